@@ -8,12 +8,10 @@ st.set_page_config(
     layout="wide"
 )
 
-# Resto de imports después de set_page_config
+# Resto de imports después de set_page_config. Las páginas (y sus dependencias
+# pesadas: plotly, matplotlib, echarts, conexiones) se importan al seleccionarlas
 from streamlit_option_menu import option_menu
-from Tar_Graf.corba_carrega import mostrar_corba_carrega
-from tar_elec.tarifes_electricas import mostrar_tarifes_electricas
-from tar_gas.tarifes_gas import mostrar_tarifes_gas
-from ranking_energetica import mostrar_ranking_energetico  # Nueva importación
+from carga_paginas import PAGINAS, cargar_pagina, informe_importacion
 from verificar_db import verificar_y_corregir_bd  # Aquí se importa verificar_db.py
 
 # Ahora verificamos la base de datos después de set_page_config
@@ -26,17 +24,17 @@ with st.sidebar:
     
     selected = option_menu(
         menu_title=None,
-        options=["Tarifes Elèctriques", "Corba de Càrrega", "Tarifes Gas", "Ranking Energètic"],  # Añadida nueva opción
-        icons=["lightning-charge", "graph-up", "fire", "trophy"],  # Añadido icono de trofeo
+        options=list(PAGINAS),
+        icons=["lightning-charge", "graph-up", "fire", "trophy"],
         default_index=0,
     )
 
-# Navegación principal
-if selected == "Tarifes Elèctriques":
-    mostrar_tarifes_electricas()
-elif selected == "Corba de Càrrega":
-    mostrar_corba_carrega()
-elif selected == "Ranking Energètic":  # Nueva condición
-    mostrar_ranking_energetico()
-else:
-    mostrar_tarifes_gas()
+# Navegación principal: solo se importa la página seleccionada
+mostrar_pagina = cargar_pagina(selected)
+
+# Informe del coste de importación de las páginas cargadas en este proceso
+with st.sidebar.expander("⏱️ Càrrega de pàgines"):
+    for opcion, informe in informe_importacion().items():
+        st.caption(f"{opcion}: {informe['segundos'] * 1000:.0f} ms, {informe['modulos_nuevos']} mòduls")
+
+mostrar_pagina()
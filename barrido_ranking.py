@@ -0,0 +1,173 @@
+"""
+Barrido en paralelo del ranking combinado sobre una rejilla de parámetros.
+
+Los puntos (potencia, consumo_elec, consumo_gas) se reparten en tramos entre
+procesos de un ProcessPoolExecutor. Cada proceso abre su propia conexión SQLite
+de solo lectura para cargar las tarifas y lee la curva de carga desde memoria
+compartida, de modo que la curva no se serializa por cada proceso ni tarea.
+"""
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from calendario_periodos import PERIODOS, calendario_anios
+from conexiones_bd import crear_engine_lectura
+from config import DB_PATH
+from curva_carga import CUPS_POR_DEFECTO, curvas_horarias
+from motor_ranking import cargar_tarifas_electricas, cargar_tarifas_gas, energia_por_periodo_curvas
+from precios_horarios import costes_series_curvas
+from ranking_por_lotes import COLUMNAS_SALIDA, evaluar_puntos, puntos_rejilla
+
+# Tramos por proceso: más de uno para repartir bien la carga entre procesos
+TRAMOS_POR_PROCESO = 4
+
+# Estado de cada proceso de trabajo, preparado una sola vez por _inicializar_proceso
+_ESTADO = {}
+
+
+def compartir_curvas(curvas, costes_series=None):
+    """
+    Copia los arrays de unas curvas horarias a segmentos de memoria compartida.
+    Devuelve los segmentos (que el llamante debe cerrar y liberar) y un
+    descriptor serializable con el que los procesos pueden volver a abrirlos,
+    que lleva además el coste de la primera curva en cada serie de precios
+    (costes_series de costes_series_curvas), para que los procesos no tengan
+    que leer los precios.
+    """
+    if curvas is None:
+        return [], None
+
+    segmentos = []
+    arrays = {}
+    try:
+        for clave in ('kwh', 'presente'):
+            origen = np.ascontiguousarray(curvas[clave])
+            segmento = SharedMemory(create=True, size=max(origen.nbytes, 1))
+            segmentos.append(segmento)
+            np.ndarray(origen.shape, dtype=origen.dtype, buffer=segmento.buf)[...] = origen
+            arrays[clave] = (segmento.name, origen.shape, origen.dtype.str)
+    except Exception:
+        liberar_segmentos(segmentos)
+        raise
+
+    descriptor = {
+        'cups': curvas['cups'],
+        'año_inicio': curvas['año_inicio'],
+        'año_fin': curvas['año_fin'],
+        'arrays': arrays,
+        'costes_series': {serie: float(np.atleast_1d(c)[0]) for serie, c in (costes_series or {}).items()},
+    }
+    return segmentos, descriptor
+
+
+def liberar_segmentos(segmentos):
+    """Cierra y elimina los segmentos de memoria compartida creados por este proceso"""
+    for segmento in segmentos:
+        segmento.close()
+        segmento.unlink()
+
+
+def energia_compartida(session, descriptor):
+    """
+    Abre las curvas publicadas con compartir_curvas y las reduce a energía por
+    periodo, días con datos y coste en cada serie de precios del primer punto
+    de suministro.
+    """
+    if descriptor is None:
+        return {'energia': np.zeros(len(PERIODOS)), 'dias': 0, 'costes_series': {}}
+
+    segmentos = [SharedMemory(name=nombre) for nombre, _, _ in descriptor['arrays'].values()]
+    try:
+        curvas = {
+            'cups': descriptor['cups'],
+            'año_inicio': descriptor['año_inicio'],
+            'año_fin': descriptor['año_fin'],
+        }
+        for segmento, (clave, (_, forma, dtype)) in zip(segmentos, descriptor['arrays'].items()):
+            curvas[clave] = np.ndarray(forma, dtype=np.dtype(dtype), buffer=segmento.buf)
+        lote = energia_por_periodo_curvas(session, curvas, series=())
+        # Las vistas sobre los segmentos deben soltarse antes de cerrarlos
+        del curvas
+    finally:
+        for segmento in segmentos:
+            segmento.close()
+    return {'energia': lote['energia'][0], 'dias': int(lote['dias'][0]), 'costes_series': descriptor['costes_series']}
+
+
+def _inicializar_proceso(db_path, descriptor, companias):
+    """Prepara un proceso de trabajo: energía de la curva compartida y tarifas candidatas"""
+    engine = crear_engine_lectura(db_path, pool_size=1)
+    try:
+        with Session(engine) as s:
+            _ESTADO['datos'] = energia_compartida(s, descriptor)
+            _ESTADO['matriz_elec'] = cargar_tarifas_electricas(s, companias)
+            _ESTADO['matriz_gas'] = cargar_tarifas_gas(s, companias)
+    finally:
+        engine.dispose()
+
+
+def _evaluar_tramo(puntos, discriminaciones):
+    """Evalúa en un proceso de trabajo un tramo de puntos de la rejilla"""
+    return evaluar_puntos(
+        _ESTADO['datos'], _ESTADO['matriz_elec'], _ESTADO['matriz_gas'], puntos, discriminaciones
+    )
+
+
+def dividir_en_tramos(puntos, procesos):
+    """Divide los puntos de la rejilla en tramos contiguos para repartir entre procesos"""
+    tamaño = max(1, math.ceil(len(puntos) / (procesos * TRAMOS_POR_PROCESO)))
+    return [puntos[i:i + tamaño] for i in range(0, len(puntos), tamaño)]
+
+
+def calcular_barrido(potencias, consumos_elec=None, consumos_gas=(9273.0,), companias=None,
+                     discriminaciones=("Totes",), cups=CUPS_POR_DEFECTO, db_path=DB_PATH,
+                     procesos=None):
+    """
+    Calcula el ranking combinado para todas las combinaciones de potencias y
+    consumos repartiendo la rejilla entre procesos (por defecto, uno por núcleo).
+
+    Devuelve un DataFrame con una fila por (discriminación, punto de la
+    rejilla, compañía) y las columnas de COLUMNAS_SALIDA, en el mismo orden
+    que calcular_rejilla.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    puntos = puntos_rejilla(potencias, consumos_elec, consumos_gas)
+    tramos = dividir_en_tramos(puntos, procesos)
+
+    # La curva se lee una sola vez; el calendario queda en la caché de disco
+    # para que los procesos no lo reconstruyan a la vez
+    engine = crear_engine_lectura(db_path, pool_size=1)
+    try:
+        with Session(engine) as s:
+            curvas = curvas_horarias(s, [cups])
+            costes_series = None
+            if curvas is not None:
+                calendario_anios(s, curvas['año_inicio'], curvas['año_fin'])
+                costes_series = costes_series_curvas(s, curvas)
+    finally:
+        engine.dispose()
+
+    segmentos, descriptor = compartir_curvas(curvas, costes_series)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max(1, min(procesos, len(tramos))),
+            initializer=_inicializar_proceso,
+            initargs=(db_path, descriptor, companias),
+        ) as executor:
+            resultados = executor.map(_evaluar_tramo, tramos, itertools.repeat(discriminaciones))
+            filas = [fila for tramo in resultados for fila in tramo]
+    finally:
+        liberar_segmentos(segmentos)
+
+    # Cada tramo devuelve sus filas agrupadas por discriminación
+    orden = {d: i for i, d in enumerate(dict.fromkeys(discriminaciones))}
+    df = pd.DataFrame(filas, columns=COLUMNAS_SALIDA)
+    return df.sort_values(
+        'discriminacion', key=lambda columna: columna.map(orden), kind='stable'
+    ).reset_index(drop=True)
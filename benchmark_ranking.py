@@ -0,0 +1,446 @@
+"""
+Benchmarks de los caminos críticos del ranking y del cálculo de costes.
+
+Uso:
+    python -m benchmark_ranking --companias 50 --tarifas 400 --anios 2 --festivos 14 \
+        --repeticiones 20 --salida benchmark.json
+
+Genera una base de datos sintética con el esquema de datos_energia.db (tamaño
+configurable), mide cada caso y escribe un JSON con rendimiento (llamadas/s),
+latencias p50/p95 y memoria pico (tracemalloc) por caso. Los casos de la
+página de ranking necesitan Streamlit instalado; si no se puede importar
+ranking_energetica se marcan como omitidos.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import cache_resultados
+import calendario_periodos
+import conexiones_bd
+import precios_horarios
+from cache_tarifas import invalidar_caches
+from config import DB_PATH, DB_SCHEMA, SERIE_PVPC
+from curva_carga import curva_horaria, epoch_hora_civil
+from escenarios_consumo import generar_escenarios, semanas_curva, simular_ranking
+from motor_ranking import (
+    cargar_energia_por_periodo,
+    cargar_tarifas_electricas,
+    cargar_tarifas_gas,
+    descomponer_coste_electricidad,
+    evaluar_combinaciones,
+    matriz_costes_gas
+)
+from precios_horarios import costes_series_curvas
+from ranking_por_lotes import calcular_rejilla
+from verificar_db import aplicar_migraciones
+from ventanas_coste import acumulados_curva, costes_ventanas, ventanas_moviles
+
+# Tramos estándar 2.0TD (los mismos que instala actualizar_periodos_tarifas)
+TRAMOS_2_0TD = [
+    ('laborable', 0, 8, 'valle'),
+    ('laborable', 8, 10, 'llano'),
+    ('laborable', 10, 14, 'punta'),
+    ('laborable', 14, 18, 'llano'),
+    ('laborable', 18, 22, 'punta'),
+    ('laborable', 22, 24, 'llano'),
+    ('fin_de_semana_festivo', 0, 24, 'valle'),
+]
+
+POTENCIA = 5.75
+CONSUMO_ELEC = 4232
+CONSUMO_GAS = 9273
+
+
+# ---------------------------------------------------------------------------
+# Base de datos sintética
+# ---------------------------------------------------------------------------
+
+def generar_base_datos(ruta, companias=20, tarifas=100, tarifas_gas=None, anios=1,
+                       festivos=12, año_inicio=2024, semilla=0):
+    """
+    Crea en ruta una base de datos sintética con el esquema de la aplicación:
+    tarifas eléctricas y de gas repartidas entre las compañías (una de cada
+    cinco eléctricas indexada al PVPC), una curva horaria de consumos y la
+    serie horaria de precios PVPC de los años indicados y festivos aleatorios
+    por año.
+    """
+    rng = random.Random(semilla)
+    tarifas_gas = tarifas if tarifas_gas is None else tarifas_gas
+    nombres = [f"Companyia {i:03d}" for i in range(companias)]
+
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    con = sqlite3.connect(ruta)
+    try:
+        con.executescript(DB_SCHEMA)
+        con.executemany(
+            "INSERT INTO discriminacion_horaria (dia_tipo, hora_inicio, hora_fin, periodo) VALUES (?, ?, ?, ?)",
+            TRAMOS_2_0TD
+        )
+
+        # Festivos aleatorios (formato DD/MM/YYYY)
+        filas_festivos = []
+        for año in range(año_inicio, año_inicio + anios):
+            for dia in rng.sample(range(365), min(festivos, 365)):
+                fecha = date(año, 1, 1) + timedelta(days=dia)
+                filas_festivos.append((fecha.strftime("%d/%m/%Y"), f"Festivo {dia}", 'valle'))
+        con.executemany(
+            "INSERT INTO dias_festivos (fecha, descripcion, periodo_asignado) VALUES (?, ?, ?)",
+            filas_festivos
+        )
+
+        # Tarifas eléctricas: la mitad con discriminación horaria y una de cada cinco indexada
+        filas_elec = []
+        for i in range(tarifas):
+            con_discriminacion = i % 2 == 0
+            energia = rng.uniform(0.10, 0.20)
+            indexada = i % 5 == 4
+            filas_elec.append((
+                nombres[i % companias], f"Tarifa E{i:04d}",
+                'con_discriminacion' if con_discriminacion else 'sin_discriminacion',
+                rng.uniform(20, 45), rng.uniform(0.5, 5),
+                0.0 if con_discriminacion else energia,
+                energia * 1.4 if con_discriminacion else 0.0,
+                energia if con_discriminacion else 0.0,
+                energia * 0.6 if con_discriminacion else 0.0,
+                rng.uniform(0.02, 0.03), 0.012742, rng.choice([0.0, 0.0, 0.01]),
+                SERIE_PVPC if indexada else '', rng.uniform(0.005, 0.02) if indexada else 0.0
+            ))
+        con.executemany("""
+            INSERT INTO tarifas_electricas (
+                companyia, tarifa, tipo_discriminacion,
+                termino_potencia_punta, termino_potencia_valle, termino_energia,
+                termino_energia_punta, termino_energia_plana, termino_energia_valle,
+                alquiler_contador, financiacion_bono_social, descuento,
+                serie_precios, margen_indexado
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, filas_elec)
+
+        filas_gas = [(
+            nombres[i % companias], f"Tarifa G{i:04d}",
+            rng.uniform(0.10, 0.30), rng.uniform(0.04, 0.09), rng.uniform(0.01, 0.03),
+            rng.choice([0.0, 0.0, 5.0])
+        ) for i in range(tarifas_gas)]
+        con.executemany("""
+            INSERT INTO tarifas_gas (
+                companyia, tarifa, termino_fijo, termino_energia, alquiler_contador, descuento
+            ) VALUES (?, ?, ?, ?, ?, ?)
+        """, filas_gas)
+
+        # Curva horaria con perfil diario y ruido
+        inicio = datetime(año_inicio, 1, 1)
+        n_horas = (datetime(año_inicio + anios, 1, 1) - inicio).days * 24
+        perfil = [0.2] * 7 + [0.4, 0.5, 0.4] + [0.3] * 4 + [0.4] * 4 + [0.7, 0.9, 0.8, 0.6] + [0.4, 0.3]
+        filas_consumo = []
+        filas_precios = []
+        # Generador aparte para que la curva no cambie respecto a bases sin precios
+        rng_precios = random.Random(semilla + 1)
+        for h in range(n_horas):
+            momento = inicio + timedelta(hours=h)
+            filas_consumo.append((
+                momento.strftime("%d/%m/%Y"), momento.strftime("%H:%M"),
+                round(perfil[momento.hour] * rng.uniform(0.5, 1.5), 3), 0.0,
+                epoch_hora_civil(momento)
+            ))
+            precio = 0.08 + 0.1 * perfil[momento.hour] * rng_precios.uniform(0.5, 1.5)
+            filas_precios.append((SERIE_PVPC, epoch_hora_civil(momento), round(precio, 5)))
+        con.executemany(
+            "INSERT INTO consumos (Fecha, Hora, AE_kWh, AI_kVArh, timestamp) VALUES (?, ?, ?, ?, ?)",
+            filas_consumo
+        )
+        con.executemany(
+            "INSERT INTO precios_horarios (serie, timestamp, precio) VALUES (?, ?, ?)", filas_precios
+        )
+        con.commit()
+    finally:
+        con.close()
+    return {'companias': nombres, 'tarifas': tarifas, 'tarifas_gas': tarifas_gas, 'horas': n_horas}
+
+
+# ---------------------------------------------------------------------------
+# Medición
+# ---------------------------------------------------------------------------
+
+def medir(funcion, repeticiones, preparar=None, calentamiento=1):
+    """
+    Ejecuta funcion repeticiones veces (tras unas llamadas de calentamiento) y
+    resume latencias y rendimiento. La memoria pico se mide en una llamada
+    aparte con tracemalloc para no distorsionar los tiempos.
+    """
+    for _ in range(calentamiento):
+        if preparar:
+            preparar()
+        funcion()
+
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    if preparar:
+        preparar()
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    tiempos = np.array(tiempos)
+    return {
+        'repeticiones': repeticiones,
+        'llamadas_por_s': float(repeticiones / tiempos.sum()) if tiempos.sum() > 0 else None,
+        'p50_ms': float(np.percentile(tiempos, 50) * 1000),
+        'p95_ms': float(np.percentile(tiempos, 95) * 1000),
+        'min_ms': float(tiempos.min() * 1000),
+        'max_ms': float(tiempos.max() * 1000),
+        'memoria_pico_mb': pico / 2**20,
+    }
+
+
+def casos_motor(engine, datos, repeticiones):
+    """Casos del motor vectorizado y del ranking por lotes (sin Streamlit)"""
+    companias = datos['companias']
+    with Session(engine) as s:
+        energia = cargar_energia_por_periodo(s)
+        matriz_elec = cargar_tarifas_electricas(s, companias)
+        matriz_gas = cargar_tarifas_gas(s, companias)
+        acumulados = acumulados_curva(s)
+        curva = curva_horaria(s)
+        semanas = semanas_curva(s, curva=curva)
+    partes_elec = descomponer_coste_electricidad(matriz_elec)
+    ventanas = ventanas_moviles(acumulados)
+
+    def cargar_curva():
+        with Session(engine) as s:
+            cargar_energia_por_periodo(s)
+
+    def cargar_tarifas():
+        with Session(engine) as s:
+            cargar_tarifas_electricas(s, companias)
+            cargar_tarifas_gas(s, companias)
+
+    def coste_indexado_curva():
+        precios_horarios._PRECIOS.clear()
+        with Session(engine) as s:
+            costes_series_curvas(s, curva)
+
+    def rejilla():
+        with Session(engine) as s:
+            calcular_rejilla(s, companias, [3.45, 4.6, 5.75, 6.9], None, [6000, 9273, 12000], ["Totes"])
+
+    return {
+        'cargar_energia_por_periodo': medir(cargar_curva, repeticiones),
+        'cargar_tarifas': medir(cargar_tarifas, repeticiones),
+        'evaluar_combinaciones': medir(
+            lambda: evaluar_combinaciones(
+                matriz_elec, matriz_gas, energia['energia'], energia['dias'], POTENCIA, CONSUMO_GAS
+            ),
+            repeticiones
+        ),
+        'matriz_costes_gas_1000_consumos': medir(
+            lambda: matriz_costes_gas(matriz_gas, np.linspace(0, 30000, 1000)), repeticiones
+        ),
+        'costes_ventanas_moviles': medir(
+            lambda: costes_ventanas(partes_elec, acumulados, ventanas, POTENCIA), repeticiones
+        ),
+        'costes_series_curvas_memmap': medir(coste_indexado_curva, repeticiones),
+        'simular_ranking_2000_escenarios': medir(
+            lambda: simular_ranking(
+                matriz_elec, matriz_gas, generar_escenarios(semanas, 2000, semilla=0), POTENCIA, CONSUMO_GAS
+            ),
+            repeticiones
+        ),
+        'calcular_rejilla_12_puntos': medir(rejilla, repeticiones),
+    }
+
+
+def casos_pagina(engine, datos, repeticiones):
+    """
+    Casos de la página de ranking (ranking_energetica) y de la verificación de
+    la BD al arrancar, sobre la base sintética.
+    """
+    import ranking_energetica
+    import verificar_db
+    conexiones_bd.usar_base_datos(engine.url.database)
+
+    companias = datos['companias'][:10]
+    tarifas_elec = ranking_energetica.obtener_tarifas_electricidad_por_compania(companias[0])
+    tarifas_gas = ranking_energetica.obtener_tarifas_gas_por_compania(companias[0])
+
+    def verificar():
+        verificar_db._DB_VERIFICADA = False
+        verificar_db.verificar_y_corregir_bd()
+
+    return {
+        'calcular_ranking_combinado': medir(
+            lambda: ranking_energetica.calcular_ranking_combinado(
+                companias + ["Tarifa Referencia"], CONSUMO_ELEC, CONSUMO_GAS, POTENCIA
+            ),
+            repeticiones
+        ),
+        'calcular_ranking_combinado_sin_cache': medir(
+            lambda: ranking_energetica.calcular_ranking_combinado_sin_cache(
+                companias + ["Tarifa Referencia"], CONSUMO_ELEC, CONSUMO_GAS, POTENCIA
+            ),
+            repeticiones
+        ),
+        'calcular_ranking_sin_cache_en_frio': medir(
+            lambda: ranking_energetica.calcular_ranking_combinado_sin_cache(
+                companias + ["Tarifa Referencia"], CONSUMO_ELEC, CONSUMO_GAS, POTENCIA
+            ),
+            repeticiones, preparar=invalidar_caches
+        ),
+        # Con 10 compañías hilos_ranking no llega al umbral: debe costar lo mismo que el secuencial
+        'calcular_ranking_4_hilos_sin_cache_en_frio': medir(
+            lambda: ranking_energetica.calcular_ranking_combinado_sin_cache(
+                companias + ["Tarifa Referencia"], CONSUMO_ELEC, CONSUMO_GAS, POTENCIA, hilos=4
+            ),
+            repeticiones, preparar=invalidar_caches
+        ),
+        'calcular_ranking_top_5_sin_cache': medir(
+            lambda: ranking_energetica.calcular_ranking_combinado_sin_cache(
+                companias + ["Tarifa Referencia"], CONSUMO_ELEC, CONSUMO_GAS, POTENCIA, top_k=5
+            ),
+            repeticiones
+        ),
+        'procesar_mejor_tarifa_electrica': medir(
+            lambda: ranking_energetica.procesar_mejor_tarifa_electrica(tarifas_elec, POTENCIA),
+            repeticiones
+        ),
+        'procesar_mejor_tarifa_gas': medir(
+            lambda: ranking_energetica.procesar_mejor_tarifa_gas(tarifas_gas, CONSUMO_GAS),
+            repeticiones
+        ),
+        'crear_tarifa_referencia': medir(
+            lambda: ranking_energetica.crear_tarifa_referencia('electricidad', POTENCIA),
+            repeticiones
+        ),
+        'verificar_y_corregir_bd': medir(verificar, repeticiones),
+    }
+
+
+def ejecutar(args):
+    """Genera la base sintética, ejecuta todos los casos y devuelve el informe"""
+    directorio = tempfile.mkdtemp(prefix="benchmark_ranking_")
+    base = os.path.join(directorio, "base.db")
+    ruta = os.path.join(directorio, "datos_energia.db")
+    # Calendarios y resultados cacheados junto a la base sintética, no en la caché de la aplicación
+    calendario_periodos.CACHE_DIR = directorio
+    cache_resultados.CACHE_DIR = directorio
+    precios_horarios.CACHE_DIR = directorio
+
+    try:
+        inicio = time.perf_counter()
+        datos = generar_base_datos(
+            base, args.companias, args.tarifas, args.tarifas_gas, args.anios,
+            args.festivos, semilla=args.semilla
+        )
+        generacion = time.perf_counter() - inicio
+
+        # Primer arranque: migraciones sobre una copia recién generada en cada repetición
+        def copiar_base():
+            shutil.copyfile(base, ruta)
+
+        def migrar():
+            engine = create_engine(f"sqlite:///{ruta}")
+            try:
+                with Session(engine) as s:
+                    aplicar_migraciones(s)
+            finally:
+                engine.dispose()
+
+        casos = {'migraciones_primer_arranque': medir(migrar, args.repeticiones, preparar=copiar_base)}
+
+        engine = create_engine(f"sqlite:///{ruta}")
+        try:
+            casos.update(casos_motor(engine, datos, args.repeticiones))
+            try:
+                casos.update(casos_pagina(engine, datos, args.repeticiones))
+            except ImportError as e:
+                casos['pagina_ranking'] = {'omitido': f"No se puede importar la página: {e}"}
+            casos['metricas_escritura'] = conexiones_bd.metricas_escritura()
+        finally:
+            engine.dispose()
+            conexiones_bd.usar_base_datos(DB_PATH)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'entorno': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parametros': {
+            'companias': args.companias,
+            'tarifas': args.tarifas,
+            'tarifas_gas': datos['tarifas_gas'],
+            'anios': args.anios,
+            'horas_consumo': datos['horas'],
+            'festivos_por_anio': args.festivos,
+            'repeticiones': args.repeticiones,
+            'semilla': args.semilla,
+        },
+        'generacion_base_s': generacion,
+        'casos': casos,
+    }
+
+
+def crear_parser():
+    """Define los argumentos de la línea de comandos"""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark_ranking",
+        description="Mesura el rendiment del rànquing sobre una base de dades sintètica."
+    )
+    parser.add_argument('--companias', type=int, default=20, help="Número de compañías")
+    parser.add_argument('--tarifas', type=int, default=100, help="Número de tarifas eléctricas")
+    parser.add_argument('--tarifas-gas', type=int, default=None,
+                        help="Número de tarifas de gas (por defecto, igual que --tarifas)")
+    parser.add_argument('--anios', type=int, default=1, help="Años de consumos horarios")
+    parser.add_argument('--festivos', type=int, default=12, help="Festivos por año")
+    parser.add_argument('--repeticiones', type=int, default=20, help="Repeticiones por caso")
+    parser.add_argument('--semilla', type=int, default=0, help="Semilla de los datos sintéticos")
+    parser.add_argument('--salida', default=None, help="Fichero JSON de resultados (por defecto, stdout)")
+    return parser
+
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos"""
+    args = crear_parser().parse_args(argv)
+    # La salida estándar es solo el JSON: los mensajes de las migraciones y de
+    # los caminos medidos van a la salida de error
+    with contextlib.redirect_stdout(sys.stderr):
+        informe = ejecutar(args)
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + "\n")
+        print(f"Resultados escritos en {args.salida}", file=sys.stderr)
+    else:
+        print(texto)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Caché persistente de resultados completos (por ejemplo, un ranking), compartida
+entre procesos y reinicios de la aplicación.
+
+Cada resultado se guarda en una base SQLite dentro de CACHE_DIR, bajo una
+clave que es el hash de las entradas del cálculo, de la identidad de la base
+de datos y de las versiones de las tablas de las que depende: si cambian las
+tarifas o la curva, o se usa otra base, la clave cambia y el resultado
+antiguo deja de usarse (y acaba expulsado por LRU). La caché se
+acota por número de entradas y por tamaño total. Cualquier error de la caché
+se trata como un fallo: el resultado se calcula sin ella.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import CACHE_DIR
+
+# Cambiar si cambia el formato o el cálculo de los resultados: invalida las entradas antiguas
+VERSION_FORMATO = 2
+
+NOMBRE_FICHERO = 'resultados.sqlite'
+
+MAXIMO_ENTRADAS = 2000
+MAXIMO_BYTES = 64 * 2**20
+
+# Segundos durante los que no se actualiza la marca de último uso de una entrada
+# (evita una escritura en cada acierto; basta para el orden LRU)
+RESOLUCION_USO = 60
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS resultados (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL,
+    tamano INTEGER NOT NULL,
+    creado REAL NOT NULL,
+    usado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_resultados_usado ON resultados(usado);
+"""
+
+
+def clave_resultado(nombre, entradas, versiones, identidad=''):
+    """
+    Hash estable (sha256) del cálculo, sus entradas, las versiones de sus
+    tablas y la identidad de la base de datos (cache_tarifas.identidad_bd)
+    """
+    contenido = json.dumps(
+        [VERSION_FORMATO, nombre, entradas, list(versiones), identidad],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+class CacheResultados:
+    """
+    Caché LRU persistente de resultados serializables en JSON. La ruta por
+    defecto se resuelve en cada uso a partir de CACHE_DIR, de modo que varias
+    réplicas que comparten el volumen comparten también la caché.
+    """
+
+    def __init__(self, ruta=None, maximo_entradas=MAXIMO_ENTRADAS, maximo_bytes=MAXIMO_BYTES):
+        self._ruta = ruta
+        self.maximo_entradas = maximo_entradas
+        self.maximo_bytes = maximo_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self.errores = 0
+        self._preparada = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def ruta(self):
+        return self._ruta or os.path.join(CACHE_DIR, NOMBRE_FICHERO)
+
+    def _conectar(self):
+        """
+        Devuelve la conexión de este hilo a la caché, abriéndola (y creando la
+        base la primera vez en este proceso) si no existe o ha cambiado la ruta
+        """
+        ruta = self.ruta
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is not None and self._local.ruta == ruta:
+            return conexion
+        if conexion is not None:
+            conexion.close()
+            self._local.conexion = None
+
+        if self._preparada != ruta:
+            os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        conexion = sqlite3.connect(ruta, timeout=5)
+        if self._preparada != ruta:
+            conexion.execute("PRAGMA journal_mode = WAL")
+            conexion.executescript(ESQUEMA)
+            self._preparada = ruta
+        conexion.execute("PRAGMA synchronous = NORMAL")
+        self._local.conexion, self._local.ruta = conexion, ruta
+        return conexion
+
+    def _descartar_conexion(self):
+        """Cierra la conexión de este hilo tras un error (se reabrirá en el siguiente uso)"""
+        conexion = getattr(self._local, 'conexion', None)
+        self._local.conexion = None
+        if conexion is not None:
+            try:
+                conexion.close()
+            except sqlite3.Error:
+                pass
+
+    def obtener(self, clave):
+        """Devuelve el resultado guardado para la clave, o None"""
+        try:
+            conexion = self._conectar()
+            fila = conexion.execute(
+                "SELECT valor, usado FROM resultados WHERE clave = ?", (clave,)
+            ).fetchone()
+            ahora = time.time()
+            if fila is not None and ahora - fila[1] > RESOLUCION_USO:
+                with conexion:
+                    conexion.execute("UPDATE resultados SET usado = ? WHERE clave = ?", (ahora, clave))
+        except (sqlite3.Error, OSError) as e:
+            self._registrar_error(e)
+            return None
+
+        with self._lock:
+            if fila is None:
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+        return json.loads(fila[0]) if fila is not None else None
+
+    def guardar(self, clave, valor):
+        """Guarda el resultado y expulsa los menos usados si se superan los límites"""
+        texto = json.dumps(valor, ensure_ascii=False, default=float)
+        ahora = time.time()
+        try:
+            conexion = self._conectar()
+            with conexion:
+                conexion.execute(
+                    "INSERT OR REPLACE INTO resultados (clave, valor, tamano, creado, usado) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (clave, texto, len(texto.encode('utf-8')), ahora, ahora)
+                )
+                self._expulsar(conexion)
+        except (sqlite3.Error, OSError) as e:
+            self._registrar_error(e)
+
+    def _expulsar(self, conexion):
+        """Elimina las entradas menos usadas que exceden el número o el tamaño máximos"""
+        conexion.execute("""
+            DELETE FROM resultados WHERE clave IN (
+                SELECT clave FROM (
+                    SELECT clave,
+                           ROW_NUMBER() OVER (ORDER BY usado DESC) AS posicion,
+                           SUM(tamano) OVER (ORDER BY usado DESC) AS acumulado
+                    FROM resultados
+                ) WHERE posicion > ? OR acumulado > ?
+            )
+        """, (self.maximo_entradas, self.maximo_bytes))
+
+    def _registrar_error(self, error):
+        self._descartar_conexion()
+        with self._lock:
+            self.errores += 1
+        print(f"Caché de resultados no disponible: {error}")
+
+    def vaciar(self):
+        """Elimina todas las entradas"""
+        try:
+            conexion = self._conectar()
+            with conexion:
+                conexion.execute("DELETE FROM resultados")
+        except (sqlite3.Error, OSError) as e:
+            self._registrar_error(e)
+
+    def estadisticas(self):
+        """Aciertos, fallos y errores de este proceso, y entradas y bytes de la caché"""
+        entradas, tamano = 0, 0
+        try:
+            entradas, tamano = self._conectar().execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM resultados"
+            ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            self._registrar_error(e)
+        with self._lock:
+            return {
+                'ruta': self.ruta,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'errores': self.errores,
+                'entradas': entradas,
+                'bytes': tamano,
+            }
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# Tablas cuya versión mantienen los triggers de verificar_db (migraciones 5, 7 y 8)
+TABLAS_VERSIONADAS = (
+    'tarifas_electricas', 'tarifas_gas', 'consumos', 'discriminacion_horaria', 'dias_festivos',
+    'precios_horarios'
+)
+
+# Tablas de las que dependen la energía por periodo y el coste horario de la curva
+TABLAS_CURVA = ('consumos', 'discriminacion_horaria', 'dias_festivos', 'precios_horarios')
+
+# Cachés creadas en este proceso, para poder invalidarlas desde cualquier módulo
+_CACHES = []
+
+
+def version_tabla(session, tabla):
+    """Devuelve el contador de versión de la tabla (0 si aún no está versionada)"""
+    version = session.execute(
+        text("SELECT version FROM versiones_tablas WHERE tabla = :tabla"), {"tabla": tabla}
+    ).scalar()
+    return int(version or 0)
+
+
+def versiones_tablas(session, tablas):
+    """Devuelve en una consulta la tupla de versiones de varias tablas"""
+    marcadores = [f":t{i}" for i in range(len(tablas))]
+    filas = session.execute(
+        text(f"SELECT tabla, version FROM versiones_tablas WHERE tabla IN ({', '.join(marcadores)})"),
+        {f"t{i}": t for i, t in enumerate(tablas)}
+    ).fetchall()
+    versiones = dict(filas)
+    return tuple(int(versiones.get(t) or 0) for t in tablas)
+
+
+def identidad_bd(session):
+    """
+    Identidad de la base de datos de la sesión para las claves de las cachés
+    en disco: hash del uuid de identidad_bd (migración 9), de la ruta resuelta
+    del fichero y de su inodo. Una copia o una restauración de la base tiene
+    las mismas versiones de tablas, pero no la misma identidad.
+    """
+    ruta = ''
+    for _, nombre, fichero in session.execute(text("PRAGMA database_list")).fetchall():
+        if nombre == 'main':
+            ruta = os.path.realpath(fichero) if fichero else ''
+    try:
+        inodo = os.stat(ruta).st_ino if ruta else None
+    except OSError:
+        inodo = None
+    try:
+        uuid = session.execute(text("SELECT uuid FROM identidad_bd WHERE id = 1")).scalar()
+    except OperationalError:
+        # Base aún sin migrar: basta con la ruta y el inodo
+        uuid = None
+    return hashlib.sha256(f"{uuid}|{ruta}|{inodo}".encode('utf-8')).hexdigest()[:16]
+
+
+class CacheVersionada:
+    """
+    Caché LRU acotada de consultas sobre una tabla (o varias). Todas las
+    entradas dependen de la versión de las tablas: en cuanto alguna cambia
+    (cualquier INSERT, UPDATE o DELETE) la caché se vacía. Opcionalmente las
+    entradas caducan además a los ttl segundos. Es segura entre hilos
+    (sesiones de Streamlit).
+    """
+
+    def __init__(self, tablas, maximo=64, ttl=None):
+        self.tablas = (tablas,) if isinstance(tablas, str) else tuple(tablas)
+        self.maximo = maximo
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._version = None
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        _CACHES.append(self)
+
+    def obtener(self, session, clave, calcular):
+        """
+        Devuelve el valor cacheado para la clave o lo calcula con calcular().
+        Si calcular lanza una excepción no se guarda nada.
+        """
+        version = versiones_tablas(session, self.tablas)
+        ahora = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                self._entradas.clear()
+                self._version = version
+            entrada = self._entradas.get(clave)
+            if entrada is not None and (self.ttl is None or ahora - entrada[1] < self.ttl):
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+
+        valor = calcular()
+
+        with self._lock:
+            # Si la tabla ha cambiado mientras se calculaba, el valor puede estar obsoleto
+            if version == self._version:
+                self._entradas[clave] = (valor, ahora)
+                self._entradas.move_to_end(clave)
+                while len(self._entradas) > self.maximo:
+                    self._entradas.popitem(last=False)
+        return valor
+
+    def invalidar(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._entradas.clear()
+            self._version = None
+
+    def estadisticas(self):
+        """Devuelve aciertos, fallos, número de entradas y versión de las tablas"""
+        with self._lock:
+            return {
+                'tablas': self.tablas,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'entradas': len(self._entradas),
+                'version': self._version,
+            }
+
+
+def invalidar_caches(tabla=None):
+    """Vacía las cachés de la tabla indicada (o todas) tras modificarla fuera de SQLite"""
+    for cache in _CACHES:
+        if tabla is None or tabla in cache.tablas:
+            cache.invalidar()
+
+
+def estadisticas_caches():
+    """Devuelve las estadísticas de todas las cachés del proceso"""
+    return [cache.estadisticas() for cache in _CACHES]
@@ -0,0 +1,107 @@
+import os
+import hashlib
+from datetime import datetime, date
+
+import numpy as np
+from sqlalchemy import text
+
+from config import CACHE_DIR
+
+# Periodos de la discriminación horaria 2.0TD (el índice es el usado en los arrays)
+PERIODOS = ('punta', 'llano', 'valle')
+
+# Calendarios ya construidos en este proceso: (año, firma) -> array uint8
+_CALENDARIOS = {}
+
+
+def tabla_periodos(tramos):
+    """
+    Construye la tabla (tipo de día, hora) -> periodo a partir de las filas
+    (dia_tipo, hora_inicio, hora_fin, periodo) de discriminacion_horaria.
+    Fila 0: laborable, fila 1: fin de semana o festivo. Por defecto, valle.
+    """
+    tabla = np.full((2, 24), PERIODOS.index('valle'), dtype=np.uint8)
+    for dia_tipo, hora_inicio, hora_fin, periodo in tramos:
+        fila = 0 if dia_tipo == 'laborable' else 1
+        tabla[fila, int(hora_inicio):int(hora_fin)] = PERIODOS.index(periodo)
+    return tabla
+
+
+def construir_calendario(año, tramos, festivos):
+    """
+    Devuelve un array uint8 con el periodo de cada hora del año
+    (índice = día del año * 24 + hora civil).
+    """
+    inicio = date(año, 1, 1)
+    n_dias = (date(año + 1, 1, 1) - inicio).days
+
+    # Sábados y domingos
+    tipos_dia = ((np.arange(n_dias) + inicio.weekday()) % 7 >= 5).astype(np.uint8)
+
+    # Festivos del año (formato DD/MM/YYYY)
+    for fecha in festivos:
+        try:
+            dia = datetime.strptime(fecha, "%d/%m/%Y").date()
+        except (TypeError, ValueError):
+            continue
+        if dia.year == año:
+            tipos_dia[(dia - inicio).days] = 1
+
+    return tabla_periodos(tramos)[tipos_dia].ravel()
+
+
+def leer_definicion_calendario(session, año):
+    """Lee los tramos horarios y los festivos del año que definen el calendario"""
+    tramos = session.execute(text(
+        "SELECT dia_tipo, hora_inicio, hora_fin, periodo FROM discriminacion_horaria "
+        "ORDER BY dia_tipo, hora_inicio, hora_fin"
+    )).fetchall()
+    festivos = session.execute(
+        text("SELECT fecha FROM dias_festivos WHERE fecha LIKE :patron ORDER BY fecha"),
+        {"patron": f"%/{año}"}
+    ).fetchall()
+    return [tuple(t) for t in tramos], [f[0] for f in festivos]
+
+
+def firma_calendario(tramos, festivos):
+    """Huella de la definición del calendario; cambia si cambian tramos o festivos"""
+    contenido = repr((sorted(tramos), sorted(festivos))).encode('utf-8')
+    return hashlib.sha1(contenido).hexdigest()[:16]
+
+
+def obtener_calendario(session, año):
+    """
+    Devuelve el calendario de periodos del año, usando la caché en memoria y en
+    disco. Se reconstruye automáticamente cuando cambian los tramos de
+    discriminacion_horaria o los festivos de ese año.
+    """
+    tramos, festivos = leer_definicion_calendario(session, año)
+    firma = firma_calendario(tramos, festivos)
+
+    calendario = _CALENDARIOS.get((año, firma))
+    if calendario is not None:
+        return calendario
+
+    ruta = os.path.join(CACHE_DIR, f"calendario_{año}_{firma}.npy")
+    try:
+        calendario = np.load(ruta)
+    except (OSError, ValueError):
+        calendario = construir_calendario(año, tramos, festivos)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            np.save(ruta, calendario)
+        except OSError as e:
+            print(f"No se pudo guardar el calendario en caché: {e}")
+
+    # Las entradas de firmas anteriores del mismo año ya no son válidas
+    for clave in [c for c in _CALENDARIOS if c[0] == año]:
+        del _CALENDARIOS[clave]
+    _CALENDARIOS[(año, firma)] = calendario
+    return calendario
+
+
+def calendario_anios(session, año_inicio, año_fin):
+    """Concatena los calendarios de periodos de varios años consecutivos"""
+    return np.concatenate([
+        obtener_calendario(session, año) for año in range(año_inicio, año_fin + 1)
+    ])
@@ -0,0 +1,41 @@
+import importlib
+import sys
+import time
+
+# Páginas del menú: opción -> (módulo, función que la muestra)
+PAGINAS = {
+    "Tarifes Elèctriques": ("tar_elec.tarifes_electricas", "mostrar_tarifes_electricas"),
+    "Corba de Càrrega": ("Tar_Graf.corba_carrega", "mostrar_corba_carrega"),
+    "Tarifes Gas": ("tar_gas.tarifes_gas", "mostrar_tarifes_gas"),
+    "Ranking Energètic": ("ranking_energetica", "mostrar_ranking_energetico"),
+}
+
+# Coste de la primera importación de cada página en este proceso.
+# Vive en este módulo porque app.py se vuelve a ejecutar en cada rerun.
+_INFORME_IMPORTACION = {}
+
+
+def cargar_pagina(opcion):
+    """
+    Devuelve la función que muestra la página, importando su módulo (y con él
+    sus dependencias pesadas) solo la primera vez que se selecciona
+    """
+    modulo, funcion = PAGINAS[opcion]
+    if modulo not in sys.modules:
+        modulos_antes = len(sys.modules)
+        inicio = time.perf_counter()
+        importlib.import_module(modulo)
+        segundos = time.perf_counter() - inicio
+        _INFORME_IMPORTACION[opcion] = {
+            'modulo': modulo,
+            'segundos': segundos,
+            'modulos_nuevos': len(sys.modules) - modulos_antes,
+        }
+        print(f"Página '{opcion}' importada en {segundos:.3f} s "
+              f"({_INFORME_IMPORTACION[opcion]['modulos_nuevos']} módulos nuevos)")
+    return getattr(sys.modules[modulo], funcion)
+
+
+def informe_importacion():
+    """Devuelve el coste de importación de las páginas cargadas hasta ahora"""
+    return dict(_INFORME_IMPORTACION)
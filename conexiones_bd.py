@@ -0,0 +1,164 @@
+"""
+Gestión de conexiones a la base de datos SQLite.
+
+Las lecturas usan un pool de conexiones de solo lectura; las escrituras pasan
+por un único escritor serializado con un lock de proceso, que registra cuánto
+esperan. La base de datos se pone en modo WAL para que las lecturas no se
+bloqueen mientras se escribe.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+from cache_tarifas import invalidar_caches
+from config import DB_PATH
+from instrumentacion import ConexionInstrumentada
+
+# PRAGMAs aplicados a cada conexión nueva
+PRAGMAS_CONEXION = {
+    'synchronous': 'NORMAL',   # Seguro con WAL y mucho más rápido que FULL
+    'mmap_size': 256 * 2**20,  # Lecturas mapeadas en memoria (256 MB)
+    'cache_size': -64 * 2**10,  # 64 MB de caché de páginas (negativo = KiB)
+    'temp_store': 'MEMORY',
+    'busy_timeout': 10000,     # ms de espera si otro proceso tiene el bloqueo
+}
+
+# Conexiones de lectura simultáneas del pool
+TAMANO_POOL_LECTURA = 8
+
+_RUTA_BD = DB_PATH
+_ENGINES = {}
+_LOCK_ENGINES = threading.Lock()
+_LOCK_ESCRITURA = threading.Lock()
+_LOCK_METRICAS = threading.Lock()
+
+_METRICAS = {
+    'escrituras': 0,
+    'esperas': 0,
+    'espera_total_s': 0.0,
+    'espera_max_s': 0.0,
+    'errores_bloqueo': 0,
+}
+
+
+def usar_base_datos(ruta):
+    """
+    Cambia la base de datos por defecto: descarta los engines de la anterior y
+    vacía las cachés de consultas, cuyas versiones de tablas podrían coincidir
+    con las de la nueva base
+    """
+    global _RUTA_BD
+    with _LOCK_ENGINES:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+        _RUTA_BD = ruta
+    invalidar_caches()
+
+
+def aplicar_pragmas(conexion_dbapi, pragmas=PRAGMAS_CONEXION):
+    """Aplica los PRAGMAs de ajuste a una conexión sqlite3"""
+    cursor = conexion_dbapi.cursor()
+    try:
+        for nombre, valor in pragmas.items():
+            cursor.execute(f"PRAGMA {nombre} = {valor}")
+    finally:
+        cursor.close()
+
+
+def crear_engine_lectura(db_path=None, pool_size=TAMANO_POOL_LECTURA):
+    """Crea un engine con un pool de conexiones SQLite de solo lectura"""
+    uri = f"{Path(db_path or _RUTA_BD).resolve().as_uri()}?mode=ro"
+    engine = create_engine(
+        "sqlite://",
+        creator=lambda: sqlite3.connect(
+            uri, uri=True, check_same_thread=False, factory=ConexionInstrumentada
+        ),
+        poolclass=QueuePool, pool_size=pool_size, max_overflow=pool_size,
+    )
+    event.listen(engine, "connect", lambda conexion, _: aplicar_pragmas(conexion))
+    return engine
+
+
+def crear_engine_escritura(db_path=None):
+    """Crea el engine del escritor: una sola conexión, en modo WAL"""
+    engine = create_engine(
+        f"sqlite:///{db_path or _RUTA_BD}",
+        connect_args={'check_same_thread': False, 'factory': ConexionInstrumentada},
+        poolclass=QueuePool, pool_size=1, max_overflow=0,
+    )
+
+    def al_conectar(conexion, _):
+        aplicar_pragmas(conexion, {'journal_mode': 'WAL', **PRAGMAS_CONEXION})
+
+    event.listen(engine, "connect", al_conectar)
+    return engine
+
+
+def obtener_engine(tipo):
+    """Devuelve (creándolo la primera vez) el engine 'lectura' o 'escritura'"""
+    with _LOCK_ENGINES:
+        if 'escritura' not in _ENGINES:
+            # El escritor se crea primero: activa WAL antes de que lean los demás
+            _ENGINES['escritura'] = crear_engine_escritura()
+            with _ENGINES['escritura'].connect():
+                pass
+        if tipo == 'lectura' and 'lectura' not in _ENGINES:
+            _ENGINES['lectura'] = crear_engine_lectura()
+        return _ENGINES[tipo]
+
+
+@contextmanager
+def sesion_lectura():
+    """Sesión sobre una conexión del pool de solo lectura"""
+    with Session(obtener_engine('lectura')) as s:
+        yield s
+
+
+@contextmanager
+def sesion_escritura():
+    """
+    Sesión del escritor único del proceso. Espera (y mide la espera) a que
+    termine cualquier otra escritura; al salir confirma los cambios pendientes,
+    o los deshace si hay una excepción.
+    """
+    inicio = time.perf_counter()
+    with _LOCK_ESCRITURA:
+        espera = time.perf_counter() - inicio
+        with _LOCK_METRICAS:
+            _METRICAS['escrituras'] += 1
+            _METRICAS['espera_total_s'] += espera
+            _METRICAS['espera_max_s'] = max(_METRICAS['espera_max_s'], espera)
+            if espera > 0.001:
+                _METRICAS['esperas'] += 1
+
+        with Session(obtener_engine('escritura')) as s:
+            try:
+                yield s
+                s.commit()
+            except OperationalError as e:
+                s.rollback()
+                if 'locked' in str(e):
+                    with _LOCK_METRICAS:
+                        _METRICAS['errores_bloqueo'] += 1
+                raise
+            except Exception:
+                s.rollback()
+                raise
+
+
+def metricas_escritura():
+    """Devuelve las métricas de esperas del escritor en este proceso"""
+    with _LOCK_METRICAS:
+        metricas = dict(_METRICAS)
+    metricas['espera_media_s'] = (
+        metricas['espera_total_s'] / metricas['escrituras'] if metricas['escrituras'] else 0.0
+    )
+    return metricas
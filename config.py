@@ -6,17 +6,23 @@ from zoneinfo import ZoneInfo
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'datos_energia.db')
 ASSETS_PATH = os.path.join(BASE_DIR, 'assets')
+CACHE_DIR = os.path.join(BASE_DIR, '.cache')
 
 # Configuración de la base de datos
 DB_SCHEMA = """
 CREATE TABLE IF NOT EXISTS consumos (
     Id INTEGER PRIMARY KEY,
+    cups TEXT NOT NULL DEFAULT '',  -- Punto de suministro ('' = curva de la aplicación)
     Fecha TEXT,
     Hora TEXT,
     AE_kWh REAL,
-    AI_kVArh REAL
+    AI_kVArh REAL,
+    timestamp INTEGER  -- Segundos de la hora civil (Fecha + Hora) tratada como UTC
 );
 
+CREATE INDEX IF NOT EXISTS idx_consumos_timestamp ON consumos(timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_consumos_cups_timestamp ON consumos(cups, timestamp);
+
 CREATE TABLE IF NOT EXISTS tarifas_electricas (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     companyia TEXT NOT NULL,
@@ -31,16 +37,38 @@ CREATE TABLE IF NOT EXISTS tarifas_electricas (
     termino_energia_valle REAL DEFAULT 0.0,
     alquiler_contador REAL DEFAULT 0.0,
     financiacion_bono_social REAL DEFAULT 0.0,
-    descuento REAL DEFAULT 0.0,
+    descuento REAL DEFAULT 0.0,  -- €/kWh restados al precio de la energía
     parametro_adicional TEXT DEFAULT '',
     permanencia INTEGER DEFAULT 0,
     duracion_anios INTEGER DEFAULT 1,
     impuesto_electricidad REAL DEFAULT 5.113,
     iva REAL DEFAULT 21.0,
+    serie_precios TEXT DEFAULT '',  -- Tarifa indexada: serie de precios_horarios ('' = precios fijos)
+    margen_indexado REAL DEFAULT 0.0,  -- €/kWh sumados al precio horario de la serie
     fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Series horarias de precios de mercado (€/kWh) para las tarifas indexadas
+CREATE TABLE IF NOT EXISTS precios_horarios (
+    serie TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,  -- Segundos de la hora civil tratada como UTC (como consumos)
+    precio REAL NOT NULL,
+    PRIMARY KEY (serie, timestamp)
+) WITHOUT ROWID;
+
+-- Versión de las tablas de tarifas, consumos, calendario y precios, incrementada por triggers en cada cambio
+CREATE TABLE IF NOT EXISTS versiones_tablas (
+    tabla TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Identidad de la base de datos (uuid creado por la migración 9) para las claves de las cachés en disco
+CREATE TABLE IF NOT EXISTS identidad_bd (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    uuid TEXT NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS discriminacion_horaria (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     dia_tipo TEXT CHECK(dia_tipo IN ('laborable', 'fin_de_semana_festivo')),
@@ -64,7 +92,7 @@ CREATE TABLE IF NOT EXISTS tarifas_gas (
     termino_fijo REAL DEFAULT 0.0,
     termino_energia REAL DEFAULT 0.0,
     alquiler_contador REAL DEFAULT 0.0,
-    descuento REAL DEFAULT 0.0,
+    descuento REAL DEFAULT 0.0,  -- % sobre el término de energía
     impuesto_ieh REAL DEFAULT 0.00234,
     iva REAL DEFAULT 21.0,
     fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -77,6 +105,39 @@ APP_NAME = "Comparador Tarifes Elèctriques/Gas"
 APP_ICON = "⚡"
 TIMEZONE = "Europe/Madrid"
 
+# Tarifas de referencia (PVPC y TUR) con las que se compara cuando no hay
+# ninguna tarifa "(actual)" ni de referencia guardada en la base de datos.
+# Si se ha importado la serie horaria SERIE_PVPC, la referencia eléctrica usa
+# sus precios hora a hora en lugar de los tres precios por periodo.
+SERIE_PVPC = 'pvpc'
+
+TARIFA_REFERENCIA_ELECTRICIDAD = {
+    'companyia': 'Tarifa Referencia',
+    'tarifa': 'PVPC',
+    'tipo_discriminacion': 'con_discriminacion',
+    'termino_potencia_punta': 30.67,
+    'termino_potencia_valle': 1.42,
+    'termino_energia_punta': 0.16,
+    'termino_energia_plana': 0.10,
+    'termino_energia_valle': 0.08,
+    'alquiler_contador': 0.026630,
+    'financiacion_bono_social': 0.012742,
+    'descuento': 0.0,
+    'impuesto_electricidad': 5.1126963,
+    'iva': 21.0,
+}
+
+TARIFA_REFERENCIA_GAS = {
+    'companyia': 'Tarifa Referencia',
+    'tarifa': 'TUR',
+    'termino_fijo': 0.16,
+    'termino_energia': 0.05,
+    'descuento': 0.0,
+    'alquiler_contador': 0.02,
+    'impuesto_ieh': 0.00234,
+    'iva': 21.0,
+}
+
 def obtener_cambios_horario(año):
     """Retorna las fechas de cambio de horario para el año especificado"""
     # Cambio a horario de verano (último domingo de marzo)
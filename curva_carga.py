@@ -0,0 +1,123 @@
+import calendar
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+SEGUNDOS_HORA = 3600
+HORAS_DIA = 24
+
+# Punto de suministro (CUPS) de la curva anónima de la aplicación
+CUPS_POR_DEFECTO = ''
+
+
+def epoch_hora_civil(momento):
+    """Segundos de una fecha/hora civil tratada como UTC (mismo criterio que consumos.timestamp)"""
+    if not isinstance(momento, datetime):
+        momento = datetime(momento.year, momento.month, momento.day)
+    return calendar.timegm(momento.timetuple())
+
+
+def fecha_desde_epoch(segundos):
+    """Convierte un timestamp de hora civil en datetime (sin zona horaria)"""
+    return datetime(1970, 1, 1) + timedelta(seconds=int(segundos))
+
+
+def cargar_curvas(session, lista_cups, desde=None, hasta=None):
+    """
+    Carga en una sola consulta las curvas de los puntos de suministro indicados,
+    ordenadas por CUPS y timestamp, en el rango [desde, hasta) usando el índice
+    (cups, timestamp). Devuelve arrays planos de fila, timestamps y kWh.
+    """
+    marcadores = [f":s{i}" for i in range(len(lista_cups))] or ["NULL"]
+    query = f"""
+        SELECT cups, timestamp, AE_kWh FROM consumos
+        WHERE cups IN ({', '.join(marcadores)}) AND timestamp IS NOT NULL
+    """
+    params = {f"s{i}": c for i, c in enumerate(lista_cups)}
+    if desde is not None:
+        query += " AND timestamp >= :desde"
+        params['desde'] = epoch_hora_civil(desde)
+    if hasta is not None:
+        query += " AND timestamp < :hasta"
+        params['hasta'] = epoch_hora_civil(hasta)
+    query += " ORDER BY cups, timestamp"
+
+    filas = session.execute(text(query), params).fetchall()
+    posicion = {c: i for i, c in enumerate(lista_cups)}
+    return {
+        'fila': np.array([posicion[f[0]] for f in filas], dtype=np.int64),
+        'timestamp': np.array([f[1] for f in filas], dtype=np.int64),
+        'kwh': np.array([f[2] or 0.0 for f in filas], dtype=np.float64),
+    }
+
+
+def demanda_maxima(session, cups=CUPS_POR_DEFECTO, desde=None, hasta=None):
+    """
+    Devuelve el mayor consumo horario (kWh en una hora, es decir, la potencia
+    media en kW de la hora más cargada) de la curva, o 0.0 si no hay consumos.
+    """
+    query = "SELECT MAX(AE_kWh) FROM consumos WHERE cups = :cups AND timestamp IS NOT NULL"
+    params = {'cups': cups}
+    if desde is not None:
+        query += " AND timestamp >= :desde"
+        params['desde'] = epoch_hora_civil(desde)
+    if hasta is not None:
+        query += " AND timestamp < :hasta"
+        params['hasta'] = epoch_hora_civil(hasta)
+    maximo = session.execute(text(query), params).scalar()
+    return float(maximo or 0.0)
+
+
+def curvas_horarias(session, lista_cups, desde=None, hasta=None):
+    """
+    Devuelve las curvas de varios puntos de suministro como matriz contigua
+    float64 (suministros x horas), con una columna por hora civil desde el 1 de
+    enero del primer año con datos hasta el 31 de diciembre del último, de modo
+    que la columna de cada hora coincide con su índice en el calendario de
+    periodos. Devuelve None si no hay consumos.
+    """
+    curvas = cargar_curvas(session, lista_cups, desde, hasta)
+    if len(curvas['timestamp']) == 0:
+        return None
+
+    año_inicio = fecha_desde_epoch(curvas['timestamp'].min()).year
+    año_fin = fecha_desde_epoch(curvas['timestamp'].max()).year
+    n_horas = (date(año_fin + 1, 1, 1) - date(año_inicio, 1, 1)).days * HORAS_DIA
+    n_total = len(lista_cups) * n_horas
+
+    horas = (curvas['timestamp'] - epoch_hora_civil(date(año_inicio, 1, 1))) // SEGUNDOS_HORA
+    indices = curvas['fila'] * n_horas + horas
+    kwh = np.bincount(indices, weights=curvas['kwh'], minlength=n_total)
+    presente = np.bincount(indices, minlength=n_total) > 0
+
+    return {
+        'cups': list(lista_cups),
+        'año_inicio': año_inicio,
+        'año_fin': año_fin,
+        'kwh': np.ascontiguousarray(kwh.reshape(len(lista_cups), n_horas), dtype=np.float64),
+        'presente': presente.reshape(len(lista_cups), n_horas),
+    }
+
+
+def curva_horaria(session, desde=None, hasta=None, cups=CUPS_POR_DEFECTO):
+    """Igual que curvas_horarias para un único punto de suministro (arrays 1D)"""
+    curvas = curvas_horarias(session, [cups], desde, hasta)
+    if curvas is None:
+        return None
+    return {
+        'año_inicio': curvas['año_inicio'],
+        'año_fin': curvas['año_fin'],
+        'kwh': curvas['kwh'][0],
+        'presente': curvas['presente'][0],
+    }
+
+
+def dias_con_datos(curva):
+    """
+    Número de días que tienen al menos una hora de consumo en la curva
+    (un entero, o un array por suministro si la curva es una matriz)
+    """
+    presente = curva['presente']
+    dias = presente.reshape(presente.shape[:-1] + (-1, HORAS_DIA)).any(axis=-1).sum(axis=-1)
+    return int(dias) if presente.ndim == 1 else dias
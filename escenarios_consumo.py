@@ -0,0 +1,236 @@
+"""
+Escenarios de consumo para medir la robustez del ranking.
+
+A partir de la curva histórica se generan miles de años de consumo
+perturbados: se remuestrean semanas completas de la curva (con reemplazo), se
+escala el consumo total y se desplaza energía entre la punta y el valle. Cada
+escenario se reduce a su energía por periodo y su coste en cada serie de
+precios, de modo que todas las tarifas se evalúan contra todos los escenarios
+con un producto de matrices (escenarios x tarifas), por bloques para acotar
+la memoria. El resultado es, para cada compañía, la probabilidad de ser la
+más barata y los percentiles de su coste total.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+from calendario_periodos import PERIODOS, calendario_anios
+from curva_carga import CUPS_POR_DEFECTO, HORAS_DIA, curva_horaria
+from motor_ranking import (
+    DIAS_ANIO,
+    calcular_costes_gas,
+    coste_desde_partes,
+    descomponer_coste_electricidad,
+    filtrar_matriz,
+    potencia_optima_terminos,
+    terminos_electricidad
+)
+from precios_horarios import precios_completos, precios_horarios, series_precios
+from ventanas_coste import anios_contrato, sumar_meses
+
+ESCENARIOS = 2000
+SEMANAS_ANIO = 52
+DIAS_SEMANA = 7
+
+# Desviaciones por defecto: del logaritmo del factor de escala del consumo
+# eléctrico y del de gas, y de la fracción de energía desplazada entre la punta
+# y el valle
+DESVIACION_ESCALA = 0.10
+DESVIACION_GAS = 0.10
+DESVIACION_DESPLAZAMIENTO = 0.10
+
+# Escenarios evaluados a la vez: la matriz de costes ocupa bloque x tarifas
+TAMANO_BLOQUE = 256
+
+PERCENTILES = (5, 50, 95)
+
+PUNTA = PERIODOS.index('punta')
+VALLE = PERIODOS.index('valle')
+
+
+def semanas_curva(session, cups=CUPS_POR_DEFECTO, curva=None, series=None, meses=None):
+    """
+    Reduce la curva a sus semanas completas (siete días con datos, contadas
+    desde el primer día con datos): 'energia' (semanas, 3) por periodo y
+    'costes_series', {serie: (semanas, 3)} con el coste a precio de mercado de
+    cada periodo (todas las series importadas si es None). Con meses, solo
+    cuentan los días de los últimos meses de la curva (la ventana de
+    ventanas_coste.ultimos_meses). Devuelve None si no hay ninguna semana
+    completa.
+    """
+    if curva is None:
+        curva = curva_horaria(session, cups=cups)
+    if curva is None:
+        return None
+
+    n_dias = len(curva['kwh']) // HORAS_DIA
+    con_datos = curva['presente'].reshape(n_dias, HORAS_DIA).any(axis=1)
+    if meses is not None:
+        inicio = date(curva['año_inicio'], 1, 1)
+        hasta = inicio + timedelta(days=int(np.flatnonzero(con_datos)[-1]) + 1)
+        con_datos[:max((sumar_meses(hasta, -meses) - inicio).days, 0)] = False
+    primer_dia = int(np.flatnonzero(con_datos)[0])
+    n_semanas = (n_dias - primer_dia) // DIAS_SEMANA
+    completas = con_datos[primer_dia:primer_dia + n_semanas * DIAS_SEMANA].reshape(
+        n_semanas, DIAS_SEMANA
+    ).all(axis=1)
+    if not completas.any():
+        return None
+
+    # Semana de cada hora (-1 fuera de las semanas completas)
+    semana_dia = np.full(n_dias, -1, dtype=np.int64)
+    semana_dia[primer_dia:primer_dia + n_semanas * DIAS_SEMANA] = np.repeat(
+        np.where(completas, np.cumsum(completas) - 1, -1), DIAS_SEMANA
+    )
+    semana_hora = np.repeat(semana_dia, HORAS_DIA)
+    dentro = semana_hora >= 0
+    periodos = calendario_anios(session, curva['año_inicio'], curva['año_fin'])
+    celdas = semana_hora[dentro] * len(PERIODOS) + periodos[dentro]
+    forma = (int(completas.sum()), len(PERIODOS))
+
+    def por_semana(pesos):
+        return np.bincount(celdas, weights=pesos[dentro], minlength=forma[0] * forma[1]).reshape(forma)
+
+    costes_series = {}
+    for serie in (series_precios(session) if series is None else series):
+        precios = precios_completos(
+            precios_horarios(session, serie, curva['año_inicio'], curva['año_fin']), curva['kwh'] != 0, serie
+        )
+        costes_series[serie] = por_semana(curva['kwh'] * precios)
+    return {
+        'energia': por_semana(curva['kwh']),
+        'costes_series': costes_series,
+    }
+
+
+def generar_escenarios(semanas, n=ESCENARIOS, desviacion_escala=DESVIACION_ESCALA,
+                       desviacion_desplazamiento=DESVIACION_DESPLAZAMIENTO, semilla=None):
+    """
+    Genera n años de consumo a partir de las semanas de semanas_curva:
+    SEMANAS_ANIO semanas remuestreadas con reemplazo, un factor de escala
+    lognormal y una fracción normal de energía desplazada de la punta al valle
+    (o del valle a la punta si es negativa). La energía desplazada se valora,
+    en cada serie de precios, al precio medio del periodo en el escenario.
+
+    Devuelve 'energia' (n, 3), 'dias' (n,) y 'costes_series' {serie: (n,)},
+    anualizados a DIAS_ANIO días, listos para motor_ranking.
+    """
+    rng = np.random.default_rng(semilla)
+    n_semanas = len(semanas['energia'])
+    recuentos = rng.multinomial(SEMANAS_ANIO, np.full(n_semanas, 1 / n_semanas), size=n).astype(np.float64)
+    escala = rng.lognormal(0.0, desviacion_escala, size=n) * DIAS_ANIO / (SEMANAS_ANIO * DIAS_SEMANA)
+    desplazamiento = np.clip(rng.normal(0.0, desviacion_desplazamiento, size=n), -1.0, 1.0)
+
+    energia = recuentos @ semanas['energia']
+    movida = np.where(desplazamiento >= 0, desplazamiento * energia[:, PUNTA], desplazamiento * energia[:, VALLE])
+
+    costes_series = {}
+    for serie, costes in semanas['costes_series'].items():
+        costes = recuentos @ costes
+        precio_punta = np.divide(costes[:, PUNTA], energia[:, PUNTA], out=np.zeros(n), where=energia[:, PUNTA] > 0)
+        precio_valle = np.divide(costes[:, VALLE], energia[:, VALLE], out=np.zeros(n), where=energia[:, VALLE] > 0)
+        costes_series[serie] = (costes.sum(axis=1) + movida * (precio_valle - precio_punta)) * escala
+
+    energia[:, PUNTA] -= movida
+    energia[:, VALLE] += movida
+    return {
+        'energia': energia * escala[:, None],
+        'dias': np.full(n, DIAS_ANIO, dtype=np.float64),
+        'costes_series': costes_series,
+    }
+
+
+def agrupar_por_compania(matriz, companias):
+    """
+    Submatriz con las tarifas de las compañías indicadas, contiguas y en ese
+    orden, y la columna en la que empieza cada compañía (para reduceat)
+    """
+    posicion = {compania: j for j, compania in enumerate(companias)}
+    grupo = np.array([posicion.get(c, -1) for c in matriz['companyia']], dtype=np.int64)
+    columnas = np.flatnonzero(grupo >= 0)
+    columnas = columnas[np.argsort(grupo[columnas], kind='stable')]
+    inicios = np.searchsorted(grupo[columnas], np.arange(len(companias)))
+    return filtrar_matriz(matriz, columnas), inicios
+
+
+def minimos_por_bloque(costes, inicios):
+    """Coste mínimo de cada grupo de columnas contiguas (NaN solo si todo el grupo es NaN, y entonces infinito)"""
+    minimos = np.fmin.reduceat(costes, inicios, axis=1)
+    return np.where(np.isnan(minimos), np.inf, minimos)
+
+
+def simular_ranking(matriz_elec, matriz_gas, escenarios, potencia, consumo_gas,
+                    desviacion_gas=DESVIACION_GAS, percentiles=PERCENTILES, semilla=None,
+                    tamano_bloque=TAMANO_BLOQUE, potencia_minima=None, paso_potencia=None,
+                    por_contrato=False):
+    """
+    Evalúa todas las tarifas contra todos los escenarios (por bloques de
+    tamano_bloque) con el consumo de gas escalado por un factor lognormal
+    propio. Para cada compañía que ofrece ambos servicios devuelve la
+    probabilidad de ser la más barata, el coste total medio y sus percentiles,
+    junto con el número de escenarios evaluados.
+
+    Como en el ranking, con potencia_minima cada tarifa se evalúa a su potencia
+    óptima (ver motor_ranking.potencia_optima_terminos). Con por_contrato,
+    escenarios es un dict {años: escenarios}, todos con el mismo número de
+    escenarios, y cada tarifa se evalúa en los de su plazo de contrato (ver
+    ventanas_coste.anios_contrato).
+    """
+    # Solo compiten las compañías que ofrecen ambos servicios (como en evaluar_combinaciones)
+    companias = sorted(set(matriz_elec['companyia']) & set(matriz_gas['companyia']))
+    if not companias:
+        return {'companias': [], 'escenarios': 0}
+
+    rng = np.random.default_rng(semilla)
+    n = len(next(iter(escenarios.values()))['dias'] if por_contrato else escenarios['dias'])
+    consumos_gas = consumo_gas * rng.lognormal(0.0, desviacion_gas, size=n)
+    matriz_elec, inicios_elec = agrupar_por_compania(matriz_elec, companias)
+    matriz_gas, inicios_gas = agrupar_por_compania(matriz_gas, companias)
+    partes = descomponer_coste_electricidad(matriz_elec)
+    potencias = np.full(len(matriz_elec['id']), potencia, dtype=np.float64)
+    if potencia_minima is not None:
+        # La potencia óptima solo depende del signo del término de potencia, no del consumo
+        potencias, _ = potencia_optima_terminos(
+            terminos_electricidad(partes, np.zeros(len(PERIODOS)), DIAS_ANIO), potencia_minima, paso=paso_potencia
+        )
+
+    # Tarifas que se evalúan en cada conjunto de escenarios, con sus partes y potencias
+    if por_contrato:
+        anios = anios_contrato(matriz_elec)
+        grupos = [(np.flatnonzero(anios == plazo), escenarios[plazo]) for plazo in np.unique(anios)]
+    else:
+        grupos = [(np.arange(len(potencias)), escenarios)]
+    grupos = [
+        (columnas, {clave: valor[columnas] for clave, valor in partes.items()}, potencias[columnas][None, :],
+         escenarios_grupo)
+        for columnas, escenarios_grupo in grupos
+    ]
+
+    costes = np.empty((n, len(companias)))
+    for inicio in range(0, n, tamano_bloque):
+        bloque = slice(inicio, min(inicio + tamano_bloque, n))
+        costes_elec = np.empty((bloque.stop - bloque.start, len(potencias)))
+        for columnas, partes_grupo, potencias_grupo, escenarios_grupo in grupos:
+            costes_elec[:, columnas] = coste_desde_partes(
+                partes_grupo, escenarios_grupo['energia'][bloque], escenarios_grupo['dias'][bloque],
+                potencias_grupo, {serie: c[bloque] for serie, c in escenarios_grupo['costes_series'].items()}
+            )
+        costes_gas = calcular_costes_gas(matriz_gas, consumos_gas[bloque])
+        costes[bloque] = minimos_por_bloque(costes_elec, inicios_elec) + minimos_por_bloque(costes_gas, inicios_gas)
+
+    # Escenarios en los que alguna compañía tiene coste finito; gana la primera más barata.
+    # Las estadísticas de coste solo se dan para compañías con coste finito en todos.
+    validos = np.isfinite(costes).any(axis=1)
+    ganadoras = costes[validos].argmin(axis=1)
+    finitas = np.isfinite(costes).all(axis=0)
+    media = np.full(len(companias), np.nan)
+    media[finitas] = costes[:, finitas].mean(axis=0)
+    valores = np.full((len(percentiles), len(companias)), np.nan)
+    valores[:, finitas] = np.percentile(costes[:, finitas], percentiles, axis=0)
+    return {
+        'companias': companias,
+        'escenarios': int(validos.sum()),
+        'probabilidad_ganar': np.bincount(ganadoras, minlength=len(companias)) / max(int(validos.sum()), 1),
+        'media': media,
+        'percentiles': dict(zip(percentiles, valores)),
+    }
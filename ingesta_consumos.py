@@ -0,0 +1,271 @@
+"""
+Ingesta de curvas de carga en consumos desde exportaciones CSV de distribuidoras.
+
+Uso:
+    python -m ingesta_consumos curva_2023.csv curva_2024.csv --cups ES0031000000000000XX
+
+Cada fichero se lee en streaming y se inserta por lotes (executemany) en una
+única transacción. Se aceptan separador ';' o ',', coma decimal, fechas
+DD/MM/YYYY o YYYY-MM-DD y horas 'HH:MM' o numeradas 1..24 (23 o 25 en los días
+de cambio de horario). Como en las filas de consumos, cada hora se identifica
+por su hora civil de fin: '01:00' es la primera del día y la última es '24:00'
+o '00:00' del día siguiente, que es como se guarda. Las filas de una misma hora
+civil se suman (la hora repetida del día de 25 horas) y, si la hora ya estaba
+en la base de datos, se sustituye, de modo que reimportar un fichero no duplica
+consumos. Se espera el orden de las exportaciones: por CUPS y fecha.
+"""
+import argparse
+import calendar
+import csv
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from config import DB_PATH, get_horas_del_dia
+from curva_carga import CUPS_POR_DEFECTO, SEGUNDOS_HORA
+from verificar_db import aplicar_migraciones, crear_triggers_version, suspender_triggers_version
+
+# Filas que se acumulan antes de escribir un lote
+TAMANO_LOTE = 50000
+
+# Máximo de días anómalos que se detallan en el resumen
+MAX_DIAS_ANOMALOS = 100
+
+# Nombres de columna aceptados (en minúsculas) para cada campo
+ALIAS_COLUMNAS = {
+    'cups': ('cups',),
+    'fecha': ('fecha', 'date'),
+    'hora': ('hora', 'hour'),
+    'ae_kwh': ('ae_kwh', 'consumo_kwh', 'consumo', 'ae'),
+    'ai_kvarh': ('ai_kvarh', 'ai'),
+}
+
+FORMATOS_FECHA = ("%d/%m/%Y", "%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y")
+
+SQL_INSERTAR = """
+    INSERT INTO consumos (cups, Fecha, Hora, AE_kWh, AI_kVArh, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(cups, timestamp) DO UPDATE SET
+        Fecha = excluded.Fecha,
+        Hora = excluded.Hora,
+        AE_kWh = excluded.AE_kWh,
+        AI_kVArh = excluded.AI_kVArh
+"""
+
+
+def leer_fecha(valor):
+    """Interpreta una fecha en cualquiera de los formatos habituales de las distribuidoras"""
+    valor = valor.strip()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha no reconocida: {valor!r}")
+
+
+def leer_numero(valor):
+    """Convierte un número con coma o punto decimal (vacío = 0)"""
+    valor = valor.strip().replace(',', '.')
+    return float(valor) if valor else 0.0
+
+
+def hora_civil(valor, horas_dia):
+    """
+    Devuelve la hora civil de fin (0-24) de una lectura, el criterio de las
+    filas de consumos. 'HH:MM' ya es la hora civil de fin ('00:00' devuelve 0:
+    la última hora del día anterior); un número 1..horas_dia es la hora de la
+    distribuidora, que en el día de 23 horas salta la que acaba a las 03:00 y
+    en el de 25 la repite.
+    """
+    valor = valor.strip()
+    if ':' in valor:
+        hora = int(valor.split(':')[0])
+        if not 0 <= hora <= 24:
+            raise ValueError(f"Hora fuera de rango: {valor!r}")
+        return hora
+
+    numero = int(float(valor.replace(',', '.')))
+    if not 1 <= numero <= horas_dia:
+        raise ValueError(f"Hora {numero} fuera de rango en un día de {horas_dia} horas")
+    if horas_dia == 23:
+        return numero if numero <= 2 else numero + 1
+    if horas_dia == 25:
+        return numero if numero <= 3 else numero - 1
+    return numero
+
+
+def indices_columnas(cabecera, alias_columnas=ALIAS_COLUMNAS, obligatorias=('fecha', 'hora', 'ae_kwh')):
+    """Localiza cada campo en la cabecera del CSV según sus alias (por defecto, ALIAS_COLUMNAS)"""
+    nombres = [c.strip().lower() for c in cabecera]
+    indices = {}
+    for campo, alias in alias_columnas.items():
+        for nombre in alias:
+            if nombre in nombres:
+                indices[campo] = nombres.index(nombre)
+                break
+    faltan = [c for c in obligatorias if c not in indices]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el CSV: {', '.join(faltan)}")
+    return indices
+
+
+def abrir_lector(fichero):
+    """Lee la cabecera y devuelve sus columnas y un lector CSV con el separador deducido"""
+    primera = fichero.readline()
+    separador = ';' if primera.count(';') >= primera.count(',') else ','
+    cabecera = next(csv.reader([primera], delimiter=separador), [])
+    return cabecera, csv.reader(fichero, delimiter=separador)
+
+
+def ingerir_csv(session, ruta, cups=CUPS_POR_DEFECTO, tamano_lote=TAMANO_LOTE, encoding='utf-8-sig'):
+    """
+    Ingresa un CSV de curva de carga en consumos en una única transacción y
+    devuelve un resumen (filas leídas, escritas, inválidas y días cuyo número
+    de horas no coincide con config.get_horas_del_dia).
+
+    La memoria usada no depende del tamaño del fichero: solo se retiene el lote
+    en curso y el día que se está leyendo. La versión de consumos se incrementa
+    una sola vez por fichero, no en cada fila (ver suspender_triggers_version).
+    """
+    resumen = {
+        'fichero': ruta,
+        'filas_leidas': 0,
+        'filas_escritas': 0,
+        'filas_invalidas': 0,
+        'dias': 0,
+        'dias_anomalos': 0,
+        'detalle_dias_anomalos': [],
+    }
+    lote = []
+    dia_actual = None
+    horas_dia_actual = {}
+
+    def cerrar_dia():
+        """Valida el día leído y pasa sus horas (ya agregadas) al lote"""
+        if dia_actual is None:
+            return
+        cups_dia, fecha = dia_actual
+        resumen['dias'] += 1
+        esperadas = get_horas_del_dia(fecha)
+        # El día de 25 horas repite una hora civil: tiene 24 horas distintas
+        if len(horas_dia_actual) != min(esperadas, 24):
+            resumen['dias_anomalos'] += 1
+            if len(resumen['detalle_dias_anomalos']) < MAX_DIAS_ANOMALOS:
+                resumen['detalle_dias_anomalos'].append({
+                    'cups': cups_dia, 'fecha': fecha.strftime("%d/%m/%Y"),
+                    'horas': len(horas_dia_actual), 'esperadas': esperadas,
+                })
+        inicio_dia = calendar.timegm(fecha.timetuple())
+        texto_fecha = fecha.strftime("%d/%m/%Y")
+        texto_siguiente = (fecha + timedelta(days=1)).strftime("%d/%m/%Y")
+        for hora, (ae, ai) in horas_dia_actual.items():
+            # La hora que acaba a las 24:00 se guarda como las '00:00' del día siguiente
+            lote.append((cups_dia, texto_siguiente if hora == 24 else texto_fecha, f"{hora % 24:02d}:00",
+                         ae, ai, inicio_dia + hora * SEGUNDOS_HORA))
+
+    def escribir_lote():
+        if lote:
+            session.connection().exec_driver_sql(SQL_INSERTAR, lote)
+            resumen['filas_escritas'] += len(lote)
+            lote.clear()
+
+    try:
+        suspender_triggers_version(session, 'consumos')
+        with open(ruta, newline='', encoding=encoding) as fichero:
+            cabecera, lector = abrir_lector(fichero)
+            columnas = indices_columnas(cabecera)
+            # La fecha se repite en todas las horas del día: se interpreta una vez
+            texto_fecha_previa, fecha, horas_dia = None, None, 24
+
+            for fila in lector:
+                if not fila or not any(c.strip() for c in fila):
+                    continue
+                resumen['filas_leidas'] += 1
+                try:
+                    cups_fila = fila[columnas['cups']].strip() if 'cups' in columnas else cups
+                    texto_fecha = fila[columnas['fecha']]
+                    if texto_fecha != texto_fecha_previa:
+                        texto_fecha_previa = None
+                        fecha = leer_fecha(texto_fecha)
+                        horas_dia = get_horas_del_dia(fecha)
+                        texto_fecha_previa = texto_fecha
+                    hora = hora_civil(fila[columnas['hora']], horas_dia)
+                    ae = leer_numero(fila[columnas['ae_kwh']])
+                    ai = leer_numero(fila[columnas['ai_kvarh']]) if 'ai_kvarh' in columnas else 0.0
+                except (ValueError, IndexError):
+                    resumen['filas_invalidas'] += 1
+                    continue
+
+                if (cups_fila, fecha) != dia_actual:
+                    cerrar_dia()
+                    if len(lote) >= tamano_lote:
+                        escribir_lote()
+                    dia_actual = (cups_fila, fecha)
+                    horas_dia_actual = {}
+
+                # Las lecturas de una misma hora civil (hora repetida) se suman
+                previo = horas_dia_actual.get(hora)
+                horas_dia_actual[hora] = (ae, ai) if previo is None else (previo[0] + ae, previo[1] + ai)
+
+            cerrar_dia()
+            escribir_lote()
+        crear_triggers_version(session, ('consumos',))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return resumen
+
+
+def crear_parser():
+    """Define los argumentos de la línea de comandos"""
+    parser = argparse.ArgumentParser(
+        prog="python -m ingesta_consumos",
+        description="Importa corbes de càrrega (CSV de distribuïdora) a la taula consumos."
+    )
+    parser.add_argument('ficheros', nargs='+', help="Ficheros CSV a importar")
+    parser.add_argument('--db', default=DB_PATH, help="Ruta de la base de datos SQLite")
+    parser.add_argument('--cups', default=CUPS_POR_DEFECTO,
+                        help="CUPS de las filas si el CSV no tiene columna CUPS")
+    parser.add_argument('--tamano-lote', type=int, default=TAMANO_LOTE,
+                        help="Filas por lote de inserción")
+    parser.add_argument('--encoding', default='utf-8-sig', help="Codificación de los ficheros")
+    return parser
+
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos"""
+    args = crear_parser().parse_args(argv)
+    engine = create_engine(f"sqlite:///{args.db}")
+    codigo = 0
+    try:
+        with Session(engine) as s:
+            aplicar_migraciones(s)
+            for ruta in args.ficheros:
+                inicio = time.perf_counter()
+                try:
+                    resumen = ingerir_csv(s, ruta, args.cups, args.tamano_lote, args.encoding)
+                except Exception as e:
+                    print(f"Error al importar {ruta}: {e}", file=sys.stderr)
+                    codigo = 1
+                    continue
+                segundos = time.perf_counter() - inicio
+                print(f"{ruta}: {resumen['filas_leidas']} filas leídas, "
+                      f"{resumen['filas_escritas']} horas escritas, "
+                      f"{resumen['filas_invalidas']} inválidas, "
+                      f"{resumen['dias_anomalos']} de {resumen['dias']} días con horas incompletas "
+                      f"({resumen['filas_leidas'] / max(segundos, 1e-9):.0f} filas/s)")
+                for dia in resumen['detalle_dias_anomalos'][:10]:
+                    print(f"  {dia['cups'] or '(sin CUPS)'} {dia['fecha']}: "
+                          f"{dia['horas']} horas de {dia['esperadas']}")
+    finally:
+        engine.dispose()
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Instrumentación opcional de las peticiones de la aplicación.
+
+Una petición (por ejemplo, un ranking) se mide con medir_peticion; dentro, cada
+etapa se cronometra con etapa(). Las conexiones SQLite creadas con
+ConexionInstrumentada cuentan las consultas, las filas leídas y el tiempo en
+la base de datos de la petición en curso. Al terminar se emite una línea JSON
+en el logger 'comparador.rendimiento' y, si se pide, un perfil cProfile (o
+pyinstrument, si está instalado) de la petición.
+
+Sin una petición activa, etapa() y los cursores solo consultan una variable de
+contexto: la instrumentación no cuesta nada cuando está desactivada.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Variable de entorno que activa la instrumentación de todas las peticiones
+VARIABLE_ENTORNO = 'COMPARADOR_INSTRUMENTACION'
+
+# Funciones del perfil cProfile que se muestran
+LINEAS_PERFIL = 30
+
+LOGGER = logging.getLogger('comparador.rendimiento')
+if not LOGGER.handlers:
+    # Sin configuración de logging de la aplicación, los informes salen por stderr
+    _manejador = logging.StreamHandler()
+    _manejador.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+    LOGGER.addHandler(_manejador)
+    LOGGER.setLevel(logging.INFO)
+
+_MEDICION = contextvars.ContextVar('medicion', default=None)
+
+
+def instrumentacion_global():
+    """Indica si la instrumentación está activada para todas las peticiones (variable de entorno)"""
+    return os.environ.get(VARIABLE_ENTORNO, '').lower() in ('1', 'true', 'si', 'sí')
+
+
+class Medicion:
+    """
+    Tiempos por etapa y actividad de la base de datos de una petición. Los
+    hilos de una petición concurrente comparten su medición: los contadores
+    se actualizan bajo un lock.
+    """
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.total_s = None
+        self.etapas = {}
+        self.consultas = 0
+        self.filas = 0
+        self.tiempo_bd_s = 0.0
+        self.perfil = None
+        self._lock = threading.Lock()
+
+    def sumar_etapa(self, nombre, segundos):
+        with self._lock:
+            self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+
+    def sumar_bd(self, consultas=0, filas=0, segundos=0.0):
+        with self._lock:
+            self.consultas += consultas
+            self.filas += filas
+            self.tiempo_bd_s += segundos
+
+    def informe(self):
+        """Resumen serializable de la medición"""
+        with self._lock:
+            return {
+                'peticion': self.nombre,
+                'total_ms': round((self.total_s or 0.0) * 1000, 3),
+                'etapas_ms': {nombre: round(s * 1000, 3) for nombre, s in self.etapas.items()},
+                'consultas': self.consultas,
+                'filas': self.filas,
+                'bd_ms': round(self.tiempo_bd_s * 1000, 3),
+            }
+
+
+def _perfilador():
+    """Perfilador de pyinstrument si está instalado; si no, cProfile"""
+    try:
+        from pyinstrument import Profiler
+        return Profiler()
+    except ImportError:
+        return cProfile.Profile()
+
+
+def _texto_perfil(perfilador):
+    """Texto del perfil de una petición (pyinstrument o las funciones más costosas de cProfile)"""
+    if isinstance(perfilador, cProfile.Profile):
+        salida = io.StringIO()
+        pstats.Stats(perfilador, stream=salida).sort_stats('cumulative').print_stats(LINEAS_PERFIL)
+        return salida.getvalue()
+    return perfilador.output_text(unicode=True, color=False)
+
+
+@contextmanager
+def medir_peticion(nombre, activa=True, perfilar=False):
+    """
+    Mide la petición: devuelve la Medicion (o None si no está activa) y, al
+    terminar, registra su informe en el log. Con perfilar, guarda además en
+    medicion.perfil el perfil de la petición.
+    """
+    if not activa:
+        yield None
+        return
+
+    medicion = Medicion(nombre)
+    token = _MEDICION.set(medicion)
+    perfilador = _perfilador() if perfilar else None
+    if isinstance(perfilador, cProfile.Profile):
+        perfilador.enable()
+    elif perfilador is not None:
+        perfilador.start()
+    try:
+        yield medicion
+    finally:
+        if isinstance(perfilador, cProfile.Profile):
+            perfilador.disable()
+        elif perfilador is not None:
+            perfilador.stop()
+        if perfilador is not None:
+            medicion.perfil = _texto_perfil(perfilador)
+        medicion.total_s = time.perf_counter() - medicion.inicio
+        _MEDICION.reset(token)
+        LOGGER.info(json.dumps(medicion.informe(), ensure_ascii=False))
+
+
+@contextmanager
+def etapa(nombre):
+    """Cronometra una etapa de la petición en curso (no hace nada si no se mide)"""
+    medicion = _MEDICION.get()
+    if medicion is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicion.sumar_etapa(nombre, time.perf_counter() - inicio)
+
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """Cursor que suma consultas, filas leídas y tiempo a la medición en curso"""
+
+    def _medir(self, metodo, *args):
+        medicion = _MEDICION.get()
+        if medicion is None:
+            return metodo(*args)
+        inicio = time.perf_counter()
+        try:
+            return metodo(*args)
+        finally:
+            medicion.sumar_bd(segundos=time.perf_counter() - inicio)
+
+    def execute(self, *args):
+        medicion = _MEDICION.get()
+        if medicion is not None:
+            medicion.sumar_bd(consultas=1)
+        return self._medir(super().execute, *args)
+
+    def executemany(self, *args):
+        medicion = _MEDICION.get()
+        if medicion is not None:
+            medicion.sumar_bd(consultas=1)
+        return self._medir(super().executemany, *args)
+
+    def fetchone(self):
+        fila = self._medir(super().fetchone)
+        medicion = _MEDICION.get()
+        if medicion is not None and fila is not None:
+            medicion.sumar_bd(filas=1)
+        return fila
+
+    def fetchmany(self, *args):
+        filas = self._medir(super().fetchmany, *args)
+        medicion = _MEDICION.get()
+        if medicion is not None:
+            medicion.sumar_bd(filas=len(filas))
+        return filas
+
+    def fetchall(self):
+        filas = self._medir(super().fetchall)
+        medicion = _MEDICION.get()
+        if medicion is not None:
+            medicion.sumar_bd(filas=len(filas))
+        return filas
+
+
+class ConexionInstrumentada(sqlite3.Connection):
+    """Conexión sqlite3 cuyos cursores son CursorInstrumentado (usar como factory de connect)"""
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
@@ -0,0 +1,572 @@
+import heapq
+import math
+
+import numpy as np
+from sqlalchemy import text
+
+from calendario_periodos import PERIODOS, calendario_anios
+from curva_carga import CUPS_POR_DEFECTO, curvas_horarias, dias_con_datos
+from precios_horarios import costes_series_curvas
+
+DIAS_ANIO = 365
+
+# Potencia contratada máxima de la tarifa de acceso 2.0TD (kW)
+POTENCIA_MAXIMA = 15.0
+
+# Filtros de discriminación tal como llegan desde la interfaz
+FILTROS_DISCRIMINACION = {
+    "Amb discriminació": 'con_discriminacion',
+    "Sense discriminació": 'sin_discriminacion',
+}
+
+# Columnas numéricas que forman la matriz de tarifas eléctricas
+COLUMNAS_ELECTRICIDAD = (
+    'termino_potencia_punta',
+    'termino_potencia_valle',
+    'termino_energia',
+    'termino_energia_punta',
+    'termino_energia_plana',
+    'termino_energia_valle',
+    'alquiler_contador',
+    'financiacion_bono_social',
+    'descuento',
+    'impuesto_electricidad',
+    'iva',
+    'permanencia',
+    'duracion_anios',
+    'margen_indexado',
+)
+
+# serie_precios no vacía marca una tarifa indexada (ver precios_horarios)
+COLUMNAS_TEXTO_ELECTRICIDAD = ('companyia', 'tarifa', 'tipo_discriminacion', 'serie_precios')
+
+# Columnas numéricas que forman la matriz de tarifas de gas
+COLUMNAS_GAS = (
+    'termino_fijo',
+    'termino_energia',
+    'alquiler_contador',
+    'descuento',
+    'impuesto_ieh',
+    'iva',
+)
+
+COLUMNAS_TEXTO_GAS = ('companyia', 'tarifa')
+
+
+def matriz_desde_registros(registros, columnas=COLUMNAS_ELECTRICIDAD,
+                           columnas_texto=COLUMNAS_TEXTO_ELECTRICIDAD):
+    """Convierte una lista de tarifas (diccionarios) en una matriz de tarifas columnar"""
+    matriz = {
+        'id': np.array([r.get('id') or 0 for r in registros], dtype=np.int64)
+    }
+    for columna in columnas_texto:
+        matriz[columna] = np.array([r.get(columna) or '' for r in registros], dtype=object)
+    for columna in columnas:
+        matriz[columna] = np.array([r.get(columna) or 0.0 for r in registros], dtype=np.float64)
+    return matriz
+
+
+def cargar_matriz_tarifas(session, tabla, columnas, columnas_texto, companias=None, ids=None, filtros=None):
+    """
+    Carga con una sola consulta las tarifas de la tabla indicada y las devuelve
+    como matriz de tarifas (diccionario de arrays NumPy, una entrada por columna).
+    """
+    seleccion = ", ".join(
+        ["id"] + list(columnas_texto)
+        + [f"COALESCE({c}, 0.0) AS {c}" for c in columnas]
+    )
+    query = f"SELECT {seleccion} FROM {tabla} WHERE 1 = 1"
+    params = {}
+
+    if companias is not None:
+        marcadores = [f":c{i}" for i in range(len(companias))] or ["NULL"]
+        query += f" AND companyia IN ({', '.join(marcadores)})"
+        params.update({f"c{i}": c for i, c in enumerate(companias)})
+
+    if ids is not None:
+        marcadores = [f":i{i}" for i in range(len(ids))] or ["NULL"]
+        query += f" AND id IN ({', '.join(marcadores)})"
+        params.update({f"i{i}": v for i, v in enumerate(ids)})
+
+    for columna, valor in (filtros or {}).items():
+        query += f" AND {columna} = :f_{columna}"
+        params[f"f_{columna}"] = valor
+
+    query += " ORDER BY id"
+    filas = session.execute(text(query), params).fetchall()
+    return matriz_desde_registros([dict(f._mapping) for f in filas], columnas, columnas_texto)
+
+
+def cargar_tarifas_electricas(session, companias=None, tipo_discriminacion="Totes", ids=None):
+    """Carga las tarifas eléctricas candidatas como matriz de tarifas"""
+    filtros = {}
+    if tipo_discriminacion in FILTROS_DISCRIMINACION:
+        filtros['tipo_discriminacion'] = FILTROS_DISCRIMINACION[tipo_discriminacion]
+    return cargar_matriz_tarifas(
+        session, 'tarifas_electricas', COLUMNAS_ELECTRICIDAD, COLUMNAS_TEXTO_ELECTRICIDAD,
+        companias, ids, filtros
+    )
+
+
+def cargar_tarifas_gas(session, companias=None, ids=None):
+    """Carga las tarifas de gas candidatas como matriz de tarifas"""
+    return cargar_matriz_tarifas(
+        session, 'tarifas_gas', COLUMNAS_GAS, COLUMNAS_TEXTO_GAS, companias, ids
+    )
+
+
+def cargar_energia_por_periodo_lote(session, lista_cups, desde=None, hasta=None):
+    """
+    Lee las curvas de carga de varios puntos de suministro y devuelve la matriz
+    (suministros x periodos) de energía junto con los días que cubre cada curva.
+    """
+    curvas = curvas_horarias(session, lista_cups, desde, hasta)
+    if curvas is None:
+        return {
+            'cups': list(lista_cups),
+            'energia': np.zeros((len(lista_cups), len(PERIODOS))),
+            'dias': np.zeros(len(lista_cups), dtype=np.int64),
+            'costes_series': {},
+        }
+    return energia_por_periodo_curvas(session, curvas)
+
+
+def energia_por_periodo_curvas(session, curvas, series=None):
+    """
+    Reduce unas curvas horarias ya cargadas (ver curvas_horarias) a la matriz
+    (suministros x periodos) de energía y los días que cubre cada curva, junto
+    con su coste a precio de mercado en cada serie de precios (suministros,),
+    todas las importadas si series es None.
+    """
+    # Periodo de cada hora a partir del calendario precalculado
+    periodos = calendario_anios(session, curvas['año_inicio'], curvas['año_fin'])
+    indicadores = np.eye(len(PERIODOS))[periodos]
+    return {
+        'cups': curvas['cups'],
+        'energia': curvas['kwh'] @ indicadores,
+        'dias': dias_con_datos(curvas),
+        'costes_series': costes_series_curvas(session, curvas, series),
+    }
+
+
+def cargar_energia_por_periodo(session, desde=None, hasta=None, cups=CUPS_POR_DEFECTO):
+    """
+    Lee la curva de carga de consumos y devuelve la energía acumulada por periodo
+    junto con el número de días que cubre y su coste en cada serie de precios.
+    """
+    lote = cargar_energia_por_periodo_lote(session, [cups], desde, hasta)
+    return {
+        'energia': lote['energia'][0],
+        'dias': int(lote['dias'][0]),
+        'costes_series': {serie: float(coste[0]) for serie, coste in lote['costes_series'].items()},
+    }
+
+
+def anualizar_consumo(datos):
+    """
+    Lleva la energía por periodo, los días y el coste indexado de una curva
+    (ver cargar_energia_por_periodo) a un año de DIAS_ANIO días, la base sobre
+    la que se suman electricidad y gas: el consumo de los días con datos se
+    extrapola al año. Una curva sin días con datos se devuelve tal cual.
+    """
+    if not datos['dias']:
+        return datos
+    escala = DIAS_ANIO / datos['dias']
+    return dict(
+        datos,
+        energia=np.asarray(datos['energia'], dtype=np.float64) * escala,
+        dias=DIAS_ANIO,
+        costes_series={serie: coste * escala for serie, coste in datos['costes_series'].items()},
+    )
+
+
+def precios_energia(matriz):
+    """Devuelve la matriz (tarifas x periodos) de precios de energía en €/kWh"""
+    por_periodo = np.column_stack([
+        matriz['termino_energia_punta'],
+        matriz['termino_energia_plana'],
+        matriz['termino_energia_valle'],
+    ])
+    # Las tarifas sin discriminación (o con periodos sin informar) usan el término único
+    unico = matriz['termino_energia'][:, None]
+    sin_discriminacion = (matriz['tipo_discriminacion'] == 'sin_discriminacion')[:, None]
+    usar_unico = (sin_discriminacion & (unico > 0)) | (por_periodo == 0)
+    return np.where(usar_unico, unico, por_periodo)
+
+
+def descomponer_coste_electricidad(matriz):
+    """
+    Descompone el coste de cada tarifa en sus partes lineales, impuestos incluidos:
+    coste = dias * (fijo_dia + por_kw_dia * potencia) + energia_periodos @ por_kwh.T
+
+    Los términos de potencia están en €/kW y año; alquiler y bono social en €/día.
+    El descuento se resta en €/kWh del precio de la energía de cada periodo (a
+    diferencia del de gas, que es un porcentaje). El impuesto eléctrico grava
+    potencia, energía y bono social; el IVA, todo.
+
+    En las tarifas indexadas por_kwh es el margen sobre el precio de mercado;
+    el precio horario de su serie se suma aparte con coste_indexado.
+    """
+    factor_iva = 1 + matriz['iva'] / 100
+    factor_ie = (1 + matriz['impuesto_electricidad'] / 100) * factor_iva
+    indexadas = matriz['serie_precios'] != ''
+
+    por_kw_dia = (matriz['termino_potencia_punta'] + matriz['termino_potencia_valle']) / DIAS_ANIO
+    precios = np.where(indexadas[:, None], matriz['margen_indexado'][:, None], precios_energia(matriz))
+    por_kwh = precios - matriz['descuento'][:, None]
+    fijo_dia = (matriz['financiacion_bono_social'] * factor_ie
+                + matriz['alquiler_contador'] * factor_iva)
+
+    return {
+        'fijo_dia': fijo_dia,
+        'por_kw_dia': por_kw_dia * factor_ie,
+        'por_kwh': por_kwh * factor_ie[:, None],
+        'serie': matriz['serie_precios'],
+        'indexado': np.where(indexadas, factor_ie, 0.0),
+    }
+
+
+def partes_cota_inferior(partes):
+    """
+    Partes de coste con la energía de todos los periodos al precio del periodo
+    más barato de cada tarifa. Con energía no negativa, cualquier coste o
+    término evaluado con ellas es una cota inferior del real, sea cual sea el
+    reparto del consumo entre periodos.
+    """
+    por_kwh = partes['por_kwh'].min(axis=1, keepdims=True)
+    return dict(partes, por_kwh=np.broadcast_to(por_kwh, partes['por_kwh'].shape))
+
+
+def coste_indexado(partes, costes_series=None):
+    """
+    Coste a precio de mercado de las tarifas indexadas, impuestos incluidos:
+    indexado * (kWh · precio horario de su serie). costes_series asocia cada
+    serie con ese producto, escalar o vector (n,). Devuelve (tarifas,) o
+    (n, tarifas): 0 en las tarifas no indexadas y NaN en las indexadas cuya
+    serie no está importada (quedan fuera de los rankings).
+    """
+    costes_series = costes_series or {}
+    forma = np.shape(next(iter(costes_series.values()), 0.0))
+    coste = np.zeros(forma + (len(partes['serie']),))
+    for serie in np.unique(partes['serie'][partes['serie'] != '']):
+        columnas = partes['serie'] == serie
+        por_serie = np.asarray(costes_series.get(serie, np.nan), dtype=np.float64)
+        coste[..., columnas] = por_serie[..., None] * partes['indexado'][columnas]
+    return coste
+
+
+def coste_desde_partes(partes, energia, dias, potencia, costes_series=None):
+    """
+    Evalúa el coste de todas las tarifas a partir de su descomposición lineal.
+
+    energia puede ser un vector por periodo (3,) o una matriz (n, 3); en el
+    segundo caso dias y potencia pueden ser escalares o vectores (n,) y el
+    resultado tiene forma (n, tarifas) en lugar de (tarifas,). costes_series
+    (ver coste_indexado) tiene la forma de dias.
+    """
+    energia = np.asarray(energia, dtype=np.float64)
+    dias = np.asarray(dias, dtype=np.float64)
+    potencia = np.asarray(potencia, dtype=np.float64)
+    if energia.ndim > 1:
+        dias = dias.reshape(-1, 1) if dias.ndim == 1 else dias
+        potencia = potencia.reshape(-1, 1) if potencia.ndim == 1 else potencia
+    return (dias * (partes['fijo_dia'] + partes['por_kw_dia'] * potencia)
+            + energia @ partes['por_kwh'].T
+            + coste_indexado(partes, costes_series))
+
+
+def calcular_costes_electricidad(matriz, energia, dias, potencia, costes_series=None):
+    """Calcula de una vez el coste total de todas las tarifas eléctricas de la matriz"""
+    return coste_desde_partes(descomponer_coste_electricidad(matriz), energia, dias, potencia, costes_series)
+
+
+def terminos_electricidad(partes, energia, dias, costes_series=None):
+    """
+    Resultados parciales por tarifa para una curva fija (energia (3,), dias):
+    coste = fijo + por_kw * potencia + energia.
+
+    Mientras no cambien las tarifas ni la curva, cambiar la potencia solo
+    recalcula coste_desde_terminos, O(tarifas), sin volver a la curva horaria.
+    """
+    return {
+        'fijo': dias * partes['fijo_dia'],
+        'por_kw': dias * partes['por_kw_dia'],
+        'energia': (np.asarray(energia, dtype=np.float64) @ partes['por_kwh'].T
+                    + coste_indexado(partes, costes_series)),
+    }
+
+
+def coste_desde_terminos(terminos, potencia):
+    """Coste de cada tarifa a partir de sus términos parciales; potencia escalar o (tarifas,)"""
+    return terminos['fijo'] + terminos['por_kw'] * potencia + terminos['energia']
+
+
+def potencia_optima_terminos(terminos, potencia_minima, potencia_maxima=POTENCIA_MAXIMA, paso=None):
+    """
+    Devuelve la potencia contratada de mínimo coste de cada tarifa dentro de
+    [potencia_minima, potencia_maxima] y el coste con esa potencia, ambos (tarifas,).
+
+    El coste es lineal en la potencia (por_kw * potencia), así que el óptimo
+    está en un extremo del intervalo: la potencia mínima, salvo en tarifas con
+    término de potencia negativo. Con paso, la potencia mínima se redondea hacia
+    arriba al múltiplo del paso (los escalones del selector de potencia).
+    """
+    if paso:
+        potencia_minima = round(math.ceil(potencia_minima / paso - 1e-9) * paso, 6)
+    potencia_maxima = max(potencia_maxima, potencia_minima)
+
+    potencias = np.where(terminos['por_kw'] >= 0, potencia_minima, potencia_maxima)
+    return potencias, coste_desde_terminos(terminos, potencias)
+
+
+def descomponer_coste_gas(matriz):
+    """
+    Descompone el coste de cada tarifa de gas, IVA incluido:
+    coste = dias * fijo_dia + consumo * por_kwh
+
+    Término fijo y alquiler en €/día; energía e impuesto de hidrocarburos en
+    €/kWh; el descuento es un porcentaje sobre el término de energía.
+    """
+    factor_iva = 1 + matriz['iva'] / 100
+    fijo_dia = (matriz['termino_fijo'] + matriz['alquiler_contador']) * factor_iva
+    por_kwh = (matriz['termino_energia'] * (1 - matriz['descuento'] / 100)
+               + matriz['impuesto_ieh']) * factor_iva
+    return {'fijo_dia': fijo_dia, 'por_kwh': por_kwh}
+
+
+def calcular_costes_gas(matriz, consumo, dias=DIAS_ANIO):
+    """
+    Calcula de una vez el coste total de todas las tarifas de gas de la matriz.
+    Con un consumo escalar devuelve (tarifas,); con un vector de consumos (n,),
+    una matriz (n, tarifas).
+    """
+    partes = descomponer_coste_gas(matriz)
+    consumo = np.asarray(consumo, dtype=np.float64)
+    dias = np.asarray(dias, dtype=np.float64)
+    if consumo.ndim > 0:
+        consumo = consumo.reshape(-1, 1)
+        dias = dias.reshape(-1, 1) if dias.ndim == 1 else dias
+    return dias * partes['fijo_dia'] + consumo * partes['por_kwh']
+
+
+def matriz_costes_gas(matriz, consumos, dias=DIAS_ANIO):
+    """
+    Coste de todas las tarifas de gas para cada consumo: siempre una matriz
+    (tarifas, consumos), sea cual sea el número de tarifas o de consumos.
+    dias puede ser escalar o un vector (consumos,).
+    """
+    consumos = np.atleast_1d(np.asarray(consumos, dtype=np.float64))
+    return calcular_costes_gas(matriz, consumos, dias).T
+
+
+def describir_tarifa(matriz, costes, i, potencias=None):
+    """Resume la tarifa i de la matriz con su coste (y su potencia, si se indica)"""
+    descripcion = {
+        'id': int(matriz['id'][i]),
+        'tarifa': matriz['tarifa'][i],
+        'total': float(costes[i]),
+        'descuento_kwh': float(matriz['descuento'][i]),
+        'tipo_discriminacion': matriz['tipo_discriminacion'][i] or 'sin_discriminacion',
+    }
+    if potencias is not None:
+        descripcion['potencia'] = float(potencias[i])
+    return descripcion
+
+
+def mejores_tarifas_por_compania(matriz, costes, potencias=None):
+    """Devuelve, para cada compañía, la tarifa de menor coste de la matriz"""
+    mejores = {}
+    for i in np.argsort(costes, kind='stable'):
+        compania = matriz['companyia'][i]
+        if compania not in mejores and np.isfinite(costes[i]):
+            mejores[compania] = describir_tarifa(matriz, costes, i, potencias)
+    return mejores
+
+
+def mejores_tarifas_gas_por_compania(matriz, costes):
+    """Devuelve, para cada compañía, la tarifa de gas de menor coste (costes (tarifas,))"""
+    mejores = {}
+    for i in np.argsort(costes, kind='stable'):
+        compania = matriz['companyia'][i]
+        if compania not in mejores and np.isfinite(costes[i]):
+            mejores[compania] = {
+                'id': int(matriz['id'][i]),
+                'tarifa': matriz['tarifa'][i],
+                'total': float(costes[i]),
+            }
+    return mejores
+
+
+def minimos_por_compania(matriz, costes, companias):
+    """
+    Para una matriz de costes (n, tarifas) devuelve el coste mínimo y el índice
+    de la tarifa ganadora de cada compañía, ambos con forma (n, compañías).
+    Las compañías sin tarifas tienen coste infinito e índice -1; los costes
+    NaN (tarifas indexadas sin precios) cuentan como infinitos.
+    """
+    costes = np.where(np.isnan(costes), np.inf, costes)
+    n = costes.shape[0]
+    minimos = np.full((n, len(companias)), np.inf)
+    indices = np.full((n, len(companias)), -1, dtype=np.int64)
+
+    # Tarifas agrupadas por compañía (en orden de índice dentro de cada grupo)
+    posicion = {compania: j for j, compania in enumerate(companias)}
+    grupo = np.array([posicion.get(c, -1) for c in matriz['companyia']], dtype=np.int64)
+    columnas = np.flatnonzero(grupo >= 0)
+    if len(columnas) == 0:
+        return minimos, indices
+    columnas = columnas[np.argsort(grupo[columnas], kind='stable')]
+    presentes, inicios = np.unique(grupo[columnas], return_index=True)
+
+    # Mínimo por grupo y primera tarifa que lo alcanza (como argmin), sin recorrer compañías
+    ordenados = costes[:, columnas]
+    minimos[:, presentes] = np.minimum.reduceat(ordenados, inicios, axis=1)
+    tamanos = np.diff(np.append(inicios, len(columnas)))
+    es_minimo = ordenados == np.repeat(minimos[:, presentes], tamanos, axis=1)
+    primera = np.minimum.reduceat(
+        np.where(es_minimo, np.arange(len(columnas)), len(columnas)), inicios, axis=1
+    )
+    indices[:, presentes] = columnas[primera]
+    return minimos, indices
+
+
+def grupos_por_compania(matriz):
+    """Índices (ordenados) de las tarifas de cada compañía de la matriz: {compañía: array}"""
+    companias, inversa = np.unique(matriz['companyia'], return_inverse=True)
+    orden = np.argsort(inversa, kind='stable')
+    cortes = np.cumsum(np.bincount(inversa, minlength=len(companias)))[:-1]
+    return dict(zip(companias, np.split(orden, cortes)))
+
+
+def minimos_por_grupo(costes, grupos):
+    """Coste mínimo de cada grupo de tarifas (NaN cuenta como infinito): {grupo: mínimo}"""
+    costes = np.where(np.isnan(costes), np.inf, costes)
+    return {clave: float(costes[indices].min()) for clave, indices in grupos.items()}
+
+
+def k_mejores(cotas, evaluar, k):
+    """
+    Devuelve ordenados los k resultados de menor coste exacto evaluando solo
+    los candidatos que pueden entrar entre ellos.
+
+    cotas es una lista de (cota, candidato) con cota <= coste exacto, y
+    evaluar(candidatos) evalúa un lote y devuelve para cada candidato
+    (coste, resultado) o None. Se evalúan primero los k de menor cota; con el
+    k-ésimo coste como umbral, el resto de candidatos cuya cota no lo supera
+    se evalúa en un segundo lote (los demás no pueden entrar) y un montículo
+    guarda los k mejores. A igual coste gana el candidato que aparece antes en
+    cotas (como una ordenación estable del ranking completo).
+    """
+    orden = sorted(range(len(cotas)), key=lambda i: cotas[i][0])
+    # Entradas (-coste, -posición, resultado): la raíz es el peor de los k mejores
+    monticulo = []
+    inicio, tamano = 0, k
+    while inicio < len(orden):
+        umbral = -monticulo[0][0] if len(monticulo) == k else math.inf
+        lote = [p for p in orden[inicio:inicio + tamano] if cotas[p][0] <= umbral]
+        if not lote:
+            break
+        for posicion, evaluado in zip(lote, evaluar([cotas[p][1] for p in lote])):
+            if evaluado is None or not np.isfinite(evaluado[0]):
+                continue
+            entrada = (-evaluado[0], -posicion, evaluado[1])
+            if len(monticulo) < k:
+                heapq.heappush(monticulo, entrada)
+            elif entrada[:2] > monticulo[0][:2]:
+                heapq.heapreplace(monticulo, entrada)
+        inicio, tamano = inicio + tamano, len(orden)
+    return [resultado for _, _, resultado in sorted(monticulo, key=lambda e: e[:2], reverse=True)]
+
+
+def filtrar_matriz(matriz, mascara):
+    """Devuelve la submatriz de tarifas seleccionadas por la máscara booleana"""
+    return {columna: valores[mascara] for columna, valores in matriz.items()}
+
+
+def filtrar_por_discriminacion(matriz, tipo_discriminacion):
+    """Filtra en memoria una matriz eléctrica según el filtro de discriminación de la interfaz"""
+    if tipo_discriminacion not in FILTROS_DISCRIMINACION:
+        return matriz
+    return filtrar_matriz(
+        matriz, matriz['tipo_discriminacion'] == FILTROS_DISCRIMINACION[tipo_discriminacion]
+    )
+
+
+def escalar_energia(energia, consumo):
+    """Reescala la energía por periodo para que sume el consumo indicado, manteniendo el reparto"""
+    energia = np.asarray(energia, dtype=np.float64)
+    total = energia.sum(axis=-1, keepdims=True)
+    consumo = np.asarray(consumo, dtype=np.float64)
+    if consumo.ndim == 1 and energia.ndim > 1:
+        consumo = consumo.reshape(-1, 1)
+    return np.divide(energia * consumo, total, out=np.zeros(np.broadcast(energia, consumo).shape),
+                     where=total > 0)
+
+
+def escalar_costes_series(costes_series, energia, consumo):
+    """
+    Reescala el coste a precio de mercado de cada serie en la misma proporción
+    que escalar_energia escala la energía para que sume el consumo indicado
+    """
+    total = np.asarray(energia, dtype=np.float64).sum(axis=-1)
+    factor = np.divide(np.asarray(consumo, dtype=np.float64), total,
+                       out=np.zeros(np.broadcast(total, consumo).shape), where=total > 0)
+    return {serie: np.asarray(coste, dtype=np.float64) * factor for serie, coste in costes_series.items()}
+
+
+def evaluar_combinaciones(matriz_elec, matriz_gas, energia, dias, potencias, consumos_gas,
+                          costes_series=None):
+    """
+    Evalúa n escenarios a la vez (filas): energía por periodo (n, 3), días,
+    potencia y consumo de gas (escalares o vectores (n,)) y coste de cada
+    escenario en las series de precios (ver coste_indexado). Devuelve, para cada
+    compañía que ofrece ambos servicios, los costes mínimos de electricidad y
+    gas y el índice de la tarifa ganadora de cada uno, con forma (n, compañías).
+
+    Electricidad y gas se evalúan sobre los mismos días, así que el consumo de
+    gas debe ser el de ese periodo: el anual con dias = DIAS_ANIO (ver
+    anualizar_consumo).
+    """
+    energia = np.atleast_2d(np.asarray(energia, dtype=np.float64))
+    n = energia.shape[0]
+    dias = np.broadcast_to(np.asarray(dias, dtype=np.float64), (n,))
+
+    costes_elec = coste_desde_partes(
+        descomponer_coste_electricidad(matriz_elec), energia, dias,
+        np.broadcast_to(np.asarray(potencias, dtype=np.float64), (n,)),
+        {serie: np.broadcast_to(np.asarray(coste, dtype=np.float64), (n,))
+         for serie, coste in (costes_series or {}).items()}
+    )
+    costes_gas = calcular_costes_gas(
+        matriz_gas, np.broadcast_to(np.asarray(consumos_gas, dtype=np.float64), (n,)), dias=dias
+    )
+
+    # Solo compiten las compañías que ofrecen ambos servicios
+    comunes = sorted(set(matriz_elec['companyia']) & set(matriz_gas['companyia']))
+    min_elec, idx_elec = minimos_por_compania(matriz_elec, costes_elec, comunes)
+    min_gas, idx_gas = minimos_por_compania(matriz_gas, costes_gas, comunes)
+    return {
+        'companias': comunes,
+        'coste_elec': min_elec,
+        'idx_elec': idx_elec,
+        'coste_gas': min_gas,
+        'idx_gas': idx_gas,
+        'coste_total': min_elec + min_gas,
+    }
+
+
+def resultado_combinacion(evaluacion, matriz_elec, matriz_gas, fila, j):
+    """Construye el resultado de la compañía j en el escenario fila de una evaluación"""
+    e = evaluacion['idx_elec'][fila, j]
+    g = evaluacion['idx_gas'][fila, j]
+    return {
+        'companyia': evaluacion['companias'][j],
+        'tarifa_elec': matriz_elec['tarifa'][e],
+        'coste_elec': float(evaluacion['coste_elec'][fila, j]),
+        'descuento_kwh_elec': float(matriz_elec['descuento'][e]),
+        'tarifa_gas': matriz_gas['tarifa'][g],
+        'coste_gas': float(evaluacion['coste_gas'][fila, j]),
+        'coste_total': float(evaluacion['coste_total'][fila, j]),
+        'es_referencia': False,
+        'tipo_discriminacion': matriz_elec['tipo_discriminacion'][e] or 'sin_discriminacion',
+    }
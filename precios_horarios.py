@@ -0,0 +1,284 @@
+"""
+Series horarias de precios de mercado (PVPC, OMIE...) para las tarifas indexadas.
+
+Uso:
+    python -m precios_horarios pvpc_2023.csv pvpc_2024.csv --serie pvpc
+
+Los CSV tienen fecha, hora y precio en €/kWh (o precio_mwh en €/MWh) y se leen
+como las curvas de ingesta_consumos: separador ';' o ',', coma decimal y horas
+'HH:MM' (hora civil de fin, de '01:00' a '24:00') o numeradas 1..24 (23 o 25 en
+los cambios de horario; la hora repetida se promedia). Se guardan en
+precios_horarios por hora civil, con el mismo criterio que consumos; reimportar
+un fichero sustituye sus precios.
+
+Para evaluar, cada año de una serie se vuelca en CACHE_DIR como array float32
+(unos 35 KB por año) que se abre mapeado en memoria: mientras la tabla no
+cambie, leer años de precios no vuelve a consultar la base de datos.
+"""
+import argparse
+import calendar
+import glob
+import hashlib
+import os
+import sys
+from datetime import date
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from cache_tarifas import identidad_bd, version_tabla
+from config import CACHE_DIR, DB_PATH, get_horas_del_dia
+from curva_carga import HORAS_DIA, SEGUNDOS_HORA, epoch_hora_civil
+from ingesta_consumos import TAMANO_LOTE, abrir_lector, hora_civil, indices_columnas, leer_fecha, leer_numero
+from trabajos import registrar_aviso
+from verificar_db import aplicar_migraciones, crear_triggers_version, suspender_triggers_version
+
+# Nombres de columna aceptados (en minúsculas) para cada campo
+ALIAS_COLUMNAS = {
+    'fecha': ('fecha', 'date', 'dia'),
+    'hora': ('hora', 'hour', 'periodo'),
+    'precio': ('precio', 'precio_kwh', 'eur_kwh', 'price'),
+    'precio_mwh': ('precio_mwh', 'eur_mwh', 'price_mwh'),
+}
+
+SQL_INSERTAR = """
+    INSERT INTO precios_horarios (serie, timestamp, precio)
+    VALUES (?, ?, ?)
+    ON CONFLICT(serie, timestamp) DO UPDATE SET precio = excluded.precio
+"""
+
+# Fracción mínima de las horas con consumo que deben tener precio para valorar
+# una serie; por debajo, sus tarifas indexadas quedan sin calcular
+COBERTURA_MINIMA = 0.95
+
+# Años de precios ya abiertos en este proceso: (base de datos, serie, año, versión) -> array
+_PRECIOS = {}
+
+
+def ingerir_precios_csv(session, ruta, serie, tamano_lote=TAMANO_LOTE, encoding='utf-8-sig'):
+    """
+    Ingresa un CSV de precios horarios de la serie en una única transacción,
+    incrementando una sola vez la versión de precios_horarios, y devuelve un
+    resumen (filas leídas, horas escritas y filas inválidas)
+    """
+    resumen = {'fichero': ruta, 'serie': serie, 'filas_leidas': 0, 'filas_escritas': 0, 'filas_invalidas': 0}
+    # Precios del día en curso por hora civil: (suma, lecturas), para promediar la hora repetida
+    dia_actual, horas_dia_actual = None, {}
+    lote = []
+
+    def cerrar_dia():
+        if dia_actual is None:
+            return
+        inicio_dia = calendar.timegm(dia_actual.timetuple())
+        for hora, (suma, lecturas) in horas_dia_actual.items():
+            lote.append((serie, inicio_dia + hora * SEGUNDOS_HORA, suma / lecturas))
+
+    def escribir_lote():
+        if lote:
+            session.connection().exec_driver_sql(SQL_INSERTAR, lote)
+            resumen['filas_escritas'] += len(lote)
+            lote.clear()
+
+    try:
+        suspender_triggers_version(session, 'precios_horarios')
+        with open(ruta, newline='', encoding=encoding) as fichero:
+            cabecera, lector = abrir_lector(fichero)
+            columnas = indices_columnas(cabecera, ALIAS_COLUMNAS, ('fecha', 'hora'))
+            if 'precio' not in columnas and 'precio_mwh' not in columnas:
+                raise ValueError("Falta la columna de precio (precio en €/kWh o precio_mwh en €/MWh)")
+
+            for fila in lector:
+                if not fila or not any(c.strip() for c in fila):
+                    continue
+                resumen['filas_leidas'] += 1
+                try:
+                    fecha = leer_fecha(fila[columnas['fecha']])
+                    hora = hora_civil(fila[columnas['hora']], get_horas_del_dia(fecha))
+                    if 'precio' in columnas:
+                        precio = leer_numero(fila[columnas['precio']])
+                    else:
+                        precio = leer_numero(fila[columnas['precio_mwh']]) / 1000
+                except (ValueError, IndexError):
+                    resumen['filas_invalidas'] += 1
+                    continue
+
+                if fecha != dia_actual:
+                    cerrar_dia()
+                    if len(lote) >= tamano_lote:
+                        escribir_lote()
+                    dia_actual, horas_dia_actual = fecha, {}
+                suma, lecturas = horas_dia_actual.get(hora, (0.0, 0))
+                horas_dia_actual[hora] = (suma + precio, lecturas + 1)
+
+            cerrar_dia()
+            escribir_lote()
+        crear_triggers_version(session, ('precios_horarios',))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return resumen
+
+
+def series_precios(session):
+    """Devuelve los nombres de las series de precios importadas"""
+    filas = session.execute(text("SELECT DISTINCT serie FROM precios_horarios ORDER BY serie")).fetchall()
+    return [f[0] for f in filas]
+
+
+def leer_precios_anio(session, serie, año):
+    """Precios del año desde la BD: array float32 por hora civil del año, NaN donde falten"""
+    inicio = epoch_hora_civil(date(año, 1, 1))
+    n_horas = (date(año + 1, 1, 1) - date(año, 1, 1)).days * HORAS_DIA
+    filas = session.execute(
+        text("""
+            SELECT timestamp, precio FROM precios_horarios
+            WHERE serie = :serie AND timestamp >= :desde AND timestamp < :hasta
+        """),
+        {'serie': serie, 'desde': inicio, 'hasta': inicio + n_horas * SEGUNDOS_HORA}
+    ).fetchall()
+
+    precios = np.full(n_horas, np.nan, dtype=np.float32)
+    if filas:
+        datos = np.array(filas, dtype=np.float64)
+        precios[((datos[:, 0] - inicio) // SEGUNDOS_HORA).astype(np.int64)] = datos[:, 1]
+    return precios
+
+
+def precios_anio(session, serie, año):
+    """
+    Devuelve los precios horarios del año de la serie (float32, NaN donde
+    falten), mapeados en memoria desde la caché en disco. El fichero lleva la
+    identidad de la base de datos y se reconstruye cuando cambia la versión
+    de precios_horarios.
+    """
+    bd = identidad_bd(session)
+    version = version_tabla(session, 'precios_horarios')
+    precios = _PRECIOS.get((bd, serie, año, version))
+    if precios is not None:
+        return precios
+
+    firma = hashlib.sha1(serie.encode('utf-8')).hexdigest()[:12]
+    ruta = os.path.join(CACHE_DIR, f"precios_{bd}_{firma}_{año}_v{version}.npy")
+    try:
+        precios = np.load(ruta, mmap_mode='r')
+    except (OSError, ValueError):
+        precios = leer_precios_anio(session, serie, año)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Escritura atómica: otros procesos pueden estar abriendo el mismo fichero
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            with open(temporal, 'wb') as fichero:
+                np.save(fichero, precios)
+            os.replace(temporal, ruta)
+            for anterior in glob.glob(os.path.join(CACHE_DIR, f"precios_{bd}_{firma}_{año}_v*.npy")):
+                if anterior != ruta:
+                    os.remove(anterior)
+            precios = np.load(ruta, mmap_mode='r')
+        except OSError as e:
+            print(f"No se pudieron guardar los precios en caché: {e}")
+
+    for clave in [c for c in _PRECIOS if c[:3] == (bd, serie, año)]:
+        del _PRECIOS[clave]
+    _PRECIOS[(bd, serie, año, version)] = precios
+    return precios
+
+
+def precios_horarios(session, serie, año_inicio, año_fin):
+    """Concatena los precios horarios de la serie de varios años consecutivos"""
+    return np.concatenate([precios_anio(session, serie, año) for año in range(año_inicio, año_fin + 1)])
+
+
+def precios_completos(precios, usadas=None, serie=''):
+    """
+    Rellena las horas sin precio con el precio medio de la serie en el periodo
+    (float64) e informa de cuántas horas usadas (las de la máscara usadas, por
+    defecto todas) se han imputado. Si la serie no tiene precio en al menos
+    COBERTURA_MINIMA de las horas usadas, devuelve NaN en todas las horas: las
+    tarifas indexadas en ella quedan sin calcular.
+    """
+    precios = np.asarray(precios, dtype=np.float64)
+    faltan = np.isnan(precios)
+    if not faltan.any():
+        return precios
+    usadas = np.ones(len(precios), dtype=bool) if usadas is None else np.asarray(usadas, dtype=bool)
+    n_usadas = int(usadas.sum())
+    imputadas = int((faltan & usadas).sum())
+    if faltan.all() or (n_usadas and 1 - imputadas / n_usadas < COBERTURA_MINIMA):
+        informar_imputacion(
+            f"Serie de precios '{serie}': faltan {imputadas} de {n_usadas} horas; "
+            f"sus tarifas indexadas no se calculan",
+            f"Sèrie de preus '{serie}': falten {imputadas} de {n_usadas} hores; "
+            f"les seves tarifes indexades no es calculen"
+        )
+        return np.full(len(precios), np.nan)
+    if imputadas:
+        informar_imputacion(
+            f"Serie de precios '{serie}': {imputadas} de {n_usadas} horas sin precio, imputadas con el precio medio",
+            f"Sèrie de preus '{serie}': {imputadas} de {n_usadas} hores sense preu, imputades amb el preu mitjà"
+        )
+    return np.where(faltan, precios[~faltan].mean(), precios)
+
+
+def informar_imputacion(mensaje, aviso):
+    """Escribe el mensaje en el registro y, dentro de un trabajo, guarda el aviso para mostrarlo en la página"""
+    print(mensaje)
+    registrar_aviso(aviso)
+
+
+def costes_series_curvas(session, curvas, series=None):
+    """
+    Coste a precio de mercado (kWh · precio horario, en €) de una curva (horas,)
+    o de varias (suministros x horas) de curva_carga en cada serie de precios
+    (todas las importadas si es None): {serie: escalar o (suministros,)}.
+    """
+    if series is None:
+        series = series_precios(session)
+    usadas = np.atleast_2d(curvas['kwh'] != 0).any(axis=0)
+    return {
+        serie: curvas['kwh'] @ precios_completos(
+            precios_horarios(session, serie, curvas['año_inicio'], curvas['año_fin']), usadas, serie
+        )
+        for serie in series
+    }
+
+
+def crear_parser():
+    """Define los argumentos de la línea de comandos"""
+    parser = argparse.ArgumentParser(
+        prog="python -m precios_horarios",
+        description="Importa sèries horàries de preus (CSV) a la taula precios_horarios."
+    )
+    parser.add_argument('ficheros', nargs='+', help="Ficheros CSV a importar")
+    parser.add_argument('--serie', required=True, help="Nombre de la serie (p. ej. pvpc u omie)")
+    parser.add_argument('--db', default=DB_PATH, help="Ruta de la base de datos SQLite")
+    parser.add_argument('--encoding', default='utf-8-sig', help="Codificación de los ficheros")
+    return parser
+
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos"""
+    args = crear_parser().parse_args(argv)
+    engine = create_engine(f"sqlite:///{args.db}")
+    codigo = 0
+    try:
+        with Session(engine) as s:
+            aplicar_migraciones(s)
+            for ruta in args.ficheros:
+                try:
+                    resumen = ingerir_precios_csv(s, ruta, args.serie, encoding=args.encoding)
+                except Exception as e:
+                    print(f"Error al importar {ruta}: {e}", file=sys.stderr)
+                    codigo = 1
+                    continue
+                print(f"{ruta}: {resumen['filas_leidas']} filas leídas, "
+                      f"{resumen['filas_escritas']} horas de '{args.serie}' escritas, "
+                      f"{resumen['filas_invalidas']} inválidas")
+    finally:
+        engine.dispose()
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,178 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 from sqlalchemy import text
-from tar_elec.calculos_tarifas import calcular_coste_electricidad
-from tar_gas.tarifes_gas import calcular_coste_gas
+from motor_ranking import (
+    cargar_tarifas_electricas,
+    cargar_tarifas_gas,
+    COLUMNAS_GAS,
+    COLUMNAS_TEXTO_GAS,
+    describir_tarifa,
+    anualizar_consumo,
+    cargar_energia_por_periodo,
+    matriz_desde_registros,
+    calcular_costes_electricidad,
+    descomponer_coste_electricidad,
+    terminos_electricidad,
+    coste_desde_terminos,
+    mejores_tarifas_por_compania,
+    calcular_costes_gas,
+    mejores_tarifas_gas_por_compania,
+    potencia_optima_terminos,
+    partes_cota_inferior,
+    filtrar_matriz,
+    grupos_por_compania,
+    minimos_por_grupo,
+    k_mejores
+)
+from ventanas_coste import (
+    acumulados_curva,
+    energia_ventana,
+    ultimos_meses,
+    anios_contrato,
+    terminos_contrato
+)
+from curva_carga import demanda_maxima
+from escenarios_consumo import ESCENARIOS, PERCENTILES, generar_escenarios, semanas_curva, simular_ranking
+import contextvars
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from streamlit_echarts import st_echarts
 from datetime import datetime
-from functools import lru_cache  # Para caché de funciones
+from cache_tarifas import CacheVersionada, TABLAS_CURVA, estadisticas_caches, identidad_bd, versiones_tablas
+from cache_resultados import CacheResultados, clave_resultado
+from config import SERIE_PVPC, TARIFA_REFERENCIA_ELECTRICIDAD, TARIFA_REFERENCIA_GAS
+from conexiones_bd import TAMANO_POOL_LECTURA, sesion_lectura
+from instrumentacion import etapa, instrumentacion_global, medir_peticion
+from precios_horarios import series_precios
+from trabajos import enviar_trabajo, informar_progreso, obtener_trabajo, registrar_aviso
 
-# Conexión a la base de datos
-conn = st.connection("energia_db")
+# Cachés de consultas de tarifas, vaciadas automáticamente al modificar cada tabla
+CACHES_TARIFAS = {
+    'electricidad': CacheVersionada('tarifas_electricas', maximo=64, ttl=600),
+    'gas': CacheVersionada('tarifas_gas', maximo=64, ttl=600),
+}
+
+# Energía por periodo de la curva, válida mientras no cambien consumos ni calendario
+CACHE_CURVA = CacheVersionada(TABLAS_CURVA, maximo=8)
+
+# Términos parciales de coste por tarifa (dependen de las tarifas y de la curva)
+CACHE_TERMINOS = CacheVersionada(('tarifas_electricas',) + TABLAS_CURVA, maximo=32)
+
+# Resultados completos del ranking, persistentes y compartidos entre procesos
+CACHE_RESULTADOS = CacheResultados()
+
+# Tablas de las que depende un ranking (su versión forma parte de la clave)
+TABLAS_RANKING = ('tarifas_electricas', 'tarifas_gas') + TABLAS_CURVA
+
+# Periodos de consumo sobre los que se puede evaluar el coste eléctrico
+PERIODOS_EVALUACION = ("Tota la corba", "Últims 12 mesos", "Durada del contracte")
+
+# Escalón (kW) del selector de potencia, al que se redondea la potencia óptima
+PASO_POTENCIA = 0.05
+
+# Variable de entorno que fija los hilos del modo concurrente (1 lo desactiva) y
+# lo activa sin mirar el número de compañías ni de CPUs
+VARIABLE_HILOS = 'COMPARADOR_HILOS_RANKING'
+
+# Compañías por hilo a partir de las que el modo concurrente compensa: cada lote
+# añade unos 3-10 ms (sus consultas y tareas propias) a un ranking que cuesta
+# del orden de 1 ms por compañía en frío
+COMPANIAS_POR_HILO = 100
+
+def hilos_maximos():
+    """
+    Hilos del pool del ranking: los de VARIABLE_HILOS o, si no se fija, uno por
+    CPU. Como cada tarea usa su propia conexión del pool de lectura, nunca más
+    de la mitad del pool, para no dejar sin conexión al resto de páginas.
+    """
+    fijados = os.environ.get(VARIABLE_HILOS, '').strip()
+    hilos = int(fijados) if fijados.isdigit() else (os.cpu_count() or 1)
+    return max(min(hilos, TAMANO_POOL_LECTURA // 2), 1)
+
+HILOS_RANKING = hilos_maximos()
+_EJECUTOR_RANKING = ThreadPoolExecutor(max_workers=HILOS_RANKING, thread_name_prefix='ranking')
+
+# Clave de session_state con el id del último trabajo de ranking de la sesión
+CLAVE_TRABAJO_RANKING = 'trabajo_ranking'
+
+# Segundos entre actualizaciones de la barra de progreso de un trabajo
+INTERVALO_PROGRESO = 0.25
+
+def mostrar_error(mensaje):
+    """Muestra el error en la página o, dentro de un trabajo en segundo plano, lo guarda en el trabajo"""
+    if not registrar_aviso(mensaje):
+        st.error(mensaje)
+
+def cargar_energia_curva(s):
+    """
+    Energía por periodo, días y coste indexado de toda la curva de carga llevados
+    a un año (ver anualizar_consumo), leídos de la BD solo si ha cambiado
+    """
+    return CACHE_CURVA.obtener(s, ('energia',), lambda: anualizar_consumo(cargar_energia_por_periodo(s)))
+
+def terminos_periodo(s, matriz, periodo="Tota la corba", cota_inferior=False):
+    """
+    Términos parciales del coste anual de cada tarifa de la matriz evaluados
+    sobre el periodo de consumo indicado: toda la curva o sus últimos 12 meses,
+    llevados a un año (como el consumo de gas), o el plazo de contrato de cada
+    tarifa (coste anual medio). Las ventanas se resuelven
+    con las sumas acumuladas de la curva, sin volver a leer las horas. Con
+    cota_inferior, la energía se valora al precio del periodo más barato (ver
+    partes_cota_inferior).
+    """
+    partes = descomponer_coste_electricidad(matriz)
+    if cota_inferior:
+        partes = partes_cota_inferior(partes)
+    if periodo != "Tota la corba":
+        acumulados = CACHE_CURVA.obtener(s, ('acumulados',), lambda: acumulados_curva(s))
+        if acumulados is not None:
+            if periodo == "Durada del contracte":
+                return terminos_contrato(partes, acumulados, anios_contrato(matriz))
+            datos = anualizar_consumo(energia_ventana(acumulados, *ultimos_meses(acumulados, 12)))
+            return terminos_electricidad(partes, datos['energia'], datos['dias'], datos['costes_series'])
+    
+    datos_consumo = cargar_energia_curva(s)
+    return terminos_electricidad(
+        partes, datos_consumo['energia'], datos_consumo['dias'], datos_consumo['costes_series']
+    )
+
+def cargar_terminos_electricidad(s, companias, tipo_discriminacion="Totes", periodo="Tota la corba"):
+    """
+    Devuelve la matriz eléctrica y los términos parciales de coste de cada
+    tarifa. Un cambio de potencia o de consumo de gas los reutiliza; solo se
+    recalculan al modificar las tarifas, la curva o el calendario.
+    """
+    def calcular():
+        matriz = cargar_tarifas_electricas(s, companias, tipo_discriminacion)
+        return matriz, terminos_periodo(s, matriz, periodo)
+
+    return CACHE_TERMINOS.obtener(s, ('terminos', tuple(companias), tipo_discriminacion, periodo), calcular)
+
+def cargar_cotas_electricidad(s, companias, tipo_discriminacion="Totes", periodo="Tota la corba"):
+    """
+    Como cargar_terminos_electricidad, pero con los términos de la cota
+    inferior de cada tarifa y sus índices agrupados por compañía
+    """
+    def calcular():
+        matriz = cargar_tarifas_electricas(s, companias, tipo_discriminacion)
+        return matriz, grupos_por_compania(matriz), terminos_periodo(s, matriz, periodo, cota_inferior=True)
+
+    return CACHE_TERMINOS.obtener(s, ('cotas', tuple(companias), tipo_discriminacion, periodo), calcular)
 
-@lru_cache(maxsize=8)
 def obtener_companias_cache(tipo='electricidad'):
     """Obtiene la lista de compañías con caché para reducir consultas a la BD"""
     try:
         tabla = "tarifas_electricas" if tipo == 'electricidad' else "tarifas_gas"
         query = f"SELECT DISTINCT companyia FROM {tabla} ORDER BY companyia"
-        with conn.session as s:
-            result = s.execute(text(query)).fetchall()
-            return [r[0] for r in result]
+        with sesion_lectura() as s:
+            return CACHES_TARIFAS[tipo].obtener(
+                s, ('companias',),
+                lambda: [r[0] for r in s.execute(text(query)).fetchall()]
+            )
     except Exception as e:
+        # Los errores no se guardan en caché: la siguiente llamada vuelve a consultar
         st.error(f"Error al obtenir companyes: {str(e)}")
         return []
 
@@ -32,38 +184,42 @@ def obtener_companias_gas():
     """Obtiene la lista de compañías que ofrecen gas"""
     return obtener_companias_cache('gas')
 
-@lru_cache(maxsize=16)
+def consultar_tarifas_por_compania(s, compania, tipo, discriminacion=None):
+    """Consulta las tarifas de una compañía (sin caché)"""
+    if tipo == 'electricidad':
+        query = """
+        SELECT id, companyia, tarifa, potencia_contratada, tipo_discriminacion 
+        FROM tarifas_electricas 
+        WHERE companyia = :compania
+        """
+        
+        # Filtrar por tipo de discriminación si se especifica
+        if discriminacion == "Amb discriminació":
+            query += " AND tipo_discriminacion = 'con_discriminacion'"
+        elif discriminacion == "Sense discriminació":
+            query += " AND tipo_discriminacion = 'sin_discriminacion'"
+            
+        result = s.execute(text(query), {"compania": compania}).fetchall()
+        return [{
+            'id': r[0], 'companyia': r[1], 'tarifa': r[2], 
+            'potencia_contratada': r[3], 'tipo_discriminacion': r[4]
+        } for r in result]
+    
+    # Gas
+    query = "SELECT id, companyia, tarifa FROM tarifas_gas WHERE companyia = :compania"
+    result = s.execute(text(query), {"compania": compania}).fetchall()
+    return [{
+        'id': r[0], 'companyia': r[1], 'tarifa': r[2]
+    } for r in result]
+
 def obtener_tarifas_por_compania_cache(compania, tipo, discriminacion=None):
     """Caché para consultas de tarifas por compañía"""
     try:
-        if tipo == 'electricidad':
-            query = """
-            SELECT id, companyia, tarifa, potencia_contratada, tipo_discriminacion 
-            FROM tarifas_electricas 
-            WHERE companyia = :compania
-            """
-            
-            # Filtrar por tipo de discriminación si se especifica
-            if discriminacion == "Amb discriminació":
-                query += " AND tipo_discriminacion = 'con_discriminacion'"
-            elif discriminacion == "Sense discriminació":
-                query += " AND tipo_discriminacion = 'sin_discriminacion'"
-                
-            with conn.session as s:
-                result = s.execute(text(query), {"compania": compania}).fetchall()
-                tarifas = [{
-                    'id': r[0], 'companyia': r[1], 'tarifa': r[2], 
-                    'potencia_contratada': r[3], 'tipo_discriminacion': r[4]
-                } for r in result]
-        else:  # gas
-            query = "SELECT id, companyia, tarifa FROM tarifas_gas WHERE companyia = :compania"
-            with conn.session as s:
-                result = s.execute(text(query), {"compania": compania}).fetchall()
-                tarifas = [{
-                    'id': r[0], 'companyia': r[1], 'tarifa': r[2]
-                } for r in result]
-        
-        return tarifas
+        with sesion_lectura() as s:
+            return CACHES_TARIFAS[tipo].obtener(
+                s, ('tarifas', compania, discriminacion),
+                lambda: consultar_tarifas_por_compania(s, compania, tipo, discriminacion)
+            )
     except Exception as e:
         st.error(f"Error al obtenir tarifes: {str(e)}")
         return []
@@ -76,151 +232,254 @@ def obtener_tarifas_gas_por_compania(compania):
     """Obtiene las tarifas de gas de una compañía específica"""
     return obtener_tarifas_por_compania_cache(compania, 'gas')
 
-def obtener_tarifa_completa(tipo, tarifa_id):
-    """Obtiene los datos completos de una tarifa"""
+# Tarifa guardada con la que se compara: la "(actual)" del usuario o, si no
+# hay, la de referencia sembrada en la tabla por versiones anteriores
+CONSULTAS_TARIFA_REFERENCIA = {
+    'electricidad': """
+        SELECT * FROM tarifas_electricas
+        WHERE tarifa LIKE '%(actual)%' OR (companyia = 'Tarifa Referencia' AND tarifa = 'PVPC')
+        ORDER BY tarifa LIKE '%(actual)%' DESC, id
+        LIMIT 1
+    """,
+    'gas': """
+        SELECT * FROM tarifas_gas
+        WHERE tarifa LIKE '%(actual)%' OR (companyia = 'Tarifa Referencia' AND tarifa = 'TUR')
+        ORDER BY tarifa LIKE '%(actual)%' DESC, id
+        LIMIT 1
+    """,
+}
+
+TARIFAS_REFERENCIA_POR_DEFECTO = {
+    'electricidad': TARIFA_REFERENCIA_ELECTRICIDAD,
+    'gas': TARIFA_REFERENCIA_GAS,
+}
+
+def leer_tarifa_referencia(s, tipo):
+    """Tarifa "(actual)" o de referencia guardada en la BD como diccionario, o None"""
+    fila = s.execute(text(CONSULTAS_TARIFA_REFERENCIA[tipo])).mappings().fetchone()
+    return dict(fila) if fila is not None else None
+
+def crear_tarifa_referencia(tipo, potencia=None):
+    """
+    Devuelve la tarifa de referencia (electricidad o gas) como diccionario en
+    memoria, sin escribir en la BD: la tarifa "(actual)" del usuario, la de
+    referencia guardada o, si no hay ninguna, la de config (indexada a la serie
+    SERIE_PVPC si está importada). Se lee una vez por versión de la tabla; la
+    potencia solo se aplica a la copia devuelta.
+    """
     try:
-        with conn.session as s:
-            tabla = "tarifas_electricas" if tipo == 'electricidad' else "tarifas_gas"
-            query = text(f"SELECT * FROM {tabla} WHERE id = :id")
-            result = s.execute(query, {"id": tarifa_id}).fetchone()
-            
-            if result:
-                # Método seguro de convertir a diccionario
-                try:
-                    if hasattr(result, '_mapping'):
-                        return dict(result._mapping)
-                    else:
-                        return dict(result)
-                except:
-                    # Método fallback
-                    columns = s.execute(text(f"PRAGMA table_info({tabla})")).fetchall()
-                    column_names = [col[1] for col in columns]
-                    return {column_names[i]: result[i] for i in range(len(column_names)) if i < len(result)}
-            return None
+        with sesion_lectura() as s:
+            tarifa = CACHES_TARIFAS[tipo].obtener(s, ('referencia',), lambda: leer_tarifa_referencia(s, tipo))
+            series = []
+            if tarifa is None and tipo == 'electricidad':
+                series = CACHE_CURVA.obtener(s, ('series',), lambda: series_precios(s))
     except Exception as e:
-        st.error(f"Error al obtener tarifa: {str(e)}")
+        mostrar_error(f"Error al obtenir la tarifa de referència: {str(e)}")
         return None
+    
+    if tarifa is None:
+        tarifa = dict(TARIFAS_REFERENCIA_POR_DEFECTO[tipo])
+        if SERIE_PVPC in series:
+            tarifa['serie_precios'] = SERIE_PVPC
+    else:
+        tarifa = dict(tarifa)
+    if tipo == 'electricidad' and potencia:
+        tarifa['potencia_contratada'] = potencia
+    return tarifa
 
-def crear_tarifa_referencia(tipo, potencia=None):
-    """Crea una tarifa de referencia (electricidad o gas)"""
+def obtener_demanda_maxima():
+    """Obtiene el mayor consumo horario de la curva de carga (kW medios), o 0 si no hay datos"""
     try:
-        with conn.session as s:
-            if tipo == 'electricidad':
-                # Buscar primero si existe una tarifa marcada como actual
-                query = text("""
-                    SELECT id FROM tarifas_electricas 
-                    WHERE tarifa LIKE '%(actual)%' LIMIT 1
-                """)
-                result = s.execute(query).fetchone()
-                
-                if result:
-                    # Si existe, actualizarla y devolverla
-                    tarifa_id = result[0]
-                    if potencia:
-                        s.execute(
-                            text("UPDATE tarifas_electricas SET potencia_contratada = :potencia WHERE id = :id"),
-                            {"potencia": potencia, "id": tarifa_id}
-                        )
-                        s.commit()
-                    return obtener_tarifa_completa('electricidad', tarifa_id)
-                else:
-                    # Si no existe, ver si hay una tarifa de referencia
-                    query = text("SELECT id FROM tarifas_electricas WHERE companyia = 'Tarifa Referencia' AND tarifa = 'PVPC'")
-                    result = s.execute(query).fetchone()
-                    
-                    if result:
-                        # Actualizar y devolver
-                        tarifa_id = result[0]
-                        s.execute(text("""
-                            UPDATE tarifas_electricas SET 
-                            potencia_contratada = :potencia,
-                            tipo_discriminacion = 'con_discriminacion',
-                            termino_potencia_punta = 30.67,
-                            termino_potencia_valle = 1.42,
-                            termino_energia_punta = 0.16,
-                            termino_energia_plana = 0.10,
-                            termino_energia_valle = 0.08,
-                            alquiler_contador = 0.026630,
-                            financiacion_bono_social = 0.012742,
-                            descuento = 0.0,
-                            impuesto_electricidad = 5.1126963,
-                            iva = 21.0
-                            WHERE id = :id
-                        """), {'potencia': potencia, 'id': tarifa_id})
-                    else:
-                        # Crear nueva tarifa de referencia
-                        s.execute(text("""
-                            INSERT INTO tarifas_electricas (
-                                companyia, tarifa, potencia_contratada, tipo_discriminacion, 
-                                termino_potencia_punta, termino_potencia_valle, 
-                                termino_energia_punta, termino_energia_plana, termino_energia_valle,
-                                alquiler_contador, financiacion_bono_social, descuento,
-                                impuesto_electricidad, iva
-                            ) VALUES (
-                                'Tarifa Referencia', 'PVPC', :potencia, 'con_discriminacion',
-                                30.67, 1.42, 0.16, 0.10, 0.08, 0.026630, 0.012742, 0.000000,
-                                5.1126963, 21.0
-                            )
-                        """), {'potencia': potencia})
-                        result = s.execute(text("SELECT last_insert_rowid()")).fetchone()
-                        tarifa_id = result[0]
-                    
-                    s.commit()
-                    return obtener_tarifa_completa('electricidad', tarifa_id)
-            else:  # gas
-                # Buscar si existe una tarifa marcada como actual
-                query = text("""
-                    SELECT id FROM tarifas_gas 
-                    WHERE tarifa LIKE '%(actual)%' LIMIT 1
-                """)
-                result = s.execute(query).fetchone()
-                
-                if result:
-                    # Si existe, devolverla
-                    tarifa_id = result[0]
-                    return obtener_tarifa_completa('gas', tarifa_id)
-                else:
-                    # Ver si hay una tarifa de referencia
-                    query = text("SELECT id FROM tarifas_gas WHERE companyia = 'Tarifa Referencia' AND tarifa = 'TUR'")
-                    result = s.execute(query).fetchone()
-                    
-                    if result:
-                        # Actualizar valores standard
-                        tarifa_id = result[0]
-                        s.execute(text("""
-                            UPDATE tarifas_gas SET 
-                            termino_fijo = 0.16,
-                            termino_energia = 0.05,
-                            descuento = 0.0,
-                            alquiler_contador = 0.02,
-                            impuesto_ieh = 0.00234,
-                            iva = 21.0
-                            WHERE id = :id
-                        """), {'id': tarifa_id})
-                    else:
-                        # Crear nueva tarifa de referencia
-                        s.execute(text("""
-                            INSERT INTO tarifas_gas (
-                                companyia, tarifa, termino_fijo, termino_energia,
-                                descuento, alquiler_contador, impuesto_ieh, iva
-                            ) VALUES (
-                                'Tarifa Referencia', 'TUR', 0.16, 0.05, 0.0, 
-                                0.02, 0.00234, 21.0
-                            )
-                        """))
-                        result = s.execute(text("SELECT last_insert_rowid()")).fetchone()
-                        tarifa_id = result[0]
-                    
-                    s.commit()
-                    return obtener_tarifa_completa('gas', tarifa_id)
+        with sesion_lectura() as s:
+            return demanda_maxima(s)
     except Exception as e:
-        st.error(f"Error al crear tarifa de referencia: {str(e)}")
-        import traceback
-        st.error(traceback.format_exc())
-        return None
+        st.error(f"Error al obtenir la demanda màxima: {str(e)}")
+        return 0.0
+
+def calcular_ranking_combinado(companias, consumo_elec, consumo_gas, potencia, tipo_discriminacion="Totes",
+                               potencia_minima=None, periodo="Tota la corba", top_k=None, hilos=None):
+    """
+    Devuelve el ranking de calcular_ranking_combinado_sin_cache, guardado en la
+    caché persistente de resultados bajo el hash de las entradas y de las
+    versiones de tarifas, curva y calendario. Solo se guarda si esas versiones
+    no han cambiado durante el cálculo. Ni hilos ni consumo_elec forman parte
+    de la clave: el modo concurrente da el mismo resultado y el coste eléctrico
+    sale de la curva de carga, no del consumo indicado.
+    """
+    entradas = [list(companias), consumo_gas, potencia, tipo_discriminacion, potencia_minima, periodo, top_k]
+    try:
+        with etapa('cache_resultados'), sesion_lectura() as s:
+            versiones = versiones_tablas(s, TABLAS_RANKING)
+            clave = clave_resultado('calcular_ranking_combinado', entradas, versiones, identidad_bd(s))
+            resultados = CACHE_RESULTADOS.obtener(clave)
+    except Exception as e:
+        mostrar_error(f"Error al consultar la caché de resultats: {str(e)}")
+        versiones, resultados = None, None
+    if resultados is not None:
+        return resultados
+    
+    resultados = calcular_ranking_combinado_sin_cache(
+        companias, consumo_elec, consumo_gas, potencia, tipo_discriminacion, potencia_minima, periodo, top_k,
+        hilos
+    )
+    
+    if resultados and versiones is not None:
+        with etapa('cache_resultados'), sesion_lectura() as s:
+            if versiones_tablas(s, TABLAS_RANKING) == versiones:
+                CACHE_RESULTADOS.guardar(clave, resultados)
+    return resultados
+
+def resultado_compania(compania, mejor_tarifa_elec, mejor_tarifa_gas, potencia):
+    """Fila del ranking de una compañía a partir de sus mejores tarifas de electricidad y gas"""
+    return {
+        'companyia': compania,
+        'tarifa_elec': mejor_tarifa_elec['tarifa'],
+        'coste_elec': mejor_tarifa_elec['total'],
+        'descuento_kwh_elec': mejor_tarifa_elec.get('descuento_kwh', 0),
+        'tarifa_gas': mejor_tarifa_gas['tarifa'],
+        'coste_gas': mejor_tarifa_gas['total'],
+        'coste_total': mejor_tarifa_elec['total'] + mejor_tarifa_gas['total'],
+        'es_referencia': False,
+        'tipo_discriminacion': mejor_tarifa_elec.get('tipo_discriminacion', 'sin_discriminacion'),
+        'potencia': mejor_tarifa_elec.get('potencia', potencia)
+    }
+
+def costes_desde_terminos(terminos, potencia, potencia_minima=None):
+    """Potencias (o None) y costes de cada tarifa: con potencia_minima, a su potencia óptima"""
+    if potencia_minima is not None:
+        return potencia_optima_terminos(terminos, potencia_minima, paso=PASO_POTENCIA)
+    return None, coste_desde_terminos(terminos, potencia)
+
+def ranking_k_mejores_companias(s, companias, tipo_discriminacion, matriz_gas, consumo_gas, potencia,
+                                potencia_minima, periodo, top_k):
+    """
+    Las top_k compañías más baratas sin calcular el coste exacto de todo el
+    catálogo: una cota inferior por compañía (sus tarifas eléctricas con toda
+    la energía al precio del periodo más barato, más su mejor gas) ordena las
+    compañías, y solo se evalúan de forma exacta las que aún pueden entrar.
+    """
+    with etapa('cotas_inferiores'):
+        matriz_elec, grupos_elec, terminos_cota = cargar_cotas_electricidad(
+            s, companias, tipo_discriminacion, periodo
+        )
+        grupos_gas = CACHES_TARIFAS['gas'].obtener(
+            s, ('grupos', tuple(companias)), lambda: grupos_por_compania(matriz_gas)
+        )
+        _, cotas_elec = costes_desde_terminos(terminos_cota, potencia, potencia_minima)
+        minimos_elec = minimos_por_grupo(cotas_elec, grupos_elec)
+        costes_gas = calcular_costes_gas(matriz_gas, consumo_gas)
+        minimos_gas = minimos_por_grupo(costes_gas, grupos_gas)
+        cotas = [
+            (minimos_elec[c] + minimos_gas[c], c)
+            for c in companias if c in grupos_elec and c in grupos_gas
+        ]
+    
+    evaluadas = 0
+    
+    def evaluar(lote):
+        # Coste exacto de todas las tarifas de las compañías del lote en un solo cálculo
+        nonlocal evaluadas
+        informar_progreso(f"Avaluant {len(lote)} de {len(cotas)} companyies", evaluadas, len(cotas))
+        evaluadas += len(lote)
+        indices = np.concatenate([grupos_elec[c] for c in lote])
+        matriz = filtrar_matriz(matriz_elec, indices)
+        potencias, costes = costes_desde_terminos(terminos_periodo(s, matriz, periodo), potencia, potencia_minima)
+        mejores_elec = mejores_tarifas_por_compania(matriz, costes, potencias)
+        indices_gas = np.concatenate([grupos_gas[c] for c in lote])
+        mejores_gas = mejores_tarifas_gas_por_compania(
+            filtrar_matriz(matriz_gas, indices_gas), costes_gas[indices_gas]
+        )
+        evaluados = []
+        for compania in lote:
+            if compania not in mejores_elec or compania not in mejores_gas:
+                evaluados.append(None)
+                continue
+            resultado = resultado_compania(compania, mejores_elec[compania], mejores_gas[compania], potencia)
+            evaluados.append((resultado['coste_total'], resultado))
+        return evaluados
+    
+    with etapa('coste_k_mejores'):
+        return k_mejores(cotas, evaluar, top_k)
+
+def lotes_companias(companias, n_lotes):
+    """Reparte las compañías en hasta n_lotes tramos contiguos de tamaño parecido, conservando su orden"""
+    limites = np.linspace(0, len(companias), max(min(n_lotes, len(companias)), 1) + 1).astype(int)
+    return [companias[a:b] for a, b in zip(limites[:-1], limites[1:])]
+
+def mejores_electricidad_lote(companias, tipo_discriminacion, periodo, potencia, potencia_minima):
+    """Mejor tarifa eléctrica de cada compañía del lote, con su propia conexión de solo lectura"""
+    with etapa('cargar_electricidad_lote'), sesion_lectura() as s:
+        matriz_elec, terminos_elec = cargar_terminos_electricidad(s, companias, tipo_discriminacion, periodo)
+    with etapa('coste_electricidad'):
+        potencias_elec, costes_elec = costes_desde_terminos(terminos_elec, potencia, potencia_minima)
+        return mejores_tarifas_por_compania(matriz_elec, costes_elec, potencias_elec)
 
-def calcular_ranking_combinado(companias, consumo_elec, consumo_gas, potencia, tipo_discriminacion="Totes"):
-    """Calcula el ranking combinado de electricidad y gas para las compañías seleccionadas"""
+def mejores_gas_lote(companias, consumo_gas):
+    """Mejor tarifa de gas de cada compañía del lote, con su propia conexión de solo lectura"""
+    with etapa('cargar_gas_lote'), sesion_lectura() as s:
+        matriz_gas = CACHES_TARIFAS['gas'].obtener(
+            s, ('matriz', tuple(companias)), lambda: cargar_tarifas_gas(s, companias)
+        )
+    with etapa('coste_gas'):
+        return mejores_tarifas_gas_por_compania(matriz_gas, calcular_costes_gas(matriz_gas, consumo_gas))
+
+def hilos_ranking(n_companias, hilos=None):
+    """
+    Hilos con los que calcular un ranking de n_companias (None: secuencial),
+    como mucho hilos (por defecto HILOS_RANKING). Solo hay modo concurrente con
+    al menos COMPANIAS_POR_HILO compañías por hilo, aunque se pidan los hilos
+    explícitamente; con VARIABLE_HILOS fijada, se usan siempre.
+    """
+    hilos = HILOS_RANKING if hilos is None else hilos
+    if not os.environ.get(VARIABLE_HILOS, '').strip():
+        hilos = min(hilos, n_companias // COMPANIAS_POR_HILO)
+    return hilos if hilos > 1 else None
+
+def mejores_tarifas_concurrentes(companias, tipo_discriminacion, periodo, consumo_gas, potencia,
+                                 potencia_minima, hilos=HILOS_RANKING):
+    """
+    Mejores tarifas de electricidad y de gas de cada compañía, calculadas en el
+    pool de hilos del ranking: las compañías se reparten en hilos lotes y la
+    electricidad y el gas de cada lote son tareas separadas, cada una con su
+    conexión de solo lectura (SQLite y numpy liberan el GIL mientras leen y
+    calculan). Cada tarea hereda el contexto (medición y trabajo en curso).
+    Devuelve los mismos diccionarios que el cálculo secuencial.
+    """
+    lotes = lotes_companias(companias, hilos)
+    futuros = [
+        (
+            lote,
+            _EJECUTOR_RANKING.submit(
+                contextvars.copy_context().run, mejores_electricidad_lote,
+                lote, tipo_discriminacion, periodo, potencia, potencia_minima
+            ),
+            _EJECUTOR_RANKING.submit(contextvars.copy_context().run, mejores_gas_lote, lote, consumo_gas),
+        )
+        for lote in lotes
+    ]
+    mejores_elec, mejores_gas = {}, {}
+    hechas = 0
+    for lote, futuro_elec, futuro_gas in futuros:
+        mejores_elec.update(futuro_elec.result())
+        mejores_gas.update(futuro_gas.result())
+        hechas += len(lote)
+        informar_progreso(f"Avaluades {hechas} de {len(companias)} companyies", hechas, len(companias))
+    return mejores_elec, mejores_gas
+
+def calcular_ranking_combinado_sin_cache(companias, consumo_elec, consumo_gas, potencia,
+                                         tipo_discriminacion="Totes", potencia_minima=None,
+                                         periodo="Tota la corba", top_k=None, hilos=None):
+    """
+    Calcula el ranking combinado de electricidad y gas para las compañías seleccionadas.
+    Con potencia_minima, cada tarifa se evalúa con su potencia óptima (la de menor
+    coste que no baja de ese mínimo) en lugar de con la potencia indicada.
+    periodo es uno de PERIODOS_EVALUACION. Con top_k solo se devuelven las top_k
+    compañías más baratas (y la tarifa de referencia, si se ha pedido), podando
+    las que no pueden entrar (ver ranking_k_mejores_companias). Con hilos (y
+    sin top_k) las compañías se evalúan en paralelo en hasta hilos lotes si hay
+    bastantes para que compense (ver hilos_ranking y
+    mejores_tarifas_concurrentes); el resultado es el mismo.
+    """
     # Inicializar lista de resultados
     resultados = []
     
@@ -228,25 +487,75 @@ def calcular_ranking_combinado(companias, consumo_elec, consumo_gas, potencia, t
     tarifa_ref_elec = None
     tarifa_ref_gas = None
     if "Tarifa Referencia" in companias:
-        tarifa_ref_elec = crear_tarifa_referencia('electricidad', potencia)
-        tarifa_ref_gas = crear_tarifa_referencia('gas')
+        with etapa('tarifa_referencia'):
+            tarifa_ref_elec = crear_tarifa_referencia('electricidad', potencia)
+            tarifa_ref_gas = crear_tarifa_referencia('gas')
+    
+    # Curva, tarifas y términos parciales por tarifa se reutilizan entre rankings
+    # mientras no cambie la BD: mover un control solo recalcula O(tarifas)
+    companias_regulares = [c for c in companias if c != "Tarifa Referencia"]
+    if hilos is not None:
+        hilos = hilos_ranking(len(companias_regulares), hilos)
+    concurrente = top_k is None and hilos is not None and len(companias_regulares) > 1
+    informar_progreso("Carregant tarifes i consums", 0, len(companias))
+    try:
+        with etapa('cargar_tarifas_y_curva'), sesion_lectura() as s:
+            if concurrente:
+                # La curva se prepara una sola vez antes de repartir: si no, cada tarea la leería a la vez
+                if periodo == "Tota la corba":
+                    cargar_energia_curva(s)
+                else:
+                    CACHE_CURVA.obtener(s, ('acumulados',), lambda: acumulados_curva(s))
+            else:
+                matriz_gas = CACHES_TARIFAS['gas'].obtener(
+                    s, ('matriz', tuple(companias_regulares)),
+                    lambda: cargar_tarifas_gas(s, companias_regulares)
+                )
+            terminos_ref = None
+            if tarifa_ref_elec:
+                terminos_ref = terminos_periodo(s, matriz_desde_registros([tarifa_ref_elec]), periodo)
+            if top_k is not None:
+                mejores_companias = ranking_k_mejores_companias(
+                    s, companias_regulares, tipo_discriminacion, matriz_gas, consumo_gas, potencia,
+                    potencia_minima, periodo, top_k
+                )
+            elif not concurrente:
+                matriz_elec, terminos_elec = cargar_terminos_electricidad(
+                    s, companias_regulares, tipo_discriminacion, periodo
+                )
+        if concurrente:
+            with etapa('companias_en_paralelo'):
+                mejores_elec, mejores_gas = mejores_tarifas_concurrentes(
+                    companias_regulares, tipo_discriminacion, periodo, consumo_gas, potencia,
+                    potencia_minima, hilos
+                )
+    except Exception as e:
+        mostrar_error(f"Error al carregar tarifes i consums: {str(e)}")
+        return []
+    
+    if top_k is not None:
+        resultados.extend(mejores_companias)
+    elif not concurrente:
+        # Evaluar todas las tarifas eléctricas en un único cálculo
+        informar_progreso("Calculant costos de totes les tarifes")
+        with etapa('coste_electricidad'):
+            potencias_elec, costes_elec = costes_desde_terminos(terminos_elec, potencia, potencia_minima)
+            mejores_elec = mejores_tarifas_por_compania(matriz_elec, costes_elec, potencias_elec)
+        with etapa('coste_gas'):
+            mejores_gas = mejores_tarifas_gas_por_compania(matriz_gas, calcular_costes_gas(matriz_gas, consumo_gas))
     
     # Procesar cada compañía
-    for compania in companias:
+    for i, compania in enumerate(companias):
+        informar_progreso(f"Companyia: {compania}", i, len(companias))
         if compania == "Tarifa Referencia":
             if tarifa_ref_elec and tarifa_ref_gas:
                 # Calcular coste eléctrico
-                resultado_elec_ref = calcular_coste_electricidad(conn, [tarifa_ref_elec['id']])
-                coste_elec = resultado_elec_ref[0]['total'] if resultado_elec_ref else 0
+                potencias_ref, costes_ref = costes_desde_terminos(terminos_ref, potencia, potencia_minima)
+                potencia_ref = float(potencias_ref[0]) if potencias_ref is not None else potencia
+                coste_elec = float(costes_ref[0])
                 
                 # Calcular coste de gas
-                resultado_gas_ref = calcular_coste_gas(tarifa_ref_gas, consumo_gas)
-                
-                # Procesar el resultado del gas (puede ser lista o diccionario)
-                if isinstance(resultado_gas_ref, list) and len(resultado_gas_ref) > 0:
-                    coste_gas = resultado_gas_ref[0]['total']
-                else:
-                    coste_gas = resultado_gas_ref['total'] if resultado_gas_ref else 0
+                coste_gas = coste_tarifa_gas(tarifa_ref_gas, consumo_gas) or 0
                 
                 # Añadir resultado
                 resultados.append({
@@ -256,100 +565,159 @@ def calcular_ranking_combinado(companias, consumo_elec, consumo_gas, potencia, t
                     'tarifa_gas': tarifa_ref_gas['tarifa'],
                     'coste_gas': coste_gas,
                     'coste_total': coste_elec + coste_gas,
-                    'es_referencia': True
+                    'es_referencia': True,
+                    'potencia': potencia_ref
                 })
             continue
         
-        # Procesar compañías regulares
-        tarifas_elec = obtener_tarifas_electricidad_por_compania(compania, tipo_discriminacion)
-        tarifas_gas = obtener_tarifas_gas_por_compania(compania)
-        
-        if not tarifas_elec or not tarifas_gas:
+        # Con top_k las compañías ya están evaluadas
+        if top_k is not None:
             continue
         
-        # Encontrar mejor tarifa eléctrica
-        mejor_tarifa_elec = procesar_mejor_tarifa_electrica(tarifas_elec, potencia)
+        # Mejor tarifa eléctrica ya calculada para la compañía
+        mejor_tarifa_elec = mejores_elec.get(compania)
         if not mejor_tarifa_elec:
             continue
-            
-        # Encontrar mejor tarifa gas
-        mejor_tarifa_gas = procesar_mejor_tarifa_gas(tarifas_gas, consumo_gas)
+        
+        # Mejor tarifa de gas ya calculada para la compañía
+        mejor_tarifa_gas = mejores_gas.get(compania)
         if not mejor_tarifa_gas:
             continue
         
         # Guardar resultado
-        resultados.append({
-            'companyia': compania,
-            'tarifa_elec': mejor_tarifa_elec['tarifa'],
-            'coste_elec': mejor_tarifa_elec['total'],
-            'descuento_kwh_elec': mejor_tarifa_elec.get('descuento_kwh', 0),
-            'tarifa_gas': mejor_tarifa_gas['tarifa'],
-            'coste_gas': mejor_tarifa_gas['total'],
-            'coste_total': mejor_tarifa_elec['total'] + mejor_tarifa_gas['total'],
-            'es_referencia': False,
-            'tipo_discriminacion': mejor_tarifa_elec.get('tipo_discriminacion', 'sin_discriminacion')
-        })
+        resultados.append(resultado_compania(compania, mejor_tarifa_elec, mejor_tarifa_gas, potencia))
     
     # Ordenar resultados por coste total
+    informar_progreso("Ordenant el ranking", len(companias))
     return sorted(resultados, key=lambda x: x['coste_total'])
 
-def procesar_mejor_tarifa_electrica(tarifas, potencia):
-    """Procesa las tarifas eléctricas para encontrar la mejor"""
-    mejor_tarifa = None
-    menor_coste = float('inf')
-    
-    for tarifa in tarifas:
-        # Ajustar la potencia contratada
-        with conn.session as s:
-            s.execute(
-                text("UPDATE tarifas_electricas SET potencia_contratada = :potencia WHERE id = :id"),
-                {"potencia": potencia, "id": tarifa['id']}
+def calcular_escenarios_ranking(companias, consumo_gas, potencia, tipo_discriminacion="Totes",
+                                potencia_minima=None, periodo="Tota la corba", n_escenarios=ESCENARIOS):
+    """
+    Robustez del ranking frente a la incertidumbre del consumo: evalúa las
+    compañías (sin la tarifa de referencia) en n_escenarios años de consumo
+    generados a partir de las semanas de la curva (ver escenarios_consumo).
+    Los filtros son los del ranking: con potencia_minima cada tarifa va a su
+    potencia óptima, y las semanas salen del periodo de evaluación (los
+    últimos 12 meses o, para cada tarifa, su plazo de contrato). La semilla es
+    fija, así que la misma petición da el mismo resultado. Devuelve None si el
+    periodo no tiene ninguna semana completa.
+    """
+    companias_regulares = [c for c in companias if c != "Tarifa Referencia"]
+    por_contrato = periodo == "Durada del contracte"
+    try:
+        with etapa('cargar_escenarios'), sesion_lectura() as s:
+            matriz_elec = CACHES_TARIFAS['electricidad'].obtener(
+                s, ('matriz', tuple(companias_regulares), tipo_discriminacion),
+                lambda: cargar_tarifas_electricas(s, companias_regulares, tipo_discriminacion)
             )
-            s.commit()
-        
-        # Calcular coste
-        resultados = calcular_coste_electricidad(conn, [tarifa['id']])
-        if resultados and len(resultados) > 0:
-            coste = resultados[0]['total']
-            if coste < menor_coste:
-                menor_coste = coste
-                mejor_tarifa = {
-                    'id': tarifa['id'],
-                    'tarifa': tarifa['tarifa'],
-                    'total': coste,
-                    'descuento_kwh': resultados[0].get('descuento_kwh', 0),
-                    'tipo_discriminacion': tarifa.get('tipo_discriminacion', 'sin_discriminacion')
-                }
+            matriz_gas = CACHES_TARIFAS['gas'].obtener(
+                s, ('matriz', tuple(companias_regulares)),
+                lambda: cargar_tarifas_gas(s, companias_regulares)
+            )
+            # Meses de curva de los que se toman las semanas (None: toda la curva), por plazo de contrato
+            if por_contrato:
+                meses = {plazo: int(plazo) * 12 for plazo in np.unique(anios_contrato(matriz_elec))}
+            else:
+                meses = {None: 12 if periodo == "Últims 12 mesos" else None}
+            semanas = {
+                plazo: CACHE_CURVA.obtener(s, ('semanas', m), lambda m=m: semanas_curva(s, meses=m))
+                for plazo, m in meses.items()
+            }
+    except Exception as e:
+        mostrar_error(f"Error al carregar la corba per als escenaris: {str(e)}")
+        return None
+    if any(semanas_plazo is None for semanas_plazo in semanas.values()):
+        return None
     
-    return mejor_tarifa
+    with etapa('simular_escenarios'):
+        escenarios = {plazo: generar_escenarios(semanas_plazo, n_escenarios, semilla=0)
+                      for plazo, semanas_plazo in semanas.items()}
+        return simular_ranking(
+            matriz_elec, matriz_gas, escenarios if por_contrato else escenarios[None], potencia, consumo_gas,
+            semilla=1, potencia_minima=potencia_minima, paso_potencia=PASO_POTENCIA, por_contrato=por_contrato
+        )
+
+def ejecutar_peticion_ranking(peticion, medir=False, perfilar=False):
+    """
+    Calcula el ranking de la petición (los argumentos de
+    calcular_ranking_combinado, más n_escenarios si se pide el análisis de
+    robustez) dentro de un trabajo en segundo plano. Devuelve la petición, los
+    resultados, la simulación de escenarios (o None) y la medición (o None).
+    Al perfilar no se usa la caché de resultados, para perfilar el cálculo.
+    """
+    calcular = calcular_ranking_combinado_sin_cache if perfilar else calcular_ranking_combinado
+    with medir_peticion('ranking', activa=medir, perfilar=perfilar) as medicion:
+        resultados = calcular(
+            peticion['companias'], peticion['consumo_elec'], peticion['consumo_gas'], peticion['potencia'],
+            peticion['tipo_discriminacion'], peticion['potencia_minima'], peticion['periodo'], peticion['top_k'],
+            HILOS_RANKING
+        )
+        simulacion = None
+        if resultados and peticion['n_escenarios']:
+            informar_progreso(f"Simulant {peticion['n_escenarios']} escenaris de consum")
+            simulacion = calcular_escenarios_ranking(
+                peticion['companias'], peticion['consumo_gas'], peticion['potencia'],
+                peticion['tipo_discriminacion'], peticion['potencia_minima'], peticion['periodo'],
+                peticion['n_escenarios']
+            )
+    return {'peticion': peticion, 'resultados': resultados, 'simulacion': simulacion, 'medicion': medicion}
+
+def enviar_peticion_ranking(peticion, medir=False, perfilar=False):
+    """
+    Envía el cálculo de la petición a segundo plano y devuelve su trabajo. El
+    id es el hash de la petición, de las versiones de las tablas y de la
+    identidad de la base de datos: repetir la misma petición mientras se
+    calcula (o después) devuelve el mismo trabajo. Al perfilar, un trabajo ya
+    terminado no se reutiliza: se calcula de nuevo para obtener su perfil.
+    """
+    entradas = [peticion, medir, perfilar]
+    try:
+        with sesion_lectura() as s:
+            versiones = versiones_tablas(s, TABLAS_RANKING)
+            identidad = identidad_bd(s)
+    except Exception as e:
+        # Sin versiones, un id único: el trabajo no se comparte con otras peticiones
+        mostrar_error(f"Error al consultar les versions de les taules: {str(e)}")
+        versiones, identidad = (time.time(),), ''
+    id_trabajo = clave_resultado('trabajo_ranking', entradas, versiones, identidad)
+    return enviar_trabajo(id_trabajo, 'ranking', ejecutar_peticion_ranking, peticion, medir, perfilar,
+                          reutilizar_terminado=not perfilar)
+
+def procesar_mejor_tarifa_electrica(tarifas, potencia, datos_consumo=None):
+    """Procesa las tarifas eléctricas para encontrar la mejor, sin modificar la BD"""
+    if not tarifas:
+        return None
+    
+    with sesion_lectura() as s:
+        matriz = cargar_tarifas_electricas(s, ids=[t['id'] for t in tarifas])
+        if datos_consumo is None:
+            datos_consumo = cargar_energia_curva(s)
+    
+    if len(matriz['id']) == 0:
+        return None
+    
+    costes = calcular_costes_electricidad(
+        matriz, datos_consumo['energia'], datos_consumo['dias'], potencia, datos_consumo.get('costes_series')
+    )
+    return describir_tarifa(matriz, costes, int(costes.argmin()))
+
+def coste_tarifa_gas(tarifa, consumo):
+    """Coste total de una tarifa de gas completa, o None si no se puede calcular"""
+    matriz = matriz_desde_registros([tarifa], COLUMNAS_GAS, COLUMNAS_TEXTO_GAS)
+    coste = float(calcular_costes_gas(matriz, consumo)[0])
+    return coste if np.isfinite(coste) else None
 
 def procesar_mejor_tarifa_gas(tarifas, consumo):
-    """Procesa las tarifas de gas para encontrar la mejor"""
-    mejor_tarifa = None
-    menor_coste = float('inf')
-    
-    for tarifa in tarifas:
-        tarifa_completa = obtener_tarifa_completa('gas', tarifa['id'])
-        if tarifa_completa:
-            # Calcular coste
-            resultado = calcular_coste_gas(tarifa_completa, consumo)
-            
-            if resultado:
-                # Procesar el resultado (puede ser lista o diccionario)
-                if isinstance(resultado, list) and len(resultado) > 0:
-                    coste = resultado[0]['total']
-                else:
-                    coste = resultado['total']
-                
-                if coste < menor_coste:
-                    menor_coste = coste
-                    mejor_tarifa = {
-                        'id': tarifa['id'],
-                        'tarifa': tarifa['tarifa'],
-                        'total': coste
-                    }
+    """Procesa las tarifas de gas para encontrar la mejor, con una sola consulta"""
+    if not tarifas:
+        return None
     
-    return mejor_tarifa
+    with sesion_lectura() as s:
+        matriz = cargar_tarifas_gas(s, ids=[t['id'] for t in tarifas])
+    
+    mejores = mejores_tarifas_gas_por_compania(matriz, calcular_costes_gas(matriz, consumo))
+    return min(mejores.values(), key=lambda t: t['total'], default=None)
 
 def preparar_datos_grafico(resultados):
     """Prepara los datos para el gráfico"""
@@ -458,6 +826,7 @@ def mostrar_tabla_resumen(resultados):
         "Tarifa Gas": [r['tarifa_gas'] for r in resultados],
         "Cost Gas": [r['coste_gas'] for r in resultados],
         "Cost Total": [r['coste_total'] for r in resultados],
+        "Potència": [r.get('potencia') for r in resultados],
         "Discriminació": [r.get('tipo_discriminacion', 'sin_discriminacion') == 'con_discriminacion' 
                          for r in resultados]
     })
@@ -472,6 +841,7 @@ def mostrar_tabla_resumen(resultados):
             "Tarifa Gas": st.column_config.TextColumn("Tarifa Gas"),
             "Cost Gas": st.column_config.NumberColumn("Cost Gas", format="%.2f €"),
             "Cost Total": st.column_config.NumberColumn("Cost Total", format="%.2f €"),
+            "Potència": st.column_config.NumberColumn("Potència", format="%.2f kW"),
             "Discriminació": st.column_config.CheckboxColumn("Discriminació Horària")
         },
         use_container_width=True
@@ -512,18 +882,143 @@ def mostrar_resultados_ranking(resultados, tipo_discriminacion="Totes"):
                f"**Cost total anual: {ganador['coste_total']:.2f}€**")
     
     # Preparar datos para gráfico
-    datos_grafico = preparar_datos_grafico(resultados)
+    with etapa('preparar_datos_grafico'):
+        datos_grafico = preparar_datos_grafico(resultados)
     
     # Crear y mostrar gráfico
-    option = crear_configuracion_grafico(datos_grafico)
-    st_echarts(options=option, height="500px")
+    with etapa('crear_configuracion_grafico'):
+        option = crear_configuracion_grafico(datos_grafico)
+    with etapa('render_grafico'):
+        st_echarts(options=option, height="500px")
     
     # Mostrar tabla de resumen
-    mostrar_tabla_resumen(resultados)
+    with etapa('render_tabla'):
+        mostrar_tabla_resumen(resultados)
     
     # Mostrar comparación con tarifa de referencia si existe
     mostrar_comparacion_referencia(resultados, ganador)
 
+def mostrar_escenarios(simulacion):
+    """Muestra la probabilidad de ganar y los percentiles de coste de cada compañía"""
+    st.subheader("Robustesa davant la incertesa del consum")
+    if not simulacion or not simulacion['companias']:
+        st.warning("No hi ha prou corba de càrrega (setmanes completes) per generar escenaris")
+        return
+    
+    st.caption(f"{simulacion['escenarios']} escenaris: setmanes de la corba remostrejades, "
+               "consum escalat i energia desplaçada entre punta i vall")
+    df_escenarios = pd.DataFrame({
+        "Companyia": simulacion['companias'],
+        "Probabilitat de guanyar": simulacion['probabilidad_ganar'] * 100,
+        "Cost mitjà": simulacion['media'],
+        **{f"P{p}": simulacion['percentiles'][p] for p in PERCENTILES},
+    }).sort_values(["Probabilitat de guanyar", "Cost mitjà"], ascending=[False, True])
+    
+    st.dataframe(
+        df_escenarios,
+        hide_index=True,
+        column_config={
+            "Probabilitat de guanyar": st.column_config.NumberColumn("Probabilitat de guanyar", format="%.1f %%"),
+            "Cost mitjà": st.column_config.NumberColumn("Cost mitjà", format="%.2f €"),
+            **{f"P{p}": st.column_config.NumberColumn(f"Cost P{p}", format="%.2f €") for p in PERCENTILES},
+        },
+        use_container_width=True
+    )
+
+def mostrar_panel_rendimiento(medicion, visualizacion=None):
+    """
+    Muestra los tiempos por etapa, la actividad de la BD y el perfil de una
+    petición medida, junto con las etapas de visualización de sus resultados
+    en esta ejecución de la página (medidas aparte, si se pasan) y el estado
+    de las cachés del proceso
+    """
+    informe = medicion.informe()
+    etapas = [("Càlcul", nombre, ms) for nombre, ms in informe['etapas_ms'].items()]
+    if visualizacion is not None:
+        etapas += [("Visualització", nombre, ms) for nombre, ms in visualizacion.informe()['etapas_ms'].items()]
+    with st.expander("⏱️ Rendiment"):
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Temps total", f"{informe['total_ms']:.0f} ms")
+        col2.metric("Consultes", informe['consultas'])
+        col3.metric("Files llegides", informe['filas'])
+        col4.metric("Temps a la BD", f"{informe['bd_ms']:.0f} ms")
+        if visualizacion is not None:
+            st.caption(f"Visualització dels resultats: {visualizacion.informe()['total_ms']:.0f} ms "
+                       "(no inclosa al temps total del càlcul)")
+        st.dataframe(
+            pd.DataFrame({
+                "Fase": [fase for fase, _, _ in etapas],
+                "Etapa": [nombre for _, nombre, _ in etapas],
+                "Temps (ms)": [ms for _, _, ms in etapas],
+            }),
+            hide_index=True,
+            use_container_width=True
+        )
+        # Cachés en memoria del proceso (compartidas por todas las sesiones) y caché de resultados en disco
+        caches = estadisticas_caches()
+        resultados = CACHE_RESULTADOS.estadisticas()
+        st.caption("Memòries cau del procés (compartides per totes les sessions)")
+        st.dataframe(
+            pd.DataFrame({
+                "Memòria cau": [", ".join(c['tablas']) for c in caches] + ["Resultats (disc)"],
+                "Encerts": [c['aciertos'] for c in caches] + [resultados['aciertos']],
+                "Errades": [c['fallos'] for c in caches] + [resultados['fallos']],
+                "Entrades": [c['entradas'] for c in caches] + [resultados['entradas']],
+            }),
+            hide_index=True,
+            use_container_width=True
+        )
+        if medicion.perfil:
+            st.code(medicion.perfil, language=None)
+
+def esperar_trabajo_ranking(trabajo):
+    """
+    Muestra el progreso del trabajo hasta que termina. Si se cambia un control
+    mientras tanto, Streamlit interrumpe esta espera pero no el trabajo: la
+    siguiente ejecución de la página se vuelve a enganchar a él.
+    """
+    if trabajo.terminado:
+        return
+    barra = st.progress(0.0, text="Calculant el ranking energètic...")
+    while not trabajo.esperar(INTERVALO_PROGRESO):
+        progreso = trabajo.progreso()
+        if progreso['estado'] == 'en_cola':
+            texto = "En cua: esperant que acabin altres càlculs..."
+        else:
+            texto = (f"{progreso['descripcion'] or 'Calculant el ranking energètic...'} "
+                     f"({progreso['hechas']}/{progreso['total']} companyies, {progreso['segundos']:.0f} s)")
+        barra.progress(progreso['fraccion'], text=texto)
+    barra.empty()
+
+def mostrar_trabajo_ranking(trabajo, peticion_actual, medir_rendimiento=False):
+    """Espera al trabajo de ranking (si no ha terminado) y muestra sus resultados, avisos y rendimiento"""
+    esperar_trabajo_ranking(trabajo)
+    progreso = trabajo.progreso()
+    for aviso in progreso['avisos']:
+        st.error(aviso)
+    if progreso['estado'] == 'error':
+        st.error(f"Error al calcular el ranking: {trabajo.error}")
+        return
+    
+    calculo = trabajo.resultado
+    peticion = calculo['peticion']
+    if peticion != peticion_actual:
+        st.caption("Resultats de l'últim càlcul. Fes clic a \"Calcular Ranking\" per actualitzar-los "
+                   "amb les opcions actuals.")
+    # El cálculo se midió en el trabajo; la visualización se mide aquí, en cada ejecución de la página
+    visualizacion = None
+    if calculo['resultados']:
+        with medir_peticion('mostrar_ranking', activa=medir_rendimiento) as visualizacion:
+            mostrar_resultados_ranking(calculo['resultados'], peticion['tipo_discriminacion'])
+            if peticion['n_escenarios']:
+                with etapa('render_escenarios'):
+                    mostrar_escenarios(calculo['simulacion'])
+    else:
+        st.error("No s'han pogut calcular resultats amb les dades proporcionades.")
+    
+    if calculo['medicion'] is not None and medir_rendimiento:
+        mostrar_panel_rendimiento(calculo['medicion'], visualizacion)
+
 def mostrar_ranking_energetico():
     """Función principal que muestra la interfaz de usuario"""
     st.title("🏆 Ranking Energètic")
@@ -552,10 +1047,24 @@ def mostrar_ranking_energetico():
     # Potencia contratada
     potencia = st.slider(
         "Potència contractada (kW):", 
-        min_value=1.0, max_value=10.0, value=5.75, step=0.05,
+        min_value=1.0, max_value=10.0, value=5.75, step=PASO_POTENCIA,
         help="Potència contractada en kiloWatts (kW)"
     )
     
+    # Potencia óptima: la más barata de cada tarifa que cubre el pico horario de la curva
+    optimizar_potencia = st.checkbox(
+        "Calcular la potència òptima per a cada tarifa",
+        help="Ignora el control lliscant i usa la potència més econòmica que cobreix el consum horari màxim"
+    )
+    potencia_minima = None
+    if optimizar_potencia:
+        potencia_minima = obtener_demanda_maxima()
+        if potencia_minima > 0:
+            st.caption(f"Consum horari màxim de la corba: {potencia_minima:.2f} kW")
+        else:
+            st.warning("No hi ha corba de càrrega; s'usa la potència del control lliscant.")
+            potencia_minima = None
+    
     # Tipo de discriminación
     tipo_discriminacion = st.radio(
         "Tipus de discriminació horària:",
@@ -563,6 +1072,23 @@ def mostrar_ranking_energetico():
         help="Filtra per tarifes amb o sense discriminació horària"
     )
     
+    # Periodo de la curva sobre el que se evalúa el coste eléctrico
+    periodo = st.selectbox(
+        "Període d'avaluació:",
+        options=PERIODOS_EVALUACION,
+        help="Tota la corba de càrrega o els seus últims 12 mesos, portats a un any, o, per a cada "
+             "tarifa, el cost anual mitjà durant la seva permanència (els últims anys de la corba)"
+    )
+    
+    # Con catálogos grandes basta con las mejores compañías: el resto se poda sin calcularlo
+    mostrar_millors = st.number_input(
+        "Mostrar només les millors companyies (0 = totes):",
+        min_value=0, max_value=100, value=0,
+        help="Calcula només les N companyies més barates, descartant sense avaluar-les "
+             "les que no hi poden entrar"
+    )
+    top_k = int(mostrar_millors) or None
+    
     # Consumo eléctrico anual
     consumo_electricidad = st.number_input(
         "Consum anual d'electricitat (kWh):", 
@@ -577,34 +1103,60 @@ def mostrar_ranking_energetico():
         help="Consum anual de gas en kiloWatts hora (kWh)"
     )
     
-    # Botón para calcular
-    if st.button("📊 Calcular Ranking"):
+    # Robustez del ranking frente a variaciones del consumo
+    analizar_escenarios = st.checkbox(
+        "Analitzar la robustesa amb escenaris de consum",
+        help="Avalua les companyies en milers d'anys de consum generats a partir de la corba "
+             "i mostra la probabilitat que cadascuna sigui la més barata"
+    )
+    n_escenarios = ESCENARIOS
+    if analizar_escenarios:
+        n_escenarios = st.slider(
+            "Nombre d'escenaris:",
+            min_value=500, max_value=5000, value=ESCENARIOS, step=500
+        )
+    
+    # Instrumentación opcional: tiempos por etapa, consultas y perfil de la petición
+    medir_rendimiento = st.checkbox(
+        "Mesurar el rendiment",
+        value=instrumentacion_global(),
+        help="Mostra el temps de cada etapa del càlcul i les consultes a la base de dades"
+    )
+    perfilar = medir_rendimiento and st.checkbox(
+        "Perfilar aquest càlcul",
+        help="Desa un perfil (cProfile o pyinstrument) de la propera execució"
+    )
+    
+    # Petición con las opciones actuales (también identifica su trabajo en segundo plano)
+    peticion = {
+        'companias': list(companias_seleccionadas),
+        'consumo_elec': consumo_electricidad,
+        'consumo_gas': consumo_gas,
+        'potencia': potencia,
+        'tipo_discriminacion': tipo_discriminacion,
+        'potencia_minima': potencia_minima,
+        'periodo': periodo,
+        'top_k': top_k,
+        'n_escenarios': n_escenarios if analizar_escenarios else None,
+    }
+    
+    # Botón para calcular: el ranking se calcula en segundo plano y la página
+    # solo muestra su progreso, así que cambiar un control no lo reinicia
+    pulsado = st.button("📊 Calcular Ranking")
+    if pulsado:
         if not companias_seleccionadas:
             st.warning("Si us plau, selecciona almenys una companyia per comparar.")
         else:
-            with st.spinner("Calculant el ranking energètic..."):
-                # Mostrar mensaje de procesamiento
-                calculos_placeholder = st.empty()
-                calculos_placeholder.info("Processant tarifes i calculant costos...")
-                
-                # Calcular ranking
-                resultados = calcular_ranking_combinado(
-                    companias_seleccionadas, 
-                    consumo_electricidad, 
-                    consumo_gas, 
-                    potencia,
-                    tipo_discriminacion
-                )
-                
-                # Eliminar mensaje de procesamiento
-                calculos_placeholder.empty()
-                
-                # Mostrar resultados
-                if resultados:
-                    mostrar_resultados_ranking(resultados, tipo_discriminacion)
-                else:
-                    st.error("No s'han pogut calcular resultats amb les dades proporcionades.")
-    else:
+            trabajo = enviar_peticion_ranking(
+                peticion, medir=medir_rendimiento or instrumentacion_global(), perfilar=perfilar
+            )
+            st.session_state[CLAVE_TRABAJO_RANKING] = trabajo.id
+    
+    # Último trabajo de la sesión: en curso (se sigue su progreso) o terminado
+    trabajo = obtener_trabajo(st.session_state.get(CLAVE_TRABAJO_RANKING))
+    if trabajo is not None:
+        mostrar_trabajo_ranking(trabajo, peticion, medir_rendimiento)
+    elif not pulsado:
         # Mensaje inicial
         st.info("""
         ### 📋 Instruccions
@@ -624,4 +1176,4 @@ if __name__ == "__main__":
         layout="wide"
     )
     
-    mostrar_ranking_energetico()
\ No newline at end of file
+    mostrar_ranking_energetico()
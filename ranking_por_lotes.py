@@ -0,0 +1,215 @@
+"""
+Ranking energético por lotes, sin Streamlit.
+
+Uso:
+    python -m ranking_por_lotes --potencias 3.45,4.6,5.75 --consumos-gas 6000:12000:1000 \
+        --discriminacion Totes "Amb discriminació" --salida resultados.csv
+
+Los rangos se escriben como inicio:fin:paso (fin incluido). El formato de salida
+se deduce de la extensión (.csv o .parquet).
+"""
+import argparse
+import csv
+import itertools
+import sys
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from config import DB_PATH
+from curva_carga import CUPS_POR_DEFECTO
+from motor_ranking import (
+    FILTROS_DISCRIMINACION,
+    anualizar_consumo,
+    cargar_energia_por_periodo,
+    cargar_tarifas_electricas,
+    cargar_tarifas_gas,
+    escalar_costes_series,
+    escalar_energia,
+    evaluar_combinaciones,
+    filtrar_por_discriminacion,
+    resultado_combinacion
+)
+from verificar_db import aplicar_migraciones
+
+COLUMNAS_SALIDA = [
+    'discriminacion', 'potencia', 'consumo_elec', 'consumo_gas', 'posicion',
+    'companyia', 'tarifa_elec', 'coste_elec', 'tarifa_gas', 'coste_gas',
+    'coste_total', 'tipo_discriminacion'
+]
+
+# Alias cortos aceptados en la línea de comandos
+ALIAS_DISCRIMINACION = {
+    'totes': "Totes",
+    'amb': "Amb discriminació",
+    'sense': "Sense discriminació",
+}
+
+
+def valores_rejilla(texto):
+    """Interpreta una lista 'a,b,c' o un rango 'inicio:fin:paso' (fin incluido)"""
+    if ':' in texto:
+        inicio, fin, paso = (float(v) for v in texto.split(':'))
+        n = int(np.floor((fin - inicio) / paso + 1e-9)) + 1
+        return [round(inicio + i * paso, 6) for i in range(n)]
+    return [float(v) for v in texto.split(',') if v.strip()]
+
+
+def normalizar_discriminacion(valor):
+    """Acepta los textos de la interfaz o sus alias cortos"""
+    valor = ALIAS_DISCRIMINACION.get(valor.strip().lower(), valor)
+    if valor != "Totes" and valor not in FILTROS_DISCRIMINACION:
+        raise argparse.ArgumentTypeError(f"Tipo de discriminación desconocido: {valor}")
+    return valor
+
+
+def puntos_rejilla(potencias, consumos_elec, consumos_gas):
+    """
+    Devuelve la lista de puntos (potencia, consumo_elec, consumo_gas) de la
+    rejilla. Sin consumos eléctricos explícitos se usa la curva anualizada (None).
+    """
+    return list(itertools.product(potencias, consumos_elec or [None], consumos_gas))
+
+
+def evaluar_puntos(datos, matriz_elec_total, matriz_gas, puntos, discriminaciones):
+    """
+    Evalúa una lista de puntos de la rejilla con las tarifas y la energía por
+    periodo ya cargadas y devuelve una fila por (punto, compañía). Cada tipo de
+    discriminación se evalúa como un único cálculo matricial. Las compañías sin
+    coste finito en un punto (por ejemplo, solo con tarifas indexadas a una serie
+    de precios que no se ha importado) no se escriben en ese punto.
+
+    Los costes son anuales: la curva se lleva a DIAS_ANIO días (ver
+    anualizar_consumo) y los consumos eléctricos y de gas son anuales.
+    """
+    if not puntos:
+        return []
+    datos = anualizar_consumo(datos)
+
+    energia = np.array([
+        datos['energia'] if consumo is None else escalar_energia(datos['energia'], consumo)
+        for _, consumo, _ in puntos
+    ]).reshape(len(puntos), -1)
+    # El coste indexado se escala con el consumo igual que la energía
+    consumos = [datos['energia'].sum() if consumo is None else consumo for _, consumo, _ in puntos]
+    costes_series = escalar_costes_series(datos['costes_series'], datos['energia'], consumos)
+
+    filas = []
+    for discriminacion in discriminaciones:
+        matriz_elec = filtrar_por_discriminacion(matriz_elec_total, discriminacion)
+        evaluacion = evaluar_combinaciones(
+            matriz_elec, matriz_gas, energia, datos['dias'],
+            [p[0] for p in puntos], [p[2] for p in puntos], costes_series
+        )
+        if not evaluacion['companias']:
+            continue
+
+        orden = np.argsort(evaluacion['coste_total'], axis=1, kind='stable')
+        for i, (potencia, consumo_elec, consumo_gas) in enumerate(puntos):
+            validas = [j for j in orden[i] if np.isfinite(evaluacion['coste_total'][i, j])]
+            for posicion, j in enumerate(validas, start=1):
+                resultado = resultado_combinacion(evaluacion, matriz_elec, matriz_gas, i, j)
+                filas.append({
+                    'discriminacion': discriminacion,
+                    'potencia': potencia,
+                    'consumo_elec': float(energia[i].sum()) if consumo_elec is None else consumo_elec,
+                    'consumo_gas': consumo_gas,
+                    'posicion': posicion,
+                    **{c: resultado[c] for c in COLUMNAS_SALIDA if c in resultado},
+                })
+    return filas
+
+
+def calcular_rejilla(session, companias, potencias, consumos_elec, consumos_gas,
+                     discriminaciones, cups=CUPS_POR_DEFECTO):
+    """
+    Calcula el ranking combinado para todas las combinaciones de la rejilla y
+    devuelve una fila por (punto de la rejilla, compañía).
+    """
+    datos = cargar_energia_por_periodo(session, cups=cups)
+    matriz_elec_total = cargar_tarifas_electricas(session, companias)
+    matriz_gas = cargar_tarifas_gas(session, companias)
+    return evaluar_puntos(
+        datos, matriz_elec_total, matriz_gas,
+        puntos_rejilla(potencias, consumos_elec, consumos_gas), discriminaciones
+    )
+
+
+def escribir_resultados(filas, ruta):
+    """Escribe los resultados en CSV o Parquet según la extensión del fichero"""
+    if ruta.lower().endswith('.parquet'):
+        import pandas as pd
+        pd.DataFrame(filas, columns=COLUMNAS_SALIDA).to_parquet(ruta, index=False)
+        return
+
+    with open(ruta, 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=COLUMNAS_SALIDA)
+        escritor.writeheader()
+        escritor.writerows(filas)
+
+
+def crear_parser():
+    """Define los argumentos de la línea de comandos"""
+    parser = argparse.ArgumentParser(
+        prog="python -m ranking_por_lotes",
+        description="Calcula el ranking energètic combinat per a una graella de paràmetres."
+    )
+    parser.add_argument('--db', default=DB_PATH, help="Ruta de la base de datos SQLite")
+    parser.add_argument('--companias', nargs='*', default=None,
+                        help="Compañías a comparar (por defecto, todas)")
+    parser.add_argument('--cups', default=CUPS_POR_DEFECTO,
+                        help="Punto de suministro cuya curva se usa (por defecto, la curva de la aplicación)")
+    parser.add_argument('--potencias', type=valores_rejilla, default=[5.75],
+                        help="Potencias en kW: lista a,b,c o rango inicio:fin:paso")
+    parser.add_argument('--consumos-elec', type=valores_rejilla, default=None,
+                        help="Consumos eléctricos anuales en kWh (por defecto, el de la curva)")
+    parser.add_argument('--consumos-gas', type=valores_rejilla, default=[9273.0],
+                        help="Consumos de gas anuales en kWh")
+    parser.add_argument('--discriminacion', nargs='+', type=normalizar_discriminacion,
+                        default=["Totes"], help="Totes, amb y/o sense")
+    parser.add_argument('--salida', default='ranking.csv',
+                        help="Fichero de resultados (.csv o .parquet)")
+    parser.add_argument('--procesos', type=int, default=1,
+                        help="Procesos entre los que repartir la rejilla (0 = uno por núcleo)")
+    parser.add_argument('--sin-migrar', action='store_true',
+                        help="No aplicar las migraciones del esquema antes de calcular")
+    return parser
+
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos"""
+    args = crear_parser().parse_args(argv)
+    inicio = time.perf_counter()
+
+    engine = create_engine(f"sqlite:///{args.db}")
+    try:
+        with Session(engine) as s:
+            if not args.sin_migrar:
+                aplicar_migraciones(s)
+            if args.procesos == 1:
+                filas = calcular_rejilla(
+                    s, args.companias, args.potencias, args.consumos_elec,
+                    args.consumos_gas, args.discriminacion, args.cups
+                )
+        if args.procesos != 1:
+            from barrido_ranking import calcular_barrido
+            filas = calcular_barrido(
+                args.potencias, args.consumos_elec, args.consumos_gas, args.companias,
+                args.discriminacion, args.cups, args.db, args.procesos or None
+            ).to_dict('records')
+        escribir_resultados(filas, args.salida)
+    except Exception as e:
+        print(f"Error al calcular el ranking: {e}", file=sys.stderr)
+        return 1
+    finally:
+        engine.dispose()
+
+    print(f"{len(filas)} filas escritas en {args.salida} "
+          f"({time.perf_counter() - inicio:.2f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
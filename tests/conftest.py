@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos de la aplicación están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def base_sintetica(tmp_path_factory):
+    """
+    Base de datos sintética de benchmark_ranking ya migrada y activa en
+    conexiones_bd, con las cachés en disco en un directorio temporal
+    """
+    import benchmark_ranking
+    import cache_resultados
+    import calendario_periodos
+    import conexiones_bd
+    import precios_horarios
+    from config import DB_PATH
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from verificar_db import aplicar_migraciones
+
+    directorio = tmp_path_factory.mktemp('base_sintetica')
+    ruta = str(directorio / 'datos_energia.db')
+    with pytest.MonkeyPatch.context() as mp:
+        for modulo in (calendario_periodos, cache_resultados, precios_horarios):
+            mp.setattr(modulo, 'CACHE_DIR', str(directorio))
+        datos = benchmark_ranking.generar_base_datos(ruta, companias=12, tarifas=120, anios=2, festivos=5)
+        engine = create_engine(f"sqlite:///{ruta}")
+        try:
+            with Session(engine) as s:
+                aplicar_migraciones(s)
+        finally:
+            engine.dispose()
+        conexiones_bd.usar_base_datos(ruta)
+        try:
+            yield datos
+        finally:
+            conexiones_bd.usar_base_datos(DB_PATH)
@@ -0,0 +1,38 @@
+import sqlite3
+
+from sqlalchemy import text
+
+import conexiones_bd
+from cache_tarifas import CacheVersionada
+from config import DB_PATH, DB_SCHEMA
+from verificar_db import aplicar_migraciones
+
+
+def crear_base(ruta, tarifa):
+    con = sqlite3.connect(ruta)
+    con.executescript(DB_SCHEMA)
+    con.close()
+    conexiones_bd.usar_base_datos(str(ruta))
+    with conexiones_bd.sesion_escritura() as s:
+        aplicar_migraciones(s)
+        s.execute(text("INSERT INTO tarifas_gas (companyia, tarifa) VALUES ('A', :tarifa)"), {"tarifa": tarifa})
+        s.commit()
+
+
+def test_cambiar_de_base_vacia_las_caches(tmp_path):
+    cache = CacheVersionada('tarifas_gas')
+
+    def tarifas():
+        with conexiones_bd.sesion_lectura() as s:
+            return cache.obtener(s, 'tarifas', lambda: s.execute(text("SELECT tarifa FROM tarifas_gas")).scalar())
+
+    try:
+        # Las dos bases tienen las mismas versiones de tablas
+        crear_base(tmp_path / 'a.db', 'Tarifa A')
+        crear_base(tmp_path / 'b.db', 'Tarifa B')
+        conexiones_bd.usar_base_datos(str(tmp_path / 'a.db'))
+        assert tarifas() == 'Tarifa A'
+        conexiones_bd.usar_base_datos(str(tmp_path / 'b.db'))
+        assert tarifas() == 'Tarifa B'
+    finally:
+        conexiones_bd.usar_base_datos(DB_PATH)
@@ -0,0 +1,120 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from config import DB_SCHEMA
+from ingesta_consumos import hora_civil, ingerir_csv
+from verificar_db import SQL_TIMESTAMP_CONSUMO, aplicar_migraciones
+
+
+@pytest.fixture
+def sesion(tmp_path):
+    ruta = tmp_path / 'consumos.db'
+    con = sqlite3.connect(ruta)
+    con.executescript(DB_SCHEMA)
+    con.close()
+    engine = create_engine(f"sqlite:///{ruta}")
+    with Session(engine) as s:
+        aplicar_migraciones(s)
+        yield s
+    engine.dispose()
+
+
+def escribir_csv(ruta, filas):
+    ruta.write_text("Fecha;Hora;AE_kWh\n" + "".join(f"{f};{h};{v}\n" for f, h, v in filas), encoding='utf-8')
+    return str(ruta)
+
+
+def filas_consumos(s):
+    return s.execute(text("SELECT Fecha, Hora, AE_kWh FROM consumos ORDER BY timestamp")).fetchall()
+
+
+def test_hora_civil_hhmm():
+    assert hora_civil('01:00', 24) == 1
+    assert hora_civil('23:00', 24) == 23
+    assert hora_civil('24:00', 24) == 24
+    # Última hora del día anterior, como se guarda en consumos
+    assert hora_civil('00:00', 24) == 0
+    with pytest.raises(ValueError):
+        hora_civil('25:00', 24)
+
+
+def test_hora_civil_numerada():
+    assert [hora_civil(str(n), 24) for n in (1, 2, 3, 24)] == [1, 2, 3, 24]
+    # Día de 23 horas: no existe la hora que acaba a las 03:00
+    assert [hora_civil(str(n), 23) for n in (1, 2, 3, 23)] == [1, 2, 4, 24]
+    # Día de 25 horas: la hora que acaba a las 03:00 se repite
+    assert [hora_civil(str(n), 25) for n in (1, 2, 3, 4, 5, 25)] == [1, 2, 3, 3, 4, 24]
+    with pytest.raises(ValueError):
+        hora_civil('24', 23)
+
+
+@pytest.mark.parametrize('formato', ['24:00', '00:00', 'numerada'])
+def test_formatos_de_hora_equivalentes(sesion, tmp_path, formato):
+    if formato == 'numerada':
+        filas = [('15/01/2024', str(h), h) for h in range(1, 25)]
+    elif formato == '24:00':
+        filas = [('15/01/2024', f"{h:02d}:00", h) for h in range(1, 25)]
+    else:
+        filas = [('15/01/2024', f"{h:02d}:00", h) for h in range(1, 24)] + [('16/01/2024', '00:00', 24)]
+    resumen = ingerir_csv(sesion, escribir_csv(tmp_path / 'curva.csv', filas))
+
+    # Mismas etiquetas que las filas ya guardadas: '01:00' ... '23:00' y '00:00' del día siguiente
+    assert filas_consumos(sesion) == (
+        [('15/01/2024', f"{h:02d}:00", float(h)) for h in range(1, 24)] + [('16/01/2024', '00:00', 24.0)]
+    )
+    assert resumen['filas_escritas'] == 24
+    # El timestamp coincide con el que la migración calcula desde Fecha y Hora
+    distintos = sesion.execute(text(
+        f"SELECT COUNT(*) FROM consumos WHERE timestamp != {SQL_TIMESTAMP_CONSUMO.format(p='')}"
+    )).scalar()
+    assert distintos == 0
+
+
+@pytest.mark.parametrize('numerada', [True, False])
+def test_dia_de_23_horas(sesion, tmp_path, numerada):
+    horas = [1, 2] + list(range(4, 25))
+    filas = [('31/03/2024', str(n) if numerada else f"{h:02d}:00", 1.0) for n, h in enumerate(horas, start=1)]
+    resumen = ingerir_csv(sesion, escribir_csv(tmp_path / 'curva.csv', filas))
+
+    assert resumen['dias_anomalos'] == 0
+    guardadas = [(f, h) for f, h, _ in filas_consumos(sesion)]
+    assert len(guardadas) == 23
+    assert ('31/03/2024', '03:00') not in guardadas
+    assert guardadas[-1] == ('01/04/2024', '00:00')
+
+
+@pytest.mark.parametrize('numerada', [True, False])
+def test_dia_de_25_horas(sesion, tmp_path, numerada):
+    horas = [1, 2, 3, 3] + list(range(4, 25))
+    filas = [('27/10/2024', str(n) if numerada else f"{h:02d}:00", float(n)) for n, h in enumerate(horas, start=1)]
+    resumen = ingerir_csv(sesion, escribir_csv(tmp_path / 'curva.csv', filas))
+
+    assert resumen['dias_anomalos'] == 0
+    guardadas = filas_consumos(sesion)
+    assert len(guardadas) == 24
+    # Las dos lecturas de la hora repetida se suman
+    assert ('27/10/2024', '03:00', 3.0 + 4.0) in guardadas
+    assert guardadas[-1] == ('28/10/2024', '00:00', 25.0)
+
+
+def version_y_triggers(s):
+    version = s.execute(text("SELECT version FROM versiones_tablas WHERE tabla = 'consumos'")).scalar()
+    triggers = s.execute(text(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_version_consumos_%'"
+    )).scalar()
+    return version, triggers
+
+
+def test_version_una_vez_por_fichero(sesion, tmp_path):
+    version, triggers = version_y_triggers(sesion)
+    filas = [('15/01/2024', f"{h:02d}:00", h) for h in range(1, 25)]
+    ingerir_csv(sesion, escribir_csv(tmp_path / 'curva.csv', filas))
+    assert version_y_triggers(sesion) == (version + 1, triggers)
+
+    # Si la ingesta falla, el rollback deja la versión y los triggers como estaban
+    with pytest.raises(OSError):
+        ingerir_csv(sesion, str(tmp_path / 'no_existe.csv'))
+    assert version_y_triggers(sesion) == (version + 1, triggers)
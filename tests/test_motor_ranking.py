@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from motor_ranking import (
+    COLUMNAS_GAS,
+    COLUMNAS_TEXTO_GAS,
+    DIAS_ANIO,
+    anualizar_consumo,
+    calcular_costes_electricidad,
+    calcular_costes_gas,
+    evaluar_combinaciones,
+    matriz_desde_registros,
+)
+
+# Tarifa fija sin discriminación con números redondos:
+# IE 5 % e IVA 10 % -> factor_ie = 1.05 * 1.1 = 1.155
+TARIFA_FIJA = {
+    'companyia': 'A', 'tarifa': 'Fija', 'tipo_discriminacion': 'sin_discriminacion',
+    'termino_potencia_punta': 36.5, 'termino_potencia_valle': 3.65,  # 0.11 €/kW y día
+    'termino_energia': 0.15, 'alquiler_contador': 0.02, 'financiacion_bono_social': 0.01,
+    'descuento': 0.01, 'impuesto_electricidad': 5.0, 'iva': 10.0,
+}
+
+TARIFA_GAS = {
+    'companyia': 'A', 'tarifa': 'Gas', 'termino_fijo': 0.3, 'alquiler_contador': 0.1,
+    'termino_energia': 0.06, 'descuento': 10.0, 'impuesto_ieh': 0.002, 'iva': 10.0,
+}
+
+ENERGIA = np.array([100.0, 200.0, 300.0])
+
+
+def test_coste_tarifa_fija():
+    # fijo:     bono 0.01 * 1.155 + alquiler 0.02 * 1.1          = 0.03355 €/día
+    # potencia: 0.11 * 1.155                                     = 0.12705 €/kW y día
+    # energía:  (0.15 - 0.01 de descuento por kWh) * 1.155       = 0.1617 €/kWh
+    # 30 * (0.03355 + 0.12705 * 4) + 600 * 0.1617 = 16.2525 + 97.02
+    matriz = matriz_desde_registros([TARIFA_FIJA])
+    coste = calcular_costes_electricidad(matriz, ENERGIA, 30, 4.0)
+    assert coste == pytest.approx([113.2725])
+
+
+def test_descuento_electricidad_por_kwh():
+    tarifa = {
+        'companyia': 'A', 'tarifa': 'DH', 'tipo_discriminacion': 'con_discriminacion',
+        'termino_energia_punta': 0.2, 'termino_energia_plana': 0.1, 'termino_energia_valle': 0.05,
+    }
+    sin_descuento = calcular_costes_electricidad(matriz_desde_registros([tarifa]), ENERGIA, 30, 4.0)
+    con_descuento = calcular_costes_electricidad(
+        matriz_desde_registros([dict(tarifa, descuento=0.01)]), ENERGIA, 30, 4.0
+    )
+    # 100 * 0.2 + 200 * 0.1 + 300 * 0.05; el descuento resta 0.01 €/kWh a los 600 kWh
+    assert sin_descuento == pytest.approx([55.0])
+    assert con_descuento == pytest.approx([49.0])
+
+
+def test_coste_tarifa_indexada():
+    tarifa = {
+        'companyia': 'A', 'tarifa': 'Indexada', 'tipo_discriminacion': 'sin_discriminacion',
+        'serie_precios': 'pvpc', 'margen_indexado': 0.01,
+    }
+    matriz = matriz_desde_registros([tarifa])
+    # 600 kWh * 0.01 de margen + 30 € a precio de mercado
+    assert calcular_costes_electricidad(matriz, ENERGIA, 30, 4.0, {'pvpc': 30.0}) == pytest.approx([36.0])
+    # Sin la serie importada la tarifa queda sin calcular
+    assert np.isnan(calcular_costes_electricidad(matriz, ENERGIA, 30, 4.0)).all()
+
+
+def test_coste_tarifa_gas():
+    # fijo:    (0.3 + 0.1) * 1.1                           = 0.44 €/día
+    # energía: (0.06 * (1 - 10 % de descuento) + 0.002) * 1.1 = 0.0616 €/kWh
+    matriz = matriz_desde_registros([TARIFA_GAS], COLUMNAS_GAS, COLUMNAS_TEXTO_GAS)
+    assert calcular_costes_gas(matriz, 5000) == pytest.approx([365 * 0.44 + 5000 * 0.0616])
+
+
+def test_anualizar_consumo():
+    datos = anualizar_consumo({'energia': ENERGIA, 'dias': 73, 'costes_series': {'pvpc': 10.0}})
+    assert datos['dias'] == DIAS_ANIO
+    assert datos['energia'] == pytest.approx(ENERGIA * 5)
+    assert datos['costes_series']['pvpc'] == pytest.approx(50.0)
+
+
+def test_evaluar_combinaciones_mismo_periodo():
+    matriz_elec = matriz_desde_registros([TARIFA_FIJA])
+    matriz_gas = matriz_desde_registros([TARIFA_GAS], COLUMNAS_GAS, COLUMNAS_TEXTO_GAS)
+    evaluacion = evaluar_combinaciones(matriz_elec, matriz_gas, ENERGIA, 30, 4.0, 5000)
+    # Electricidad y gas sobre los mismos 30 días
+    assert evaluacion['coste_elec'][0, 0] == pytest.approx(113.2725)
+    assert evaluacion['coste_gas'][0, 0] == pytest.approx(30 * 0.44 + 5000 * 0.0616)
+    assert evaluacion['coste_total'][0, 0] == pytest.approx(113.2725 + 30 * 0.44 + 5000 * 0.0616)
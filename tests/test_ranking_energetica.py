@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip('streamlit')
+
+import ranking_energetica  # noqa: E402
+
+POTENCIA = 5.75
+CONSUMO_GAS = 9273
+
+
+@pytest.fixture(scope='module')
+def companias(base_sintetica):
+    return base_sintetica['companias'] + ["Tarifa Referencia"]
+
+
+def regulares(resultados):
+    return [r for r in resultados if not r['es_referencia']]
+
+
+@pytest.mark.parametrize('periodo', ranking_energetica.PERIODOS_EVALUACION)
+@pytest.mark.parametrize('k', [1, 2, 3, 10])
+def test_top_k_igual_que_ranking_completo(companias, periodo, k):
+    completo = ranking_energetica.calcular_ranking_combinado_sin_cache(
+        companias, 0, CONSUMO_GAS, POTENCIA, periodo=periodo
+    )
+    top = ranking_energetica.calcular_ranking_combinado_sin_cache(
+        companias, 0, CONSUMO_GAS, POTENCIA, periodo=periodo, top_k=k
+    )
+    assert regulares(top) == regulares(completo)[:k]
+    assert any(r['es_referencia'] for r in top)
+
+
+def test_hilos_ranking_aplica_el_umbral(monkeypatch):
+    monkeypatch.delenv(ranking_energetica.VARIABLE_HILOS, raising=False)
+    por_hilo = ranking_energetica.COMPANIAS_POR_HILO
+    # Aunque se pidan explícitamente, pocos hilos o compañías dejan el cálculo secuencial
+    assert ranking_energetica.hilos_ranking(10, 4) is None
+    assert ranking_energetica.hilos_ranking(3 * por_hilo, 1) is None
+    assert ranking_energetica.hilos_ranking(3 * por_hilo, 4) == 3
+    assert ranking_energetica.hilos_ranking(10 * por_hilo, 4) == 4
+
+
+@pytest.mark.parametrize('periodo', ranking_energetica.PERIODOS_EVALUACION)
+def test_ranking_concurrente_igual_que_secuencial(companias, periodo, monkeypatch):
+    # Con pocas compañías el umbral dejaría el cálculo secuencial
+    monkeypatch.setattr(ranking_energetica, 'COMPANIAS_POR_HILO', 1)
+    secuencial = ranking_energetica.calcular_ranking_combinado_sin_cache(
+        companias, 0, CONSUMO_GAS, POTENCIA, potencia_minima=4.0, periodo=periodo
+    )
+    concurrente = ranking_energetica.calcular_ranking_combinado_sin_cache(
+        companias, 0, CONSUMO_GAS, POTENCIA, potencia_minima=4.0, periodo=periodo, hilos=3
+    )
+    assert concurrente == secuencial
@@ -0,0 +1,156 @@
+"""
+Trabajos en segundo plano (por ejemplo, un ranking) con progreso consultable.
+
+Un trabajo se envía con un identificador, normalmente el hash de sus entradas
+(ver cache_resultados.clave_resultado), y se ejecuta en un pool de hilos del
+proceso. Enviar de nuevo el mismo identificador devuelve el trabajo existente:
+una ejecución de la página que se repite (un rerun de Streamlit) se engancha
+al cálculo en curso en lugar de empezarlo de nuevo, y los trabajos terminados
+se conservan (hasta MAXIMO_TERMINADOS) para recuperar su resultado.
+
+Dentro del trabajo, informar_progreso() y registrar_aviso() actualizan el
+trabajo en curso; fuera de un trabajo solo consultan una variable de contexto
+y no hacen nada.
+"""
+import contextvars
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Trabajos ejecutándose a la vez; el resto esperan en cola
+TRABAJOS_SIMULTANEOS = 2
+
+# Trabajos terminados (o con error) que se conservan, los más recientes
+MAXIMO_TERMINADOS = 32
+
+_TRABAJO = contextvars.ContextVar('trabajo', default=None)
+_TRABAJOS = OrderedDict()
+_LOCK = threading.Lock()
+_EJECUTOR = ThreadPoolExecutor(max_workers=TRABAJOS_SIMULTANEOS, thread_name_prefix='trabajo')
+
+
+class Trabajo:
+    """Estado, progreso, avisos y resultado de un trabajo en segundo plano"""
+
+    def __init__(self, id, nombre):
+        self.id = id
+        self.nombre = nombre
+        self.estado = 'en_cola'
+        self.descripcion = ''
+        self.hechas = 0
+        self.total = 0
+        self.avisos = []
+        self.resultado = None
+        self.error = None
+        self.creado = time.time()
+        self.inicio = None
+        self.fin = None
+        self._lock = threading.Lock()
+        self._terminado = threading.Event()
+
+    @property
+    def terminado(self):
+        return self._terminado.is_set()
+
+    def esperar(self, segundos=None):
+        """Espera a que termine el trabajo (como mucho los segundos indicados); indica si ha terminado"""
+        return self._terminado.wait(segundos)
+
+    def progreso(self):
+        """Copia coherente del estado y el progreso, para mostrarla mientras el trabajo avanza"""
+        with self._lock:
+            return {
+                'estado': self.estado,
+                'descripcion': self.descripcion,
+                'hechas': self.hechas,
+                'total': self.total,
+                'fraccion': min(self.hechas / self.total, 1.0) if self.total else 0.0,
+                'segundos': (self.fin or time.time()) - (self.inicio or time.time()),
+                'avisos': list(self.avisos),
+            }
+
+    def _ejecutar(self, funcion, args, kwargs):
+        with self._lock:
+            self.estado = 'en_curso'
+            self.inicio = time.time()
+        token = _TRABAJO.set(self)
+        try:
+            resultado = funcion(*args, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                self.estado, self.error = 'error', str(e)
+        else:
+            with self._lock:
+                self.estado, self.resultado = 'terminado', resultado
+        finally:
+            _TRABAJO.reset(token)
+            with self._lock:
+                self.fin = time.time()
+            self._terminado.set()
+            _expulsar_terminados()
+
+
+def enviar_trabajo(id, nombre, funcion, *args, reutilizar_terminado=True, **kwargs):
+    """
+    Ejecuta funcion(*args, **kwargs) en segundo plano como el trabajo id y lo
+    devuelve. Si ya hay un trabajo con ese id en cola, en curso o terminado,
+    devuelve ese trabajo sin ejecutar nada; uno que acabó con error (o que
+    terminó, si no reutilizar_terminado) se vuelve a ejecutar.
+    """
+    with _LOCK:
+        trabajo = _TRABAJOS.get(id)
+        reutilizables = ('en_cola', 'en_curso', 'terminado') if reutilizar_terminado else ('en_cola', 'en_curso')
+        if trabajo is not None and trabajo.estado in reutilizables:
+            _TRABAJOS.move_to_end(id)
+            return trabajo
+        trabajo = Trabajo(id, nombre)
+        _TRABAJOS[id] = trabajo
+    _EJECUTOR.submit(trabajo._ejecutar, funcion, args, kwargs)
+    return trabajo
+
+
+def obtener_trabajo(id):
+    """Devuelve el trabajo con ese id, o None si no existe o ya se ha descartado"""
+    if id is None:
+        return None
+    with _LOCK:
+        return _TRABAJOS.get(id)
+
+
+def _expulsar_terminados():
+    """Descarta los trabajos terminados más antiguos por encima de MAXIMO_TERMINADOS"""
+    with _LOCK:
+        terminados = [id for id, trabajo in _TRABAJOS.items() if trabajo.terminado]
+        for id in terminados[:max(len(terminados) - MAXIMO_TERMINADOS, 0)]:
+            del _TRABAJOS[id]
+
+
+def informar_progreso(descripcion=None, hechas=None, total=None):
+    """Actualiza la descripción y las unidades hechas y totales del trabajo en curso (si lo hay)"""
+    trabajo = _TRABAJO.get()
+    if trabajo is None:
+        return
+    with trabajo._lock:
+        if descripcion is not None:
+            trabajo.descripcion = descripcion
+        if total is not None:
+            trabajo.total = total
+        if hechas is not None:
+            trabajo.hechas = hechas
+
+
+def registrar_aviso(mensaje):
+    """
+    Guarda un aviso (por ejemplo, un error recuperado) en el trabajo en curso
+    para mostrarlo con su resultado. Devuelve False si no hay trabajo en curso.
+    """
+    trabajo = _TRABAJO.get()
+    if trabajo is None:
+        return False
+    with trabajo._lock:
+        trabajo.avisos.append(mensaje)
+    return True
+
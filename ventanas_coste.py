@@ -0,0 +1,156 @@
+"""
+Evaluación de costes sobre ventanas de fechas arbitrarias de la curva de carga:
+los últimos 12 meses, ventanas móviles o el plazo completo de cada contrato.
+
+La curva se reduce una sola vez a sumas acumuladas diarias de energía por
+periodo, de días con datos y de coste a precio de mercado en cada serie de
+precios. La energía, los días y el coste indexado de cualquier ventana se
+obtienen con dos restas, sin volver a recorrer las horas de consumos.
+"""
+import calendar
+from datetime import date, timedelta
+
+import numpy as np
+
+from calendario_periodos import PERIODOS, calendario_anios
+from curva_carga import CUPS_POR_DEFECTO, HORAS_DIA, curva_horaria
+from motor_ranking import coste_desde_partes, coste_indexado
+from precios_horarios import precios_completos, precios_horarios, series_precios
+
+
+def acumulados_curva(session, cups=CUPS_POR_DEFECTO, curva=None, series=None):
+    """
+    Devuelve las sumas acumuladas diarias de la curva: 'energia' (dias + 1, 3),
+    'dias' (dias + 1,) y 'costes_series', {serie: (dias + 1,)} con el coste a
+    precio de mercado de cada serie (todas las importadas si es None), de modo
+    que la ventana de días [a, b) vale acumulado[b] - acumulado[a]. También el
+    primer día del índice y el primer y el último día con datos. Devuelve None
+    si no hay consumos.
+    """
+    if curva is None:
+        curva = curva_horaria(session, cups=cups)
+    if curva is None:
+        return None
+
+    periodos = calendario_anios(session, curva['año_inicio'], curva['año_fin'])
+    n_dias = len(curva['kwh']) // HORAS_DIA
+    dia_de_hora = np.arange(n_dias * HORAS_DIA) // HORAS_DIA
+    energia_diaria = np.bincount(
+        dia_de_hora * len(PERIODOS) + periodos, weights=curva['kwh'], minlength=n_dias * len(PERIODOS)
+    ).reshape(n_dias, len(PERIODOS))
+    con_datos = curva['presente'].reshape(n_dias, HORAS_DIA).any(axis=1)
+    costes_series = {}
+    for serie in (series_precios(session) if series is None else series):
+        precios = precios_completos(
+            precios_horarios(session, serie, curva['año_inicio'], curva['año_fin']), curva['kwh'] != 0, serie
+        )
+        coste_diario = (curva['kwh'] * precios).reshape(n_dias, HORAS_DIA).sum(axis=1)
+        costes_series[serie] = np.concatenate([[0.0], np.cumsum(coste_diario)])
+
+    inicio = date(curva['año_inicio'], 1, 1)
+    dias_con_datos = np.flatnonzero(con_datos)
+    return {
+        'inicio': inicio,
+        'primer_dia': inicio + timedelta(days=int(dias_con_datos[0])),
+        'ultimo_dia': inicio + timedelta(days=int(dias_con_datos[-1])),
+        'energia': np.vstack([np.zeros(len(PERIODOS)), np.cumsum(energia_diaria, axis=0)]),
+        'dias': np.concatenate([[0], np.cumsum(con_datos)]).astype(np.int64),
+        'costes_series': costes_series,
+    }
+
+
+def sumar_meses(fecha, meses):
+    """Suma (o resta) meses naturales a una fecha, ajustando al último día del mes si hace falta"""
+    año, mes = divmod(fecha.year * 12 + fecha.month - 1 + meses, 12)
+    return date(año, mes + 1, min(fecha.day, calendar.monthrange(año, mes + 1)[1]))
+
+
+def indice_dia(acumulados, fecha):
+    """Posición de la fecha en las sumas acumuladas, limitada al periodo cubierto"""
+    n_dias = len(acumulados['dias']) - 1
+    return min(max((fecha - acumulados['inicio']).days, 0), n_dias)
+
+
+def energia_ventana(acumulados, desde, hasta):
+    """Energía por periodo (3,), días con datos y costes por serie de la ventana [desde, hasta), en O(1)"""
+    a, b = indice_dia(acumulados, desde), indice_dia(acumulados, hasta)
+    b = max(a, b)
+    return {
+        'energia': acumulados['energia'][b] - acumulados['energia'][a],
+        'dias': int(acumulados['dias'][b] - acumulados['dias'][a]),
+        'costes_series': {serie: float(c[b] - c[a]) for serie, c in acumulados['costes_series'].items()},
+    }
+
+
+def energia_ventanas(acumulados, ventanas):
+    """Igual que energia_ventana para una lista de ventanas: energía (n, 3), días (n,) y costes (n,)"""
+    a = np.array([indice_dia(acumulados, desde) for desde, _ in ventanas], dtype=np.int64)
+    b = np.maximum(a, [indice_dia(acumulados, hasta) for _, hasta in ventanas])
+    return {
+        'energia': acumulados['energia'][b] - acumulados['energia'][a],
+        'dias': acumulados['dias'][b] - acumulados['dias'][a],
+        'costes_series': {serie: c[b] - c[a] for serie, c in acumulados['costes_series'].items()},
+    }
+
+
+def ultimos_meses(acumulados, meses=12):
+    """Ventana de los últimos meses de la curva, terminada el día siguiente al último con datos"""
+    hasta = acumulados['ultimo_dia'] + timedelta(days=1)
+    return sumar_meses(hasta, -meses), hasta
+
+
+def ventanas_moviles(acumulados, meses=12, paso_meses=1):
+    """
+    Ventanas de meses naturales completas dentro de la curva, desplazadas
+    paso_meses: [ene-dic], [feb-ene], ... La primera empieza el primer día de
+    mes con datos y la última termina el último día con datos.
+    """
+    primer_dia = acumulados['primer_dia']
+    desde = primer_dia if primer_dia.day == 1 else sumar_meses(primer_dia.replace(day=1), 1)
+    fin = acumulados['ultimo_dia'] + timedelta(days=1)
+    ventanas = []
+    while sumar_meses(desde, meses) <= fin:
+        ventanas.append((desde, sumar_meses(desde, meses)))
+        desde = sumar_meses(desde, paso_meses)
+    return ventanas
+
+
+def costes_ventanas(partes, acumulados, ventanas, potencia):
+    """
+    Coste de todas las tarifas (partes de descomponer_coste_electricidad) en
+    cada ventana: matriz (ventanas, tarifas). Cada ventana cuesta O(tarifas).
+    """
+    datos = energia_ventanas(acumulados, ventanas)
+    return coste_desde_partes(partes, datos['energia'], datos['dias'], potencia, datos['costes_series'])
+
+
+def anios_contrato(matriz):
+    """
+    Años durante los que se paga cada tarifa: su duración si tiene permanencia
+    y 1 si no la tiene (se puede cambiar de tarifa cada año)
+    """
+    duracion = np.maximum(np.rint(matriz['duracion_anios']), 1)
+    return np.where(matriz['permanencia'] > 0, duracion, 1.0)
+
+
+def terminos_contrato(partes, acumulados, anios):
+    """
+    Términos parciales anualizados (ver motor_ranking.terminos_electricidad) de
+    cada tarifa evaluada sobre su plazo de contrato: los últimos anios[i] años
+    de la curva. Si la curva no cubre todo el plazo, el consumo de los días con
+    datos se extrapola a los días del plazo.
+    """
+    fijo = np.empty(len(anios))
+    por_kw = np.empty(len(anios))
+    energia = np.empty(len(anios))
+    for n in np.unique(anios):
+        tarifas = anios == n
+        desde, hasta = ultimos_meses(acumulados, int(n) * 12)
+        datos = energia_ventana(acumulados, desde, hasta)
+        dias_plazo = (hasta - desde).days
+        escala = dias_plazo / datos['dias'] if datos['dias'] else 0.0
+        fijo[tarifas] = dias_plazo * partes['fijo_dia'][tarifas] / n
+        por_kw[tarifas] = dias_plazo * partes['por_kw_dia'][tarifas] / n
+        indexado = coste_indexado(partes, datos['costes_series'])[tarifas]
+        energia[tarifas] = escala * (partes['por_kwh'][tarifas] @ datos['energia'] + indexado) / n
+    return {'fijo': fijo, 'por_kw': por_kw, 'energia': energia}
@@ -1,9 +1,8 @@
-import streamlit as st
 import os
 import sqlite3
+import uuid
 from sqlalchemy import text, create_engine
 from datetime import datetime
-import pandas as pd
 
 # Variable global para seguir el estado de verificación
 _DB_VERIFICADA = False
@@ -98,22 +97,66 @@ def verificar_y_corregir_bd():
     if _DB_VERIFICADA:
         return
     
-    # Indicar que ya hemos verificado la BD
-    _DB_VERIFICADA = True
+    # Con el esquema al día basta leer PRAGMA user_version en una conexión de
+    # lectura; solo si hay migraciones pendientes se toma el escritor único
+    from conexiones_bd import sesion_escritura, sesion_lectura
     
-    # Conectar con la BD a través de Streamlit
-    conn = st.connection("energia_db", type="sql")
+    with sesion_lectura() as s:
+        pendiente = version_esquema(s) < VERSION_ESQUEMA
+    if pendiente:
+        with sesion_escritura() as s:
+            aplicar_migraciones(s)
     
-    with conn.session as s:
-        # 1. Verificar tabla días festivos
-        verificar_tabla_dias_festivos(s)
-        
-        # 2. Migrar datos de termino_energia si es necesario
-        migrar_datos_termino_energia(s)
+    # Indicar que ya hemos verificado la BD (si una migración falla, se reintenta)
+    _DB_VERIFICADA = True
     
     # Opcional: Registrar verificación completa (solo una vez)
     print("Verificación inicial de la base de datos completada.")
 
+# Espera máxima (ms) por el bloqueo exclusivo mientras otro proceso migra
+ESPERA_BLOQUEO_MS = 60000
+
+def version_esquema(session):
+    """Devuelve la versión del esquema registrada en PRAGMA user_version"""
+    return session.execute(text("PRAGMA user_version")).scalar() or 0
+
+def aplicar_migraciones(session):
+    """
+    Aplica sobre una sesión cualquiera (Streamlit o SQLAlchemy) las migraciones
+    pendientes del esquema. No depende de Streamlit, de modo que también la
+    usan los procesos por lotes.
+    
+    Si el esquema está al día solo se lee PRAGMA user_version, sin escribir.
+    Si no, las migraciones pendientes se aplican en una única transacción bajo
+    bloqueo exclusivo, de modo que varios procesos que arrancan a la vez no las
+    repiten: los que esperan el bloqueo vuelven a leer la versión al obtenerlo.
+    Si una migración falla se deshace toda la transacción y se relanza el error.
+    """
+    if version_esquema(session) >= VERSION_ESQUEMA:
+        return
+    
+    session.execute(text(f"PRAGMA busy_timeout = {ESPERA_BLOQUEO_MS}"))
+    session.execute(text("BEGIN EXCLUSIVE"))
+    try:
+        # Otro proceso puede haber migrado mientras se esperaba el bloqueo
+        version = version_esquema(session)
+        if version >= VERSION_ESQUEMA:
+            session.rollback()
+            return
+        
+        for numero, migracion in MIGRACIONES:
+            if numero > version:
+                migracion(session)
+        session.execute(text(f"PRAGMA user_version = {VERSION_ESQUEMA}"))
+        session.commit()
+        print(f"Esquema de la base de datos migrado de la versión {version} a {VERSION_ESQUEMA}.")
+    except Exception as e:
+        # Sin cambios de versión ni esquema a medias: el arranque falla y las
+        # migraciones se reintentan en el siguiente
+        session.rollback()
+        print(f"Error al aplicar las migraciones: {e}")
+        raise
+
 def verificar_tabla_dias_festivos(session):
     """
     Verifica que existe la tabla de días festivos y la crea si no existe
@@ -132,10 +175,13 @@ def verificar_tabla_dias_festivos(session):
                     periodo_asignado TEXT DEFAULT 'valle' CHECK(periodo_asignado IN ('punta', 'llano', 'valle'))
                 )
             """))
-            session.commit()
             
             # Insertar algunos festivos nacionales para el año actual
-            anyo_actual = st.session_state.get('anyo_actual', 2024)
+            try:
+                import streamlit as st
+                anyo_actual = st.session_state.get('anyo_actual', 2024)
+            except Exception:
+                anyo_actual = 2024
             festivos = [
                 (f"01/01/{anyo_actual}", "Año Nuevo", "valle"),
                 (f"06/01/{anyo_actual}", "Reyes Magos", "valle"),
@@ -147,16 +193,17 @@ def verificar_tabla_dias_festivos(session):
                 (f"25/12/{anyo_actual}", "Navidad", "valle")
             ]
             
-            for festivo in festivos:
+            for fecha, descripcion, periodo in festivos:
                 session.execute(
-                    text("INSERT INTO dias_festivos (fecha, descripcion, periodo_asignado) VALUES (?, ?, ?)"),
-                    festivo
+                    text("INSERT INTO dias_festivos (fecha, descripcion, periodo_asignado) "
+                         "VALUES (:fecha, :descripcion, :periodo)"),
+                    {"fecha": fecha, "descripcion": descripcion, "periodo": periodo}
                 )
-            session.commit()
     except Exception as e:
         print(f"Error en verificar_tabla_dias_festivos: {e}")
         import traceback
         traceback.print_exc()
+        raise
 
 def migrar_datos_termino_energia(session):
     """
@@ -180,11 +227,276 @@ def migrar_datos_termino_energia(session):
                 WHERE termino_energia > 0 
                 AND (termino_energia_punta = 0 OR termino_energia_plana = 0 OR termino_energia_valle = 0)
             """))
-            session.commit()
     except Exception as e:
         print(f"Error en migrar_datos_termino_energia: {e}")
         import traceback
         traceback.print_exc()
+        raise
+
+# Expresión SQL que convierte Fecha (DD/MM/YYYY) y Hora (HH:MM) en segundos de la
+# hora civil local, tratada como UTC para que cada hora del calendario sea única
+SQL_TIMESTAMP_CONSUMO = """
+    CAST(strftime('%s', substr({p}Fecha, 7, 4) || '-' || substr({p}Fecha, 4, 2) || '-' ||
+                        substr({p}Fecha, 1, 2) || ' ' || {p}Hora) AS INTEGER)
+"""
+
+def migrar_timestamp_consumos(session):
+    """
+    Añade a consumos una columna timestamp entera e indexada, la rellena a partir
+    de Fecha/Hora y crea un trigger para mantenerla en las nuevas inserciones
+    """
+    try:
+        columnas = [col[1] for col in session.execute(text("PRAGMA table_info(consumos)")).fetchall()]
+        if not columnas:
+            return
+        
+        if 'timestamp' not in columnas:
+            session.execute(text("ALTER TABLE consumos ADD COLUMN timestamp INTEGER"))
+            print("Campo añadido a consumos: timestamp")
+        
+        session.execute(text(f"""
+            UPDATE consumos SET timestamp = {SQL_TIMESTAMP_CONSUMO.format(p='')}
+            WHERE timestamp IS NULL
+        """))
+        session.execute(text("CREATE INDEX IF NOT EXISTS idx_consumos_timestamp ON consumos(timestamp)"))
+        session.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_consumos_timestamp
+            AFTER INSERT ON consumos
+            WHEN NEW.timestamp IS NULL
+            BEGIN
+                UPDATE consumos SET timestamp = {SQL_TIMESTAMP_CONSUMO.format(p='NEW.')}
+                WHERE id = NEW.id;
+            END
+        """))
+    except Exception as e:
+        print(f"Error en migrar_timestamp_consumos: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def migrar_puntos_suministro(session):
+    """
+    Añade a consumos la columna cups (punto de suministro) y un índice
+    (cups, timestamp). La curva existente queda como el CUPS vacío.
+    """
+    try:
+        columnas = [col[1] for col in session.execute(text("PRAGMA table_info(consumos)")).fetchall()]
+        if not columnas:
+            return
+        
+        if 'cups' not in columnas:
+            session.execute(text("ALTER TABLE consumos ADD COLUMN cups TEXT NOT NULL DEFAULT ''"))
+            print("Campo añadido a consumos: cups")
+        
+        session.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_consumos_cups_timestamp ON consumos(cups, timestamp)"
+        ))
+    except Exception as e:
+        print(f"Error en migrar_puntos_suministro: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def crear_triggers_version(session, tablas):
+    """
+    Crea (si no existe) la tabla versiones_tablas y los triggers que incrementan
+    la versión de cada tabla indicada en cualquier INSERT, UPDATE o DELETE
+    """
+    session.execute(text("""
+        CREATE TABLE IF NOT EXISTS versiones_tablas (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """))
+    for tabla in tablas:
+        session.execute(
+            text("INSERT OR IGNORE INTO versiones_tablas (tabla, version) VALUES (:tabla, 0)"),
+            {"tabla": tabla}
+        )
+        for operacion in ('INSERT', 'UPDATE', 'DELETE'):
+            session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{operacion.lower()}
+                AFTER {operacion} ON {tabla}
+                BEGIN
+                    UPDATE versiones_tablas SET version = version + 1 WHERE tabla = '{tabla}';
+                END
+            """))
+
+def suspender_triggers_version(session, tabla):
+    """
+    Para escrituras masivas: incrementa una sola vez la versión de la tabla y
+    elimina sus triggers de versión, que si no la incrementarían en cada fila.
+    Todo ocurre dentro de la transacción en curso (el UPDATE la abre antes del
+    DROP), así que los demás procesos no ven la tabla sin triggers y un
+    rollback los restaura. Antes del commit hay que volver a crearlos con
+    crear_triggers_version.
+    """
+    session.execute(
+        text("UPDATE versiones_tablas SET version = version + 1 WHERE tabla = :tabla"), {"tabla": tabla}
+    )
+    for operacion in ('insert', 'update', 'delete'):
+        session.execute(text(f"DROP TRIGGER IF EXISTS trg_version_{tabla}_{operacion}"))
+
+def migrar_versiones_tarifas(session):
+    """
+    Crea la tabla versiones_tablas y los triggers que incrementan la versión de
+    cada tabla de tarifas en cualquier cambio, de modo que las cachés de
+    consultas sepan cuándo han quedado obsoletas
+    """
+    try:
+        crear_triggers_version(session, ('tarifas_electricas', 'tarifas_gas'))
+    except Exception as e:
+        print(f"Error en migrar_versiones_tarifas: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def migrar_versiones_curva(session):
+    """
+    Versiona también las tablas de las que depende la energía por periodo de la
+    curva (consumos, discriminacion_horaria y dias_festivos), para poder
+    reutilizarla entre rankings mientras no cambien
+    """
+    try:
+        crear_triggers_version(session, ('consumos', 'discriminacion_horaria', 'dias_festivos'))
+    except Exception as e:
+        print(f"Error en migrar_versiones_curva: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def migrar_ingesta_consumos(session):
+    """
+    Prepara consumos para la ingesta de CSV de distribuidoras: recupera la
+    columna AI_kVArh y hace único el índice (cups, timestamp). Si había horas
+    repetidas se suman en la primera fila y se eliminan las demás.
+    """
+    try:
+        columnas = [col[1] for col in session.execute(text("PRAGMA table_info(consumos)")).fetchall()]
+        if not columnas:
+            return
+        
+        if 'AI_kVArh' not in columnas:
+            session.execute(text("ALTER TABLE consumos ADD COLUMN AI_kVArh REAL"))
+            print("Campo añadido a consumos: AI_kVArh")
+        
+        duplicadas = session.execute(text("""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM consumos WHERE timestamp IS NOT NULL
+                GROUP BY cups, timestamp HAVING COUNT(*) > 1
+            )
+        """)).scalar()
+        if duplicadas:
+            session.execute(text("""
+                UPDATE consumos SET
+                    AE_kWh = (SELECT SUM(c.AE_kWh) FROM consumos c
+                              WHERE c.cups = consumos.cups AND c.timestamp = consumos.timestamp),
+                    AI_kVArh = (SELECT SUM(c.AI_kVArh) FROM consumos c
+                                WHERE c.cups = consumos.cups AND c.timestamp = consumos.timestamp)
+                WHERE id IN (
+                    SELECT MIN(id) FROM consumos WHERE timestamp IS NOT NULL
+                    GROUP BY cups, timestamp HAVING COUNT(*) > 1
+                )
+            """))
+            session.execute(text("""
+                DELETE FROM consumos WHERE timestamp IS NOT NULL AND id NOT IN (
+                    SELECT MIN(id) FROM consumos WHERE timestamp IS NOT NULL GROUP BY cups, timestamp
+                )
+            """))
+            print(f"Horas repetidas agrupadas en consumos: {duplicadas}")
+        
+        session.execute(text("DROP INDEX IF EXISTS idx_consumos_cups_timestamp"))
+        session.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_consumos_cups_timestamp ON consumos(cups, timestamp)"
+        ))
+    except Exception as e:
+        print(f"Error en migrar_ingesta_consumos: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def migrar_tarifas_indexadas(session):
+    """
+    Crea la tabla de series horarias de precios (precios_horarios, versionada)
+    y añade a tarifas_electricas la serie de precios y el margen de las
+    tarifas indexadas
+    """
+    try:
+        session.execute(text("""
+            CREATE TABLE IF NOT EXISTS precios_horarios (
+                serie TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                precio REAL NOT NULL,
+                PRIMARY KEY (serie, timestamp)
+            ) WITHOUT ROWID
+        """))
+        crear_triggers_version(session, ('precios_horarios',))
+        
+        columnas = [col[1] for col in session.execute(text("PRAGMA table_info(tarifas_electricas)")).fetchall()]
+        if not columnas:
+            return
+        
+        campos = {
+            'serie_precios': "TEXT DEFAULT ''",
+            'margen_indexado': 'REAL DEFAULT 0.0',
+        }
+        for campo, tipo in campos.items():
+            if campo not in columnas:
+                session.execute(text(f"ALTER TABLE tarifas_electricas ADD COLUMN {campo} {tipo}"))
+                print(f"Campo añadido a tarifas_electricas: {campo}")
+    except Exception as e:
+        print(f"Error en migrar_tarifas_indexadas: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+def migrar_identidad_bd(session):
+    """
+    Crea la tabla identidad_bd con un uuid propio de la base de datos, que
+    forma parte de las claves de las cachés en disco (resultados y precios)
+    para que dos bases con las mismas versiones de tablas no las compartan
+    """
+    try:
+        session.execute(text("""
+            CREATE TABLE IF NOT EXISTS identidad_bd (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                uuid TEXT NOT NULL
+            )
+        """))
+        session.execute(
+            text("INSERT OR IGNORE INTO identidad_bd (id, uuid) VALUES (1, :uuid)"),
+            {"uuid": uuid.uuid4().hex}
+        )
+    except Exception as e:
+        print(f"Error en migrar_identidad_bd: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+# Migraciones del esquema, en orden. El número es la versión que deja la BD
+# (PRAGMA user_version); cada una se aplica una sola vez por base de datos.
+MIGRACIONES = [
+    # 1. Verificar tabla días festivos
+    (1, verificar_tabla_dias_festivos),
+    # 2. Migrar datos de termino_energia si es necesario
+    (2, migrar_datos_termino_energia),
+    # 3. Añadir timestamp indexado a la curva de consumos
+    (3, migrar_timestamp_consumos),
+    # 4. Añadir la dimensión de punto de suministro (CUPS) a consumos
+    (4, migrar_puntos_suministro),
+    # 5. Contadores de versión de las tablas de tarifas (invalidan las cachés)
+    (5, migrar_versiones_tarifas),
+    # 6. AI_kVArh e índice único (cups, timestamp) para la ingesta de CSV
+    (6, migrar_ingesta_consumos),
+    # 7. Contadores de versión de la curva y del calendario de periodos
+    (7, migrar_versiones_curva),
+    # 8. Series horarias de precios y tarifas indexadas
+    (8, migrar_tarifas_indexadas),
+    # 9. Identidad (uuid) de la base de datos para las claves de las cachés en disco
+    (9, migrar_identidad_bd),
+]
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
 
 def corregir_tabla_festivos(session):
     """Corrige la estructura de la tabla de días festivos"""